@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+
+
+class PoolTimeoutError(pymysql.MySQLError):
+    """
+    Raised when no connection became available within the checkout timeout.
+    Derives from MySQLError so callers handle it like any other database error.
+    """
+
+
+class MySqlConnectionPool:
+    """
+    Bounded pool of pymysql connections.
+    Connections are created lazily up to max_size; idle connections are health checked
+    (ping with reconnect) before being handed out, broken connections are discarded.
+    """
+
+    DEFAULT_MAX_SIZE = 10
+    DEFAULT_CHECKOUT_TIMEOUT = 10  # seconds
+    DEFAULT_HEALTH_CHECK_INTERVAL = 30  # seconds a connection may stay idle before it is pinged
+
+    def __init__(self, connect_args: dict, max_size: int = DEFAULT_MAX_SIZE,
+                 checkout_timeout: float = DEFAULT_CHECKOUT_TIMEOUT,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL):
+        self.connect_args = connect_args
+        self.max_size = max(1, max_size)
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        self.idle = deque()  # (connection, last_used) pairs, most recently used at the right
+        self.size = 0  # connections currently owned by the pool (idle + checked out)
+        self.condition = threading.Condition()
+
+        # metrics
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.reconnects = 0
+        self.total_wait_ms = 0
+        self.max_wait_ms = 0
+
+    def _create(self):
+        connection = pymysql.connect(**self.connect_args)
+        self.created += 1
+        return connection
+
+    def checkout(self):
+        """
+        Take a connection from the pool, creating one if the pool is not full yet.
+        Blocks up to checkout_timeout seconds when all connections are in use.
+        """
+        start = time.perf_counter()
+        deadline = start + self.checkout_timeout
+        connection, last_used = None, None
+        with self.condition:
+            waited = False
+            while True:
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(f"No database connection available after {self.checkout_timeout}s")
+                waited = True
+                self.condition.wait(remaining)
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            wait_ms = (time.perf_counter() - start) * 1000
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+        try:
+            if connection is None:
+                connection = self._create()
+            elif time.monotonic() - last_used > self.health_check_interval:
+                thread_id = connection.thread_id()
+                connection.ping(reconnect=True)
+                if connection.thread_id() != thread_id:
+                    self.reconnects += 1
+        except Exception:
+            if connection is not None:
+                self._close_quietly(connection)
+            self._release_slot()
+            raise
+        return connection
+
+    def checkin(self, connection):
+        """
+        Return a healthy connection to the pool.
+        """
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        """
+        Drop a connection that failed, freeing its slot for a new one.
+        """
+        self._close_quietly(connection)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.discarded += 1
+            self.condition.notify()
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager handing out a pooled connection; connections that raised
+        connection level errors are discarded instead of being returned to the pool.
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except (pymysql.OperationalError, pymysql.InterfaceError):
+            self.discard(connection)
+            raise
+        except BaseException:
+            self.checkin(connection)
+            raise
+        else:
+            self.checkin(connection)
+
+    def get_metrics(self):
+        with self.condition:
+            return dict(
+                size=self.size,
+                max_size=self.max_size,
+                idle=len(self.idle),
+                in_use=self.size - len(self.idle),
+                checkouts=self.checkouts,
+                waits=self.waits,
+                timeouts=self.timeouts,
+                created=self.created,
+                discarded=self.discarded,
+                reconnects=self.reconnects,
+                avg_wait_ms=self.total_wait_ms / self.checkouts if self.checkouts else 0,
+                max_wait_ms=self.max_wait_ms,
+            )
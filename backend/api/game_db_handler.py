@@ -1,15 +1,30 @@
+import os
 import uuid
 import json
 
 from backend.api.generic_data_provider import GenericDataProvider
 from backend.api.generic_validator import validate_record_for_mandatory_fields
+from backend.api.ttl_cache import TtlCache
 
 
 
 
 class GameDataProvider:    
+
+    DEFAULT_MISSING_GAMES_CACHE_SIZE = 10000
+    DEFAULT_MISSING_GAMES_TTL = 10  # seconds
+    STORED_QUESTIONS_CACHE_SIZE = 10000
+    STORED_QUESTIONS_TTL = 3600  # seconds; a forgotten count only makes the next save rewrite the rows of the game
+
     def __init__(self, data_provider:GenericDataProvider):
         self.data_provider = data_provider
+        # game IDs / tokens recently not found in the storage, so repeated lookups of unknown games don't hit the DB
+        self.missing_games = TtlCache(
+            max_size=int(os.getenv("SI_MISSING_GAMES_CACHE_SIZE", GameDataProvider.DEFAULT_MISSING_GAMES_CACHE_SIZE)),
+            ttl=float(os.getenv("SI_MISSING_GAMES_TTL", GameDataProvider.DEFAULT_MISSING_GAMES_TTL)),
+        )
+        # game ID -> number of game_stats entries already written to game_questions by this process
+        self.stored_questions = TtlCache(GameDataProvider.STORED_QUESTIONS_CACHE_SIZE, GameDataProvider.STORED_QUESTIONS_TTL)
 
     def get_list_of_tournaments_by_user(self, user_id:str):
         """
@@ -55,6 +70,8 @@ class GameDataProvider:
     def set_game_data(self, user_id:str, game_id:str, tournament_id:str, game_data:dict, transient:bool=False):
         """
         Set the game data for the given game ID.
+        Entries of game_stats are stored as rows of game_questions (only the ones not written yet),
+        the games row keeps the rest of the status and the number of entries.
         Returns the ID of the upserted game.
         """
         if not game_data:
@@ -69,9 +86,12 @@ class GameDataProvider:
                     if key not in game_data:
                         game_data[key] = existing_game[key]
 
+        if not game_id:
+            game_id = str(uuid.uuid4())
+
         data = game_data.get("data", {})
         if isinstance(data, dict):
-            data = json.dumps(data)
+            data = json.dumps(self._store_questions(game_id, tournament_id, data, transient))
         elif not isinstance(data, str):
             raise ValueError("Game data must be a string or a dictionary")
         
@@ -85,32 +105,102 @@ class GameDataProvider:
 
         }
         game_id = self.data_provider.upsert_one("games", game_id, record, use_transient=transient)
+        self.invalidate_missing_game(game_id, record["token"])
         updated_game = self.data_provider.lookup_one_by_id("games", game_id)
         return updated_game
     
 
 
+    def _store_questions(self, game_id:str, tournament_id:str, data:dict, transient:bool):
+        """
+        Append the game_stats entries of the status that are not stored yet to game_questions.
+        Returns the data without game_stats (with game_stats_count instead).
+        If a row can't be written, game_stats_count covers only the stored rows; the rest is written with the next save.
+        """
+        status = data.get("status")
+        if not isinstance(status, dict) or status.get("game_stats") is None:
+            return data
+        game_stats = status["game_stats"]
+        stored = self.stored_questions.get(game_id)
+        stored = stored if stored is not TtlCache.MISSING and stored <= len(game_stats) else 0
+        for position in range(stored, len(game_stats)):
+            entry = game_stats[position]
+            record = {
+                "game_id": game_id,
+                "tournament_id": tournament_id or "",
+                "position": position,
+                "question_number": entry.get("question_number", position),
+                "nominal": entry.get("nominal", 0),
+                "player_stats": json.dumps(entry.get("player_stats")),
+            }
+            # the ID is derived from the position, so writing a row again only overwrites it
+            if self.data_provider.upsert_one("game_questions", f"{game_id}_{position}", record, use_transient=transient) is None:
+                break
+            stored = position + 1
+        self.stored_questions.put(game_id, stored)
+
+        header = {key: value for key, value in status.items() if key != "game_stats"}
+        header["game_stats_count"] = stored
+        return dict(data, status=header)
+
+    def _assemble_game_stats(self, game:dict, question_rows:list):
+        """
+        Put the game_stats stored in game_questions rows back into the status of the parsed game data.
+        Data saved before game_questions existed keeps game_stats in the status and is returned as is.
+        """
+        status = game["data"].get("status") if isinstance(game["data"], dict) else None
+        if not isinstance(status, dict) or "game_stats_count" not in status:
+            return
+        count = status.pop("game_stats_count")
+        entries = [None] * count
+        for row in question_rows:
+            position = row["position"]
+            if position < count:
+                player_stats = row["player_stats"]
+                entries[position] = {
+                    "question_number": row["question_number"],
+                    "player_stats": json.loads(player_stats) if isinstance(player_stats, str) else player_stats,
+                    "nominal": row["nominal"],
+                }
+        status["game_stats"] = [entry for entry in entries if entry is not None]
+
     def get_game_data(self, game_id:str):
         """
-        Fetch the game data for the given game ID.
+        Fetch the game data for the given game ID or token (one lookup by either).
+        IDs not found are remembered for a short time, so they don't reach the DB again until a game is created.
         Returns the game data as a dictionary.
         """
         if not game_id:
             return None
-        game = self.data_provider.lookup_one_by_id("games", game_id)
-        if not game:
-             game = self.data_provider.lookup_one_by_field("games", "token", game_id)
+        if self.missing_games.get(game_id) is not TtlCache.MISSING:
+            return None
+        game = self.data_provider.lookup_one_by_id_or_field("games", "token", game_id)
         if not game:
+            self.missing_games.put(game_id, True)
             return None
+        game = dict(game)  # in-memory storages return their own record
         game_data = game.get("data", {})
         if isinstance(game_data, str):
             game_data = json.loads(game_data)
             game["data"] = game_data
         game["game_id"] = game["id"]
+        self._assemble_game_stats(game, self.data_provider.lookup_many_by_field("game_questions", "game_id", game["id"]))
         return game
     
 
     
+    def invalidate_missing_game(self, *keys):
+        """
+        Forget that the given game IDs / tokens were not found (called when a game is created or saved).
+        """
+        self.missing_games.invalidate(*keys)
+
+    def get_metrics(self):
+        """
+        Return counters of the cache of missing games.
+        """
+        return dict(missing_games=self.missing_games.get_metrics())
+
     def get_tournament_data(self, tournament_id:str):
         """
         Fetch the tournament data for the given tournament ID.
@@ -122,7 +212,16 @@ class GameDataProvider:
         if not tournament:
             return {}
         games = self.data_provider.lookup_many_by_field("games", "tournament_id", tournament_id)
-
+        # question rows of all games in one lookup
+        question_rows = dict()
+        for row in self.data_provider.lookup_many_by_field("game_questions", "tournament_id", tournament_id):
+            question_rows.setdefault(row["game_id"], []).append(row)
+        games = [dict(game) for game in games]
+        for game in games:
+            if isinstance(game.get("data"), str):
+                game["data"] = json.loads(game["data"])
+            game["game_id"] = game["id"]
+            self._assemble_game_stats(game, question_rows.get(game["id"], []))
 
         return {
             "tournament": tournament,
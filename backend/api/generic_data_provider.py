@@ -7,16 +7,30 @@ import pymysql
 import threading
 
 
+from backend.api.connection_pool import MySqlConnectionPool
+from backend.api.json_journal import JsonJournal
+from backend.api.storage_index import IndexedStorage
 from backend.app.util.util import ArgConfig
 
 
 
+# secondary indexes maintained by the in-memory storages: entity -> {field -> unique}
+STORAGE_INDEXES = {
+    "users": {"token": True, "email": False},
+    "players": {"player_token": False, "game_id": False},
+    "games": {"token": False, "tournament_id": False},
+    "tournaments": {"host_user_id": False},
+    "game_questions": {"game_id": False, "tournament_id": False},
+}
+
 
 class GenericDataProvider:
     def __init__(self):
         db_config = os.getenv("SI_DB_CONFIG")
-        self.transient = {}
-        self.lock = threading.Lock()
+        self.transient = IndexedStorage(STORAGE_INDEXES)
+        self.entity_locks = {}  # map of [entity -> lock guarding its transient storage]
+        self.pool = None  # MySQL connection pool
+        self.journal = None  # Append-only journal backing data.json
 
         
 
@@ -29,21 +43,27 @@ class GenericDataProvider:
             host, database = host_database.split("/")
          
 
-            self.connection = pymysql.connect(
-                host=host,
-                user=user,
-                password=password,
-                database=database,
-                charset="utf8mb4",
-                autocommit = True,
-                cursorclass=pymysql.cursors.DictCursor  # Ensures results are returned as dictionaries
+            self.pool = MySqlConnectionPool(
+                dict(
+                    host=host,
+                    user=user,
+                    password=password,
+                    database=database,
+                    charset="utf8mb4",
+                    autocommit = True,
+                    cursorclass=pymysql.cursors.DictCursor  # Ensures results are returned as dictionaries
+                ),
+                max_size=int(os.getenv("SI_DB_POOL_SIZE", MySqlConnectionPool.DEFAULT_MAX_SIZE)),
+                checkout_timeout=float(os.getenv("SI_DB_POOL_TIMEOUT", MySqlConnectionPool.DEFAULT_CHECKOUT_TIMEOUT)),
+                health_check_interval=float(os.getenv("SI_DB_HEALTH_CHECK_INTERVAL", MySqlConnectionPool.DEFAULT_HEALTH_CHECK_INTERVAL)),
             )
             self.lookup_one_by_id = self.lookup_one_by_id_sql
             self.lookup_one_by_field = self.lookup_one_by_field_sql
+            self.lookup_one_by_id_or_field = self.lookup_one_by_id_or_field_sql
             self.lookup_many_by_field = self.lookup_many_by_field_sql
             self.upsert_one = self.upsert_one_sql
         else:
-            self.data = {}  # In-memory storage for JSON data
+            self.data = IndexedStorage(STORAGE_INDEXES)  # In-memory storage for JSON data
 
             self.use_predefined_json = False  # Flag to indicate if predefined JSON data should be used
 
@@ -54,14 +74,19 @@ class GenericDataProvider:
                 (isinstance(env_use_predefined_json, bool) and env_use_predefined_json) or
                 (isinstance(env_use_predefined_json, str) and env_use_predefined_json.lower() == "true")):
                 self.use_predefined_json = True
-                # Load predefined JSON data from a file if the file exists
-                if os.path.exists("data.json"):
-                    with open("data.json", "r") as f:
-                        self.data = json.load(f)
+                # Load predefined JSON data (data.json snapshot plus journal of later upserts)
+                self.journal = JsonJournal(
+                    "data.json",
+                    fsync_mode=os.getenv("SI_JSON_FSYNC", JsonJournal.FSYNC_INTERVAL).lower(),
+                    compact_every=int(os.getenv("SI_JSON_COMPACT_EVERY", JsonJournal.DEFAULT_COMPACT_EVERY)),
+                )
+                self.journal.load(self.data)
+                self.data.rebuild_indexes()
 
 
             self.lookup_one_by_id = self.lookup_one_by_id_json
             self.lookup_one_by_field = self.lookup_one_by_field_json
+            self.lookup_one_by_id_or_field = self.lookup_one_by_id_or_field_json
             self.lookup_many_by_field = self.lookup_many_by_field_json
             self.upsert_one = self.upsert_one_json
 
@@ -69,82 +94,113 @@ class GenericDataProvider:
 
 
 
+    def entity_lock(self, entity: str) -> threading.Lock:
+        """
+        Return the lock guarding the transient storage of the given entity.
+        Database calls don't need it: each one runs on its own pooled connection.
+        """
+        lock = self.entity_locks.get(entity)
+        if lock is None:
+            lock = self.entity_locks.setdefault(entity, threading.Lock())
+        return lock
+
     def lookup_one_by_id_sql(self, entity: str, id: str):
         """
         Fetch a single record from the specified entity (table) where the ID matches the given value.
         Returns the record as a dictionary of key-value pairs.
         """
-        with self.lock:
-            try:
+        try:
+            with self.entity_lock(entity):
                 transient_result = self.storage_lookup_one_by_id(self.transient, entity, id)
-                if transient_result is not None:
-                    return transient_result
-                
-                if not hasattr(self, 'connection') or self.connection is None:
-                    raise Exception("Database connection is not initialized.")
-
-                with self.connection.cursor() as cursor:
-                    # self.connection.ping(reconnect=True)
-                    query = f"SELECT * FROM {entity} WHERE id = %s"
-                    cursor.execute(query, (id,))
-                    result = cursor.fetchone()
-                return result
-            except pymysql.MySQLError as err:
-                print(f"Error: {err}")
-                return None
+            if transient_result is not None:
+                return transient_result
+            
+            if self.pool is None:
+                raise Exception("Database connection is not initialized.")
+
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                query = f"SELECT * FROM {entity} WHERE id = %s"
+                cursor.execute(query, (id,))
+                result = cursor.fetchone()
+            return result
+        except pymysql.MySQLError as err:
+            print(f"Error: {err}")
+            return None
 
     def lookup_one_by_field_sql(self, entity: str, field: str, value: str):
         """
         Fetch a single record from the specified entity (table) where the field matches the given value.
         Returns the record as a dictionary of key-value pairs.
         """
-        with self.lock:
-            try:
+        try:
+            with self.entity_lock(entity):
                 transient_result = self.storage_lookup_one_by_field(self.transient, entity, field, value)
-                if transient_result is not None:
-                    return transient_result
-                
-                if not hasattr(self, 'connection') or self.connection is None:
-                    raise Exception("Database connection is not initialized.")
-
-                with self.connection.cursor() as cursor:
-                    # self.connection.ping(reconnect=True)
-                    query = f"SELECT * FROM {entity} WHERE {field} = %s"
-                    cursor.execute(query, (value,))
-                    result = cursor.fetchone()
-                return result
-            except pymysql.MySQLError as err:
-                print(f"Error: {err}")
-                return None
+            if transient_result is not None:
+                return transient_result
+            
+            if self.pool is None:
+                raise Exception("Database connection is not initialized.")
+
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                query = f"SELECT * FROM {entity} WHERE {field} = %s"
+                cursor.execute(query, (value,))
+                result = cursor.fetchone()
+            return result
+        except pymysql.MySQLError as err:
+            print(f"Error: {err}")
+            return None
+
+    def lookup_one_by_id_or_field_sql(self, entity: str, field: str, value: str):
+        """
+        Fetch a single record from the specified entity (table) where the ID or the field matches the given value,
+        in one query. A record matching by ID takes precedence.
+        Returns the record as a dictionary of key-value pairs.
+        """
+        try:
+            with self.entity_lock(entity):
+                transient_result = self.storage_lookup_one_by_id(self.transient, entity, value) or \
+                    self.storage_lookup_one_by_field(self.transient, entity, field, value)
+            if transient_result is not None:
+                return transient_result
+
+            if self.pool is None:
+                raise Exception("Database connection is not initialized.")
+
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                query = f"SELECT * FROM {entity} WHERE id = %s OR {field} = %s LIMIT 2"
+                cursor.execute(query, (value, value))
+                results = cursor.fetchall()
+            for result in results:
+                if result["id"] == value:
+                    return result
+            return results[0] if results else None
+        except pymysql.MySQLError as err:
+            print(f"Error: {err}")
+            return None
 
     def lookup_many_by_field_sql(self, entity: str, field: str, value: str):
         """
         Fetch multiple records from the specified entity (table) where the field matches the given value.
         Returns the records as a list of dictionaries.
         """
-        with self.lock:
-            try:
-            
+        try:
+            if self.pool is None:
+                raise Exception("Database connection is not initialized.")
 
-                if not hasattr(self, 'connection') or self.connection is None:
-                    raise Exception("Database connection is not initialized.")
-                
-                
-
-                with self.connection.cursor() as cursor:
-                    # self.connection.ping(reconnect=True)
-                    query = f"SELECT * FROM {entity} WHERE {field} = %s"
-                    cursor.execute(query, (value,))
-                    results = cursor.fetchall()
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                query = f"SELECT * FROM {entity} WHERE {field} = %s"
+                cursor.execute(query, (value,))
+                results = list(cursor.fetchall())
 
+            with self.entity_lock(entity):
                 transient_result = self.storage_lookup_many_by_field(self.transient, entity, field, value)
-                if transient_result is not None:
-                    results.extend(transient_result)
-                
-                return results
-            except pymysql.MySQLError as err:
-                print(f"Error: {err}")
-                return []
+            if transient_result is not None:
+                results.extend(transient_result)
+            
+            return results
+        except pymysql.MySQLError as err:
+            print(f"Error: {err}")
+            return []
 
     def upsert_one_sql(self, entity: str, id: str, data: dict, use_transient: bool = False):
         """
@@ -153,37 +209,46 @@ class GenericDataProvider:
         If the ID is None or an empty string, a new unique ID is generated.
         Returns the ID of the upserted record.
         """
-        with self.lock:
-            try:
+        try:
 
-                if use_transient:
-                    # Use the transient storage for upsert
+            if use_transient:
+                # Use the transient storage for upsert
+                with self.entity_lock(entity):
                     return self.storage_upsert_one(self.transient, entity, id, data)
-                
-                if not hasattr(self, 'connection') or self.connection is None:
-                    raise Exception("Database connection is not initialized.")
-
-                if not id:
-                    id = str(uuid.uuid4())
-
-                with self.connection.cursor() as cursor:
-                    # self.connection.ping(reconnect=True)
-                    columns = ", ".join(data.keys())
-                    placeholders = ", ".join(["%s"] * len(data))
-                    update_clause = ", ".join([f"{key} = %s" for key in data.keys()])
-
-                    query = f"""
-                        INSERT INTO {entity} (id, {columns})
-                        VALUES (%s, {placeholders})
-                        ON DUPLICATE KEY UPDATE {update_clause}
-                    """
-                    values = (id, *data.values(), *data.values())
-                    cursor.execute(query, values)
-                    self.connection.commit()
-                return id
-            except pymysql.MySQLError as err:
-                print(f"Error: {err}")
-                return None
+            
+            if self.pool is None:
+                raise Exception("Database connection is not initialized.")
+
+            if not id:
+                id = str(uuid.uuid4())
+
+            with self.pool.connection() as connection, connection.cursor() as cursor:
+                columns = ", ".join(data.keys())
+                placeholders = ", ".join(["%s"] * len(data))
+                update_clause = ", ".join([f"{key} = %s" for key in data.keys()])
+
+                query = f"""
+                    INSERT INTO {entity} (id, {columns})
+                    VALUES (%s, {placeholders})
+                    ON DUPLICATE KEY UPDATE {update_clause}
+                """
+                values = (id, *data.values(), *data.values())
+                cursor.execute(query, values)
+                connection.commit()
+            return id
+        except pymysql.MySQLError as err:
+            print(f"Error: {err}")
+            return None
+
+    def get_metrics(self):
+        """
+        Return storage level counters (connection pool for MySQL, journal for the JSON backend).
+        """
+        if self.pool is not None:
+            return dict(pool=self.pool.get_metrics())
+        if self.journal is not None:
+            return dict(journal=self.journal.get_metrics())
+        return {}
         
 
     def storage_lookup_one_by_id(self, storage:dict, entity: str, id: str):
@@ -198,10 +263,15 @@ class GenericDataProvider:
     def storage_lookup_one_by_field(self, storage:dict, entity: str, field: str, value: str):
         """
         Fetch a single record from the in-memory JSON data where the field matches the given value.
+        Uses the secondary index of (entity, field) when one is declared, otherwise scans the records.
         Returns the record as a dictionary of key-value pairs.
         """
         if entity not in storage:
             return None
+        index = storage.get_index(entity, field) if isinstance(storage, IndexedStorage) else None
+        if index is not None:
+            id = index.first(value)
+            return storage[entity].get(id) if id is not None else None
         for record in storage[entity].values():
             if record.get(field) == value:
                 return record
@@ -210,16 +280,22 @@ class GenericDataProvider:
     def storage_lookup_many_by_field(self, storage:dict, entity: str, field: str, value: str):
         """
         Fetch multiple records from the in-memory JSON data where the field matches the given value.
+        Uses the secondary index of (entity, field) when one is declared, otherwise scans the records.
         Returns the records as a list of dictionaries.
         """
         if entity not in storage:
             return []
+        index = storage.get_index(entity, field) if isinstance(storage, IndexedStorage) else None
+        if index is not None:
+            records = storage[entity]
+            return [records[id] for id in index.ids(value)]
         return [record for record in storage[entity].values() if record.get(field) == value]
 
     def storage_upsert_one(self, storage:dict, entity: str, id: str, data: dict):
         """
         Insert or update a record in the in-memory JSON data based on the fields in the data dictionary.
         If the ID is None or an empty string, a new unique ID is generated.
+        Secondary indexes of the storage are updated; ValueError is raised if a unique index would be violated.
         Returns the ID of the upserted record.
         """
         if entity not in storage:
@@ -228,11 +304,17 @@ class GenericDataProvider:
         # Generate a unique ID if the provided ID is None or empty
         if not id:
             id = str(uuid.uuid4())
+
+        indexed = isinstance(storage, IndexedStorage)
+        if indexed:
+            storage.check_unique(entity, id, data)
         
         data["id"] = id
 
         # Insert or update the record
         storage[entity][id] = data
+        if indexed:
+            storage.index_record(entity, id, data)
 
         return id
 
@@ -257,12 +339,20 @@ class GenericDataProvider:
             return transient_result
         return self.storage_lookup_one_by_field(self.data, entity, field, value)
 
+    def lookup_one_by_id_or_field_json(self, entity: str, field: str, value: str):
+        """
+        Fetch a single record from the in-memory JSON data where the ID or the field matches the given value.
+        A record matching by ID takes precedence.
+        Returns the record as a dictionary of key-value pairs.
+        """
+        return self.lookup_one_by_id_json(entity, value) or self.lookup_one_by_field_json(entity, field, value)
+
     def lookup_many_by_field_json(self, entity: str, field: str, value: str):
         """
         Fetch multiple records from the in-memory JSON data where the field matches the given value.
         Returns the records as a list of dictionaries.
         """
-        transient_result = self.storage_lookup_many_by_field(self.transient, field, value)
+        transient_result = self.storage_lookup_many_by_field(self.transient, entity, field, value)
         data_result = self.storage_lookup_many_by_field(self.data, entity, field, value)
         if transient_result is not None:
             data_result.extend(transient_result)
@@ -279,12 +369,12 @@ class GenericDataProvider:
             return self.storage_upsert_one(self.transient, entity, id, data)
             
         
-        id = self.storage_upsert_one(self.data, entity, id, data)
+        with self.entity_lock(entity):
+            id = self.storage_upsert_one(self.data, entity, id, data)
 
-        if self.use_predefined_json:
-            # Save the updated data to the file
-            with open("data.json", "w") as f:
-                json.dump(self.data, f, indent=4)
+            if self.journal is not None:
+                # Append only the changed record; the journal is compacted into data.json in background
+                self.journal.append(entity, id, data)
 
         return id
 
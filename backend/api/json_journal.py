@@ -0,0 +1,184 @@
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class JsonJournal:
+    """
+    Append-only persistence for the JSON storage backend.
+    Every upsert appends one line ({"entity", "id", "data"}) to the journal file, a background thread
+    periodically compacts the journal into the snapshot file (data.json).
+    On startup the state is rebuilt from the snapshot followed by the journal.
+    """
+
+    FSYNC_ALWAYS = "always"      # fsync after every appended record
+    FSYNC_INTERVAL = "interval"  # fsync from the background thread every fsync_interval seconds
+    FSYNC_NEVER = "never"        # leave flushing to the OS
+
+    DEFAULT_COMPACT_EVERY = 1000  # journal records that trigger compaction into the snapshot
+    DEFAULT_FSYNC_INTERVAL = 1  # seconds
+
+    def __init__(self, snapshot_path: str = "data.json", fsync_mode: str = FSYNC_INTERVAL,
+                 compact_every: int = DEFAULT_COMPACT_EVERY, fsync_interval: float = DEFAULT_FSYNC_INTERVAL):
+        if fsync_mode not in (JsonJournal.FSYNC_ALWAYS, JsonJournal.FSYNC_INTERVAL, JsonJournal.FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync mode: {fsync_mode}")
+        self.snapshot_path = snapshot_path
+        self.journal_path = os.path.splitext(snapshot_path)[0] + ".journal"
+        # journal being folded into the snapshot; only exists while (or if interrupted during) compaction
+        self.compacting_path = self.journal_path + ".compacting"
+        self.fsync_mode = fsync_mode
+        self.compact_every = max(1, compact_every)
+        self.fsync_interval = fsync_interval
+
+        self.data = None
+        self.file = None
+        self.lock = threading.Lock()  # guards the journal file handle
+        self.compact_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.unsynced = False
+        self.running = False
+
+        # metrics
+        self.journal_records = 0  # records in the current journal file
+        self.appended = 0
+        self.appended_bytes = 0
+        self.fsyncs = 0
+        self.compactions = 0
+        self.last_compaction_ms = 0
+        self.replayed = 0
+
+    def load(self, data: dict = None) -> dict:
+        """
+        Rebuild storage from the snapshot and the journal(s) into the given dictionary, then start appending.
+        Returns the storage dictionary that subsequent append calls describe.
+        """
+        if data is None:
+            data = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                data.update(json.load(f))
+        for path in (self.compacting_path, self.journal_path):
+            self.replayed += self._replay(path, data)
+        self.journal_records = self.replayed
+        self.data = data
+        self.file = open(self.journal_path, "a", encoding="utf-8")
+        self.running = True
+        threading.Thread(target=self._run, name="json-journal", daemon=True).start()
+        atexit.register(self.close)
+        return data
+
+    @staticmethod
+    def _replay(path: str, data: dict) -> int:
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the journal: everything before it is intact
+                    break
+                data.setdefault(entry["entity"], {})[entry["id"]] = entry["data"]
+                count += 1
+        return count
+
+    def append(self, entity: str, id: str, record: dict):
+        """
+        Append a single upsert to the journal. Cost is proportional to the size of the record.
+        """
+        line = json.dumps({"entity": entity, "id": id, "data": record}, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if self.fsync_mode == JsonJournal.FSYNC_ALWAYS:
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+            else:
+                self.unsynced = True
+            self.journal_records += 1
+            self.appended += 1
+            self.appended_bytes += len(line)
+            need_compaction = self.journal_records >= self.compact_every
+        if need_compaction:
+            with self.condition:
+                self.condition.notify()
+
+    def sync(self):
+        with self.lock:
+            if self.unsynced and self.file is not None:
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+                self.unsynced = False
+
+    def compact(self):
+        """
+        Fold the journal into the snapshot. Appends are blocked only while the journal file is
+        rotated and storage is copied; the snapshot itself is written outside of the lock.
+        """
+        with self.compact_lock:
+            start = time.perf_counter()
+            with self.lock:
+                if self.journal_records == 0:
+                    return
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                if os.path.exists(self.compacting_path):
+                    # previous compaction was interrupted: keep its records in front of the current journal
+                    with open(self.compacting_path, "a", encoding="utf-8") as dst, \
+                            open(self.journal_path, "r", encoding="utf-8") as src:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.compacting_path)
+                self.file = open(self.journal_path, "a", encoding="utf-8")
+                self.journal_records = 0
+                self.unsynced = False
+                # records are replaced (not mutated) on upsert, so copying the entity maps is enough
+                snapshot = {entity: dict(records) for entity, records in list(self.data.items())}
+
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            os.remove(self.compacting_path)
+            self.compactions += 1
+            self.last_compaction_ms = (time.perf_counter() - start) * 1000
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(self.fsync_interval)
+                if not self.running:
+                    break
+            try:
+                if self.journal_records >= self.compact_every:
+                    self.compact()
+                elif self.fsync_mode == JsonJournal.FSYNC_INTERVAL:
+                    self.sync()
+            except Exception as e:
+                print(f"Error: {e}")
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.fsync_mode != JsonJournal.FSYNC_NEVER:
+            self.sync()
+
+    def get_metrics(self):
+        return dict(
+            journal_records=self.journal_records,
+            appended=self.appended,
+            appended_bytes=self.appended_bytes,
+            fsyncs=self.fsyncs,
+            compactions=self.compactions,
+            last_compaction_ms=self.last_compaction_ms,
+            replayed=self.replayed,
+        )
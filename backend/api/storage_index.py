@@ -0,0 +1,118 @@
+import logging
+from typing import Dict, Optional, List
+
+logger = logging.getLogger(__name__)
+
+
+class FieldIndex:
+    """
+    Hash index of a single (entity, field) pair: maps field value to record ID(s).
+    Unique indexes hold one ID per value, non-unique ones keep IDs in insertion order
+    so lookups return the same record a linear scan would.
+    """
+
+    def __init__(self, unique: bool = False):
+        self.unique = unique
+        self.entries: Dict[any, any] = dict()
+
+    def owner(self, value) -> Optional[str]:
+        """
+        Return the ID holding the value in a unique index (None if the value is free).
+        Missing (None) values are never indexed as unique.
+        """
+        return self.entries.get(value) if self.unique and value is not None else None
+
+    def add(self, value, id: str):
+        if self.unique:
+            if value is not None:
+                self.entries[value] = id
+        else:
+            ids = self.entries.get(value)
+            if ids is None:
+                ids = self.entries[value] = dict()
+            ids[id] = None
+
+    def remove(self, value, id: str):
+        if self.unique:
+            if self.entries.get(value) == id:
+                del self.entries[value]
+        else:
+            ids = self.entries.get(value)
+            if ids is not None:
+                ids.pop(id, None)
+                if len(ids) == 0:
+                    del self.entries[value]
+
+    def ids(self, value) -> List[str]:
+        found = self.entries.get(value)
+        if found is None:
+            return []
+        return [found] if self.unique else list(found)
+
+    def first(self, value) -> Optional[str]:
+        found = self.entries.get(value)
+        if found is None or self.unique:
+            return found
+        return next(iter(found), None)
+
+
+class IndexedStorage(dict):
+    """
+    In-memory storage (entity -> {id -> record}) that maintains declared secondary indexes.
+    Index definitions map entity -> {field -> unique}; records must be written through index_record
+    (storage_upsert_one does that) to keep indexes in sync.
+    """
+
+    def __init__(self, index_definitions: Dict[str, Dict[str, bool]], data: dict = None):
+        super().__init__(data or {})
+        self.index_definitions = index_definitions
+        self.indexes: Dict[str, Dict[str, FieldIndex]] = {
+            entity: {field: FieldIndex(unique) for field, unique in fields.items()}
+            for entity, fields in index_definitions.items()
+        }
+        # values each record was indexed with, so stale entries can be removed even if the record was mutated in place
+        self.indexed_values: Dict[str, Dict[str, tuple]] = {entity: dict() for entity in index_definitions}
+        self.rebuild_indexes()
+
+    def get_index(self, entity: str, field: str) -> Optional[FieldIndex]:
+        fields = self.indexes.get(entity)
+        return fields.get(field) if fields is not None else None
+
+    def check_unique(self, entity: str, id: str, record: dict):
+        """
+        Raise ValueError if the record would violate a unique index.
+        """
+        for field, index in self.indexes.get(entity, {}).items():
+            owner = index.owner(record.get(field))
+            if owner is not None and owner != id:
+                raise ValueError(f"Duplicate value for unique field {entity}.{field}")
+
+    def index_record(self, entity: str, id: str, record: dict):
+        fields = self.indexes.get(entity)
+        if not fields:
+            return
+        old_values = self.indexed_values[entity].get(id)
+        new_values = tuple(record.get(field) for field in fields)
+        if old_values == new_values:
+            return
+        for i, index in enumerate(fields.values()):
+            if old_values is not None:
+                if old_values[i] == new_values[i]:
+                    continue
+                index.remove(old_values[i], id)
+            index.add(new_values[i], id)
+        self.indexed_values[entity][id] = new_values
+
+    def rebuild_indexes(self):
+        for entity, fields in self.indexes.items():
+            for index in fields.values():
+                index.entries.clear()
+            self.indexed_values[entity].clear()
+            for id, record in self.get(entity, {}).items():
+                try:
+                    self.check_unique(entity, id, record)
+                except ValueError as e:
+                    # keep the first record (what a linear scan used to return)
+                    logger.warning(f"{e}: record {id} is not indexed")
+                    continue
+                self.index_record(entity, id, record)
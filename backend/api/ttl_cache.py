@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache:
+    """
+    Bounded key -> value cache with a time to live.
+    Entries are kept in LRU order; the least recently used entry is dropped when the cache is full,
+    expired entries are dropped when they are read.
+    """
+
+    MISSING = object()  # returned by get when the key is not cached
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at)
+        self.lock = threading.Lock()
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+
+    def get(self, key):
+        """
+        Return the cached value of the key, or TtlCache.MISSING if it is not cached (or has expired).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return TtlCache.MISSING
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                self.expired += 1
+                self.misses += 1
+                return TtlCache.MISSING
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0 or key is None:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidated += 1
+
+    def get_metrics(self):
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0,
+            expired=self.expired,
+            evicted=self.evicted,
+            invalidated=self.invalidated,
+        )
@@ -1,21 +1,39 @@
+import os
 import uuid
 
 from backend.api.generic_data_provider import GenericDataProvider
 from backend.api.generic_validator import validate_record_for_mandatory_fields
+from backend.api.ttl_cache import TtlCache
 
 
 class UserDataProvider:    
+
+    DEFAULT_AUTH_CACHE_SIZE = 10000
+    DEFAULT_AUTH_CACHE_TTL = 300  # seconds
+
     def __init__(self, data_provider:GenericDataProvider, keep_transient_users:bool = True):
         self.data_provider = data_provider
         self.keep_transient_users = keep_transient_users
+        # token -> record caches for authentication; records are cached when read and replaced when upserted
+        cache_size = int(os.getenv("SI_AUTH_CACHE_SIZE", UserDataProvider.DEFAULT_AUTH_CACHE_SIZE))
+        cache_ttl = float(os.getenv("SI_AUTH_CACHE_TTL", UserDataProvider.DEFAULT_AUTH_CACHE_TTL))
+        self.users_by_token = TtlCache(cache_size, cache_ttl)
+        self.players_by_token = TtlCache(cache_size, cache_ttl)
+
+    def get_metrics(self):
+        return dict(users=self.users_by_token.get_metrics(), players=self.players_by_token.get_metrics())
 
 
     def init_user(self, user_token:str, user_data:dict):
         if not user_token or user_token == "":
             raise ValueError("User token is required")
+        cached_user = self.users_by_token.get(user_token)
+        if cached_user is not TtlCache.MISSING:
+            return cached_user
         # Check if the user already exists by token
         existing_user = self.data_provider.lookup_one_by_field("users", "token", user_token)
         if existing_user:
+            self.users_by_token.put(user_token, existing_user)
             return existing_user
         required_fields = ["name"]
         transient_user = user_data.get("simple_game_start", False)
@@ -24,6 +42,8 @@ class UserDataProvider:
                 raise ValueError("User data is required")
             existing_user = self.data_provider.lookup_one_by_field("users", "email", user_data["email"])
             if existing_user:
+                if existing_user.get("token") is not None:
+                    self.users_by_token.put(existing_user["token"], existing_user)
                 return existing_user
             required_fields.append("email")
             
@@ -39,6 +59,8 @@ class UserDataProvider:
         }
         record["id"] = self.data_provider.upsert_one("users", None, record,
                                                      False if self.keep_transient_users else transient_user == True)
+        if record["id"] is not None:
+            self.users_by_token.put(user_token, record)
         return record
     
             
@@ -59,9 +81,13 @@ class UserDataProvider:
             return player_data
 
         if player_token and player_token != "":
+            cached_player = self.players_by_token.get(player_token)
+            if cached_player is not TtlCache.MISSING:
+                return cached_player
             # Check if the user already exists by token
             existing_player = self.data_provider.lookup_one_by_field("players", "player_token", player_token)
             if existing_player:
+                self.players_by_token.put(player_token, existing_player)
                 return existing_player
         
         if not validate_record_for_mandatory_fields(player_data, [ "name"]):
@@ -94,8 +120,12 @@ class UserDataProvider:
         # if player with such name already exists in the game: set it's token and return the player
         for player in all_players:
             if player["name"] == player_name:
+                # the previous token no longer leads to this player
+                self.players_by_token.invalidate(player.get("player_token"))
                 player["player_token"] = player_token
                 self.data_provider.upsert_one("players", player["id"], player)
+                if player_token:
+                    self.players_by_token.put(player_token, player)
                 return player       
                
         record = {
@@ -108,6 +138,8 @@ class UserDataProvider:
 
         }
         record["id"] = self.data_provider.upsert_one("players", None, record)  
+        if record["id"] is not None and player_token:
+            self.players_by_token.put(player_token, record)
 
         return record
     
@@ -10,7 +10,9 @@ from backend.api.generic_data_provider import get_data_api
 
 from backend.api.user_db_handler import UserDataProvider
 from backend.api.game_db_handler import GameDataProvider
-from backend.app.controllers.game_controller import test_socket_user, websocket_connection, get_game_status
+from backend.app.cluster.bus import LocalSocketBus
+from backend.app.cluster.node import ClusterNode
+from backend.app.controllers.game_controller import test_socket_user, websocket_connection, get_game_status, handle_message
 from backend.app.managers.server import SIServerManager, logger
 from backend.app.util.util import setup_logger, ArgConfig
 
@@ -19,9 +21,16 @@ game_data_provider = GameDataProvider(get_data_api())
 
 setup_logger()
 server_manager = SIServerManager(game_save_handler=game_data_provider.set_game_data,
-                                 game_loader=game_data_provider.get_game_data)
+                                 game_loader=game_data_provider.get_game_data,
+                                 game_created_handler=game_data_provider.invalidate_missing_game)
 ArgConfig.load_args()
 
+# several processes share the games: SI_CLUSTER_NODES="n1=127.0.0.1:7101,n2=127.0.0.1:7102", SI_CLUSTER_NODE_ID="n1"
+if os.getenv("SI_CLUSTER_NODES"):
+    cluster_addresses = LocalSocketBus.parse_addresses(os.getenv("SI_CLUSTER_NODES"))
+    ClusterNode(os.getenv("SI_CLUSTER_NODE_ID"), list(cluster_addresses), LocalSocketBus(cluster_addresses),
+                server_manager, handle_message)
+
 app = Flask(__name__, static_folder='../../frontend/build', static_url_path='/')
 sock = Sock(app)
 CORS(app)
@@ -33,7 +42,11 @@ def auth():
         user_token = request.json.get("token")
         if user_token is None or user_token == "":
             player_data = request.json.get("player_data")
-            transient_game = server_manager.get_game_by_id(player_data.get("game_token"))         
+            game_token = player_data.get("game_token")
+            if game_token is not None and not server_manager.owns_game_key(game_token):
+                # only the owner knows games not saved yet and transient ones, like the http status routes
+                return {'error': f"game {game_token} is served by another node"}, 421
+            transient_game = server_manager.get_game_by_id(game_token)
             player = user_data_provider.init_player(request.json.get("player_token", None), player_data, transient_game)
             return { "token":player["token"]}
         else:
@@ -61,9 +74,7 @@ def get_authenticated_player(request):
 def get_player_game_data():
     try:
         player = get_authenticated_player(request)
-        status = get_game_status(server_manager, player['game_id'])
-        status[0]['player'] = player
-        return status
+        return get_game_status(server_manager, player['game_id'], request.headers.get("If-None-Match"), dict(player=player))
     except ValueError as e:
         return {'error': str(e)}, 400   
     
@@ -72,7 +83,7 @@ def get_player_game_data():
 def get_host_game_data(game_id):
     try:
         host = get_authenticated_user(request)
-        return get_game_status(server_manager, game_id)
+        return get_game_status(server_manager, game_id, request.headers.get("If-None-Match"))
     except ValueError as e:
         return {'error': str(e)}, 400  
     
@@ -85,6 +96,15 @@ def get_host_data():
         return {'error': str(e)}, 400  
 
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    metrics = server_manager.get_metrics()
+    metrics["storage"] = get_data_api().get_metrics()
+    metrics["storage"].update(game_data_provider.get_metrics())
+    metrics["auth"] = user_data_provider.get_metrics()
+    return metrics
+
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -104,7 +124,7 @@ def websocket_connection_(ws):
 
 @app.route('/game/status/<game_id>', methods=['GET'])
 def get_game_status_(game_id):
-    return get_game_status(server_manager, game_id)
+    return get_game_status(server_manager, game_id, request.headers.get("If-None-Match"))
 
 
 
@@ -113,7 +133,7 @@ def main():
     logger.info(f"Starting server in {ArgConfig.ENV} mode...")
      # all IPs id not prod:
     hosts_to_serve = "127.0.0.1" if ArgConfig.ENV == "prod" else "0.0.0.0"
-    app.run(host=hosts_to_serve, port=4000)
+    app.run(host=hosts_to_serve, port=int(os.getenv("SI_PORT", 4000)))
 
 
 
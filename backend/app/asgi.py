@@ -0,0 +1,159 @@
+# asyncio serving mode: the same /ws, /auth, /api/* and /game/status endpoints as app.py, served by an asgi server
+# websockets are asyncio tasks instead of threads, game logic and all timers run on the event loop;
+# plain http requests are passed to the flask app in a thread pool
+# run: python -m backend.app.asgi [--env debug] (needs backend/app/requirements-asgi.txt)
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from backend.app.managers.scheduler import AsyncioScheduler, set_scheduler
+
+# must be installed before the server manager (created by app.py) schedules its first timer
+scheduler = AsyncioScheduler()
+set_scheduler(scheduler)
+
+from backend.app.app import app, server_manager
+from backend.app.controllers.game_controller import websocket_connection_async
+from backend.app.managers.connection import AsyncClientConnection
+from backend.app.util.util import ArgConfig
+
+logger = logging.getLogger(__name__)
+
+# game mailboxes drain on the loop instead of the thread pool
+server_manager.game_executor = scheduler
+
+HTTP_THREADS = 16
+http_executor = ThreadPoolExecutor(max_workers=HTTP_THREADS, thread_name_prefix="http")
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        if scope["path"] == "/ws":
+            await serve_websocket(receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1000})
+    elif scope["type"] == "http":
+        await serve_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await serve_lifespan(receive, send)
+
+
+async def serve_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            scheduler.start(asyncio.get_running_loop())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            scheduler.stop()
+            server_manager.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def serve_websocket(receive, send):
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    async def send_frame(frame):
+        if frame is None:
+            await send({"type": "websocket.close", "code": 1000})
+        else:
+            await send({"type": "websocket.send", "text": frame})
+
+    async def receive_frame():
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                return None
+            if message.get("text") is not None:
+                return message["text"]
+            if message.get("bytes") is not None:
+                return message["bytes"].decode("utf-8")
+
+    ws = AsyncClientConnection(send_frame, receive_frame)
+    await websocket_connection_async(ws, server_manager)
+
+
+async def serve_http(scope, receive, send):
+    body = io.BytesIO()
+    while True:
+        message = await receive()
+        body.write(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    body.seek(0)
+    status, headers, content = await asyncio.get_running_loop().run_in_executor(
+        http_executor, call_wsgi, build_environ(scope, body))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+def build_environ(scope, body: io.BytesIO):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": unquote(scope["path"]).encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    # runs in the http thread pool
+    response = dict()
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+    result = app.wsgi_app(environ, start_response)
+    try:
+        content = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], content
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        print("Error: asgi mode needs uvicorn, install backend/app/requirements-asgi.txt")
+        sys.exit(1)
+    logger.info(f"Starting asgi server in {ArgConfig.ENV} mode...")
+    # all IPs id not prod:
+    hosts_to_serve = "127.0.0.1" if ArgConfig.ENV == "prod" else "0.0.0.0"
+    uvicorn.run(application, host=hosts_to_serve, port=int(os.getenv("SI_PORT", 4000)), ws="wsproto", lifespan="on", log_config=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# pub/sub bus connecting the nodes of a cluster
+# every node subscribes to the channel named after its node id, messages are json compatible dicts
+# handlers of a channel are called from a single thread, in the order the messages were published by a sender
+import json
+import logging
+import socket
+import threading
+from abc import abstractmethod
+from collections import deque
+from typing import Dict, Tuple, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBus:
+
+    def __init__(self):
+        # metrics
+        self.published = 0
+        self.delivered = 0
+
+    @abstractmethod
+    def publish(self, channel: str, message: dict):
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        pass
+
+    def close(self):
+        pass
+
+    def _deliver(self, handler, message: dict):
+        try:
+            handler(message)
+            self.delivered += 1
+        except Exception as e:
+            logger.error(f"Error handling bus message: {e}")
+
+    def get_metrics(self):
+        return dict(published=self.published, delivered=self.delivered)
+
+
+class InProcessBus(MessageBus):
+    # all nodes live in one process (tests, benchmarks); messages are passed as they are, without encoding
+
+    def __init__(self):
+        super().__init__()
+        self.channels: Dict[str, "_Dispatcher"] = dict()
+        self.lock = threading.Lock()
+
+    def publish(self, channel: str, message: dict):
+        dispatcher = self.channels.get(channel)
+        if dispatcher is None:
+            logger.warning(f"No subscriber for channel {channel}")
+            return
+        self.published += 1
+        dispatcher.put(message)
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        with self.lock:
+            if channel in self.channels:
+                raise ValueError(f"Channel {channel} already has a subscriber")
+            self.channels[channel] = _Dispatcher(f"bus-{channel}", lambda message: self._deliver(handler, message))
+
+    def close(self):
+        for dispatcher in self.channels.values():
+            dispatcher.stop()
+
+
+class LocalSocketBus(MessageBus):
+    # nodes on one host (or a private network): every channel is served on its own TCP address,
+    # publishers keep a connection per channel and write newline separated json messages from a writer thread
+
+    def __init__(self, addresses: Dict[str, Tuple[str, int]]):
+        super().__init__()
+        self.addresses = addresses
+        self.peers: Dict[str, "_Dispatcher"] = dict()
+        self.lock = threading.Lock()
+        self.servers = list()
+
+    @staticmethod
+    def parse_addresses(config: str) -> Dict[str, Tuple[str, int]]:
+        # "n1=127.0.0.1:7101,n2=127.0.0.1:7102"
+        addresses = dict()
+        for entry in config.split(","):
+            node_id, address = entry.strip().split("=")
+            host, port = address.rsplit(":", 1)
+            addresses[node_id] = (host, int(port))
+        return addresses
+
+    def publish(self, channel: str, message: dict):
+        peer = self.peers.get(channel)
+        if peer is None:
+            with self.lock:
+                peer = self.peers.get(channel)
+                if peer is None:
+                    if channel not in self.addresses:
+                        raise ValueError(f"Unknown channel {channel}")
+                    peer = self.peers[channel] = _Dispatcher(f"bus-out-{channel}", None, self.addresses[channel])
+        self.published += 1
+        peer.put((json.dumps(message, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        server = socket.create_server(self.addresses[channel])
+        self.servers.append(server)
+        # messages from all publishers are handled by one thread, like in InProcessBus
+        dispatcher = _Dispatcher(f"bus-{channel}", lambda message: self._deliver(handler, message))
+        threading.Thread(target=self._accept, args=(server, dispatcher), name=f"bus-accept-{channel}", daemon=True).start()
+
+    def _accept(self, server: socket.socket, dispatcher: "_Dispatcher"):
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._read, args=(connection, dispatcher), name="bus-reader", daemon=True).start()
+
+    @staticmethod
+    def _read(connection: socket.socket, dispatcher: "_Dispatcher"):
+        with connection, connection.makefile("rb") as stream:
+            for line in stream:
+                try:
+                    dispatcher.put(json.loads(line))
+                except ValueError as e:
+                    logger.error(f"Error decoding bus message: {e}")
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        for peer in self.peers.values():
+            peer.stop()
+
+
+class _Dispatcher:
+    # queue drained by its own thread: either calls a handler for every message
+    # or (with an address) writes all queued encoded messages to a socket at once
+
+    def __init__(self, name: str, handler: Optional[Callable], address: Tuple[str, int] = None):
+        self.handler = handler
+        self.address = address
+        self.socket: Optional[socket.socket] = None
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.running = True
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def put(self, item):
+        with self.condition:
+            self.queue.append(item)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0 and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                items = list(self.queue)
+                self.queue.clear()
+            if self.address is None:
+                for item in items:
+                    self.handler(item)
+            else:
+                self._write(b"".join(items))
+        if self.socket is not None:
+            self.socket.close()
+
+    def _write(self, data: bytes):
+        try:
+            if self.socket is None:
+                self.socket = socket.create_connection(self.address)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket.sendall(data)
+        except OSError as e:
+            # messages are lost, the next write reconnects
+            logger.error(f"Error publishing to {self.address}: {e}")
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
@@ -0,0 +1,28 @@
+# consistent hash ring: maps a key (game id or token) to the cluster node owning it
+# every node gets several virtual points on the ring, so keys spread evenly
+# and adding or removing a node only moves the keys of that node
+import bisect
+import hashlib
+from typing import List
+
+
+class HashRing:
+
+    DEFAULT_REPLICAS = 64  # virtual points per node
+
+    def __init__(self, node_ids: List[str], replicas: int = DEFAULT_REPLICAS):
+        if len(node_ids) == 0:
+            raise ValueError("Hash ring needs at least one node")
+        self.node_ids = list(node_ids)
+        self.replicas = replicas
+        points = sorted((HashRing.hash(f"{node_id}#{i}"), node_id) for node_id in node_ids for i in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node_id for _, node_id in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self.points, HashRing.hash(str(key)))
+        return self.owners[i % len(self.owners)]
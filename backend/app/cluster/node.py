@@ -0,0 +1,160 @@
+# this class lets several server processes share the load: every game is owned by one node
+# (consistent hash of its id, its token hashes to the same node), websocket actions received by other nodes
+# are forwarded to the owner over the bus, and frames the owner sends to those websockets travel back the same way
+import itertools
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from backend.app.cluster.bus import MessageBus
+from backend.app.cluster.hash_ring import HashRing
+from backend.app.managers.connection import ClientConnection
+from backend.app.util.util import generate_id
+
+logger = logging.getLogger(__name__)
+
+# actions addressed by the game (id or token) and by the player sending them
+GAME_ACTIONS = {"host_reconnect", "register", "get_status", "host_decision", "start_timer", "finalize", "set_round_names"}
+PLAYER_ACTIONS = {"signal", "offset_check"}
+
+
+class RemoteConnection(ClientConnection):
+    # stands for a websocket connected to another node: frames are published to that node,
+    # which queues them in the real ClientConnection (so merging and overflow handling happen there)
+
+    def __init__(self, node: "ClusterNode", origin: str, connection_id: str):
+        self.node = node
+        self.origin = origin
+        self._player_id: Optional[str] = None
+        super().__init__(None)
+        self.connection_id = connection_id
+
+    @property
+    def connected(self):
+        return not self.closed
+
+    @property
+    def player_id(self):
+        return self._player_id
+
+    @player_id.setter
+    def player_id(self, player_id: Optional[str]):
+        # let the edge node know where to forward the actions of this player
+        self._player_id = player_id
+        if player_id is not None:
+            self.node.publish(self.origin, dict(type="bind", connection=self.connection_id, player_id=player_id,
+                                                owner=self.node.node_id))
+
+    def send(self, frame: str, supersedable: bool = False, message: dict = None):
+        if self.closed:
+            raise ConnectionError(f"connection of {self.player_id} is closed ({self.close_reason})")
+        self.node.publish(self.origin, dict(type="frame", connection=self.connection_id, frame=frame,
+                                            supersedable=supersedable, message=message))
+        self.sent += 1
+
+    def check_stalled(self) -> bool:
+        # stalls are detected by the node holding the websocket
+        return False
+
+    def close(self, reason: str = "closed"):
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        self.node.publish(self.origin, dict(type="close", connection=self.connection_id, reason=reason))
+
+
+class ClusterNode:
+
+    def __init__(self, node_id: str, node_ids: List[str], bus: MessageBus, server_manager, message_handler):
+        # node_ids are the nodes owning games; a node outside of them only forwards (e.g. a benchmark driver)
+        self.node_id = node_id
+        self.ring = HashRing(node_ids)
+        self.bus = bus
+        self.server_manager = server_manager
+        self.message_handler = message_handler  # handle_message(ws, data, server_manager) of the game controller
+        self.connection_ids = itertools.count(1)
+        # websockets of this node by connection id, and the owner node of every player using them
+        self.connections: Dict[str, ClientConnection] = dict()
+        self.player_id_to_node: Dict[str, str] = dict()
+        # websockets of other nodes talking to games of this node
+        self.remote_connections: Dict[Tuple[str, str], RemoteConnection] = dict()
+
+        # metrics
+        self.forwarded = 0
+        self.handled_remote = 0
+
+        server_manager.cluster = self
+        bus.subscribe(node_id, self._on_message)
+
+    def is_local(self, key: str) -> bool:
+        return self.ring.node_for(key) == self.node_id
+
+    def publish(self, node_id: str, message: dict):
+        self.bus.publish(node_id, message)
+
+    def route(self, data: dict) -> str:
+        action = data.get("action")
+        if action == "start_game":
+            # new game is created by the node owning its id; id assigned here is never taken from the client
+            data["game_id"] = generate_id()
+            return self.ring.node_for(data["game_id"])
+        if action in GAME_ACTIONS:
+            key = data.get("game_id") or data.get("game_token")
+            if key is not None:
+                return self.ring.node_for(key)
+        elif action in PLAYER_ACTIONS:
+            node_id = self.player_id_to_node.get(data.get("player_id"))
+            if node_id is not None:
+                return node_id
+        return self.node_id
+
+    def dispatch(self, ws: ClientConnection, data: dict):
+        # handles a message received by a websocket of this node, locally or on the owner of the game
+        node_id = self.route(data)
+        if node_id == self.node_id:
+            self.message_handler(ws, data, self.server_manager)
+            return
+        if ws.connection_id is None:
+            ws.connection_id = f"{self.node_id}-{next(self.connection_ids)}"
+            self.connections[ws.connection_id] = ws
+        self.forwarded += 1
+        self.publish(node_id, dict(type="action", origin=self.node_id, connection=ws.connection_id, data=data))
+
+    def disconnect(self, ws: ClientConnection):
+        # websocket of this node is gone: owners forwarding to it stop sending
+        if ws.connection_id is None or self.connections.pop(ws.connection_id, None) is None:
+            return
+        for node_id in set(self.ring.node_ids) - {self.node_id}:
+            self.publish(node_id, dict(type="disconnect", origin=self.node_id, connection=ws.connection_id))
+
+    def _on_message(self, message: dict):
+        kind = message["type"]
+        if kind == "action":
+            key = (message["origin"], message["connection"])
+            connection = self.remote_connections.get(key)
+            if connection is None or connection.closed:
+                connection = self.remote_connections[key] = RemoteConnection(self, *key)
+            self.handled_remote += 1
+            self.message_handler(connection, message["data"], self.server_manager)
+        elif kind == "disconnect":
+            connection = self.remote_connections.pop((message["origin"], message["connection"]), None)
+            if connection is not None:
+                connection.closed = True
+                connection.close_reason = "disconnected"
+        else:
+            connection = self.connections.get(message["connection"])
+            if connection is None or connection.closed:
+                return
+            if kind == "frame":
+                connection.send(message["frame"], message["supersedable"], message["message"])
+            elif kind == "bind":
+                self.player_id_to_node[message["player_id"]] = message["owner"]
+                connection.player_id = message["player_id"]
+            elif kind == "close":
+                self.connections.pop(message["connection"], None)
+                connection.close(message["reason"])
+
+    def get_metrics(self):
+        return dict(node_id=self.node_id, forwarded=self.forwarded, handled_remote=self.handled_remote,
+                    connections=len(self.connections), remote_connections=len(self.remote_connections),
+                    bus=self.bus.get_metrics())
@@ -1,13 +1,15 @@
 import json
 import logging
+import zlib
 
 from flask import request
 from simple_websocket import Server
 
 
+from backend.app.managers.connection import ClientConnection, AsyncClientConnection
 from backend.app.managers.entity import Player, Signal
 from backend.app.managers.server import SIServerManager
-from backend.app.util.util import setup_logger, to_dict, now, DEFAULT_NUMBER_OF_ROUNDS, ArgConfig
+from backend.app.util.util import setup_logger, to_dict, encode_message, now, DEFAULT_NUMBER_OF_ROUNDS, ArgConfig
 
 
 
@@ -15,137 +17,245 @@ setup_logger()
 
 logger = logging.getLogger(__name__)
 
-def create_game(server_manager: SIServerManager, host_name, host_id, ws:Server, number_of_rounds=DEFAULT_NUMBER_OF_ROUNDS, round_names_as_text=None):
-    game = server_manager.create_game(ws, host_name=host_name, host_id=host_id, number_of_rounds=number_of_rounds, round_names_as_text=round_names_as_text)
+def create_game(server_manager: SIServerManager, host_name, host_id, ws:Server, number_of_rounds=DEFAULT_NUMBER_OF_ROUNDS, round_names_as_text=None, game_id=None):
+    game = server_manager.create_game(ws, host_name=host_name, host_id=host_id, number_of_rounds=number_of_rounds, round_names_as_text=round_names_as_text, game_id=game_id)
     return game
 
 def test_socket_user(server_manager: SIServerManager):
     player_id = request.json.get("player_id")
     socket = server_manager.get_socket_by_player_id(player_id)
     if socket and socket.connected:
-        result = to_dict({"player_id": player_id, "status": "OK"})
-        socket.send(result)
+        result = {"player_id": player_id, "status": "OK"}
+        socket.send(encode_message(result))
         return {"status": "OK"}, 200
     return {"status": "No Socket"}, 200
 
 STATUS_OK = {"status": "OK"}
 
 def websocket_connection(ws, server_manager: SIServerManager):
+    # replies and broadcasts go through the same outbound queue, so frames to this socket never interleave
+    ws = ClientConnection(ws)
     while True:
         try:
             if ws.connected is False:
                 logger.info("Socket closed")
                 break
             data = ws.receive()  # Receive a message from the client
-            data = json.loads(data)
-            action = data.get("action")
-            if action == "offset_check" or 'isTrusted' in data:
-                pass
-            else:
-                logger.info(f"Received: {data}")
-            result = {"status": "error", "desc": "unknown action"}
-            if action == "start_game":
-                # { "action": "start_game", "host_name": "Masha", "number_of_rounds": 8 }
-                host_name = data.get("host_name")
-                host_id = data.get("host_id", None)
-                number_of_rounds = data.get("number_of_rounds")
-                round_names_as_text = data.get("round_names", None)
-                try:
-                    number_of_rounds = int(number_of_rounds) if number_of_rounds is not None else DEFAULT_NUMBER_OF_ROUNDS
-                except ValueError:
-                    number_of_rounds = DEFAULT_NUMBER_OF_ROUNDS
-                game = create_game(server_manager, host_name, host_id, ws, number_of_rounds=number_of_rounds, round_names_as_text=round_names_as_text)
-                result_start = dict(id=game.game_id, token=game.token, host={"name": game.host.name, "id": game.host.player_id, "token": game.token, "game_id": game.game_id})
-                logger.info(f"Sending: {result_start}")
-                ws.send(f"{result_start}")
-                result = None
-                game.update_status()
-            elif action == "host_reconnect":
-                # { "action": "host_reconnect",  "token": "ABCDEF" }
-                game_id = data.get("game_id")
-                game = server_manager.get_game_by_id(game_id)
-                if game is not None:
-                    server_manager.register_socket(game.host.player_id, ws)
-                    result = dict(id=game.game_id, token=game.token, host={"name": game.host.name, "id": game.host.player_id, "token": game.token, "game_id": game.game_id})
-                else:
-                    result = {"status": "error", "desc": "game not found"}
-            elif action == "register":
-                # { "action": "register", "name": "Vovochka", "token": "ABCDEF" }
-                game_id = None
-                if data.get("game_id") is None:
-                    game = server_manager.get_game_by_id(data.get("game_token")) # this function works by token or ID
-                    if game is not None:
-                        game_id = game.game_id
-                else:
-                    game_id = data.get("game_id")
-                if game_id is None:
-                    result = {"status": "error", "desc": "game id not found"}
-                    ws.send(f"{result}")
-                    continue
-                player = Player(data.get("name"), game_id, data.get("player_id", None))
-                player = server_manager.register_player(player, ws)
-                result = to_dict(player)
-            elif action == "signal":
-                # { "action": "signal", "player_id": "4", "local_ts": 213121237874 }
-                player_id = data.get("player_id")
-                local_ts = data.get("local_ts")
-                game = server_manager.get_game_by_player_id(player_id)
-                if game is not None:
-                    lag = server_manager.ntp_manager.get_lag(player_id)
-                    adjusted_ts = local_ts - lag
-                    signal: Signal = Signal(player_id, now(), local_ts, adjusted_ts)
-                    server_manager.get_game_by_player_id(player_id).process_signal(signal)
-                result = {"status": "OK"}
-            elif action == "host_decision":
-                # { "action": "host_decision", "game_id": "3", "decision": "accept" }
-                game_id = data.get("game_id")
-                host_decision = data.get("host_decision")
-                game = server_manager.get_game_by_id(game_id)
-                if game is not None:
-                    game.process_host_decision(host_decision)
-                result = STATUS_OK
-            elif action == "start_timer":
-            #{ "action": "start_timer", "game_id": "2" }
-                game_id = data.get("game_id")
-                game = server_manager.get_game_by_id(game_id)
-                if game is not None:
-                    game.start_timer()
-                result = STATUS_OK
-            elif action == "finalize":
-                game_id = data.get("game_id")
-                game = server_manager.get_game_by_id(game_id)
-                if game is not None:
-                    game.finalize_game()
-            elif action == "set_round_names":
-                game_id = data.get("game_id")
-                game = server_manager.get_game_by_id(game_id)
-                if game is not None and hasattr(game, 'set_round_names'):
-                    round_names_as_text = data.get("round_names", None)
-                    game.set_round_names(round_names_as_text)
-                    result = STATUS_OK
-            else:
-                result = None
-            if result is not None:
-                logger.info(f"Sending: {result}")
-                ws.send(f"{result}")
-            elif action == "offset_check":
-                data['server_in_ts'] = now()
-                lag = server_manager.process_lag_check(data)
-                result = dict(action="offset_check_result", lag=lag)
-                ws.send(f"{result}")
-
+            dispatch_message(ws, json.loads(data), server_manager)
         except Exception as e:
             logger.error(f"Error: {e}")
             if ArgConfig.is_dev():
+                ws.close()
                 raise e
             else:
                 logger.error(f"Error: {e}")
+    ws.close()
+    if server_manager.cluster is not None:
+        server_manager.cluster.disconnect(ws)
+
+
+async def websocket_connection_async(ws: AsyncClientConnection, server_manager: SIServerManager):
+    # asgi mode: same protocol, messages are handled on the event loop (game logic and timers run there too)
+    while True:
+        try:
+            data = await ws.receive()
+            if data is None:
+                logger.info("Socket closed")
+                break
+            dispatch_message(ws, json.loads(data), server_manager)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            if ArgConfig.is_dev():
+                ws.close()
+                raise e
+    ws.close()
+    if server_manager.cluster is not None:
+        server_manager.cluster.disconnect(ws)
+
+
+def dispatch_message(ws: ClientConnection, data: dict, server_manager: SIServerManager):
+    # in cluster mode the message is handled by the node owning the game
+    if server_manager.cluster is not None:
+        server_manager.cluster.dispatch(ws, data)
+    else:
+        handle_message(ws, data, server_manager)
+
+
+def handle_message(ws: ClientConnection, data: dict, server_manager: SIServerManager):
+    action = data.get("action")
+    if action == "offset_check" or 'isTrusted' in data:
+        pass
+    else:
+        logger.info(f"Received: {data}")
+    result = {"status": "error", "desc": "unknown action"}
+    if action == "start_game":
+        # { "action": "start_game", "host_name": "Masha", "number_of_rounds": 8 }
+        host_name = data.get("host_name")
+        host_id = data.get("host_id", None)
+        number_of_rounds = data.get("number_of_rounds")
+        round_names_as_text = data.get("round_names", None)
+        try:
+            number_of_rounds = int(number_of_rounds) if number_of_rounds is not None else DEFAULT_NUMBER_OF_ROUNDS
+        except ValueError:
+            number_of_rounds = DEFAULT_NUMBER_OF_ROUNDS
+        # nobody knows the new game before the reply, so it is created here; everything after runs in its mailbox
+        # game id is only taken when ClusterNode.route assigned it, never from the client
+        game_id = data.get("game_id") if server_manager.cluster is not None else None
+        game = create_game(server_manager, host_name, host_id, ws, number_of_rounds=number_of_rounds, round_names_as_text=round_names_as_text, game_id=game_id)
+        game.submit(start_game, ws, game)
+        result = None
+    elif action == "host_reconnect":
+        # { "action": "host_reconnect",  "token": "ABCDEF" }
+        game_id = data.get("game_id")
+        game = server_manager.get_game_by_id(game_id)
+        if game is not None:
+            game.submit(reconnect_host, ws, game, server_manager)
+            result = None
+        else:
+            result = {"status": "error", "desc": "game not found"}
+    elif action == "register":
+        # { "action": "register", "name": "Vovochka", "token": "ABCDEF" }
+        game_id = None
+        if data.get("game_id") is None:
+            game = server_manager.get_game_by_id(data.get("game_token")) # this function works by token or ID
+            if game is not None:
+                game_id = game.game_id
+        else:
+            game_id = data.get("game_id")
+        if game_id is None:
+            result = {"status": "error", "desc": "game id not found"}
+            ws.send(encode_message(result))
+            return
+        player = Player(data.get("name"), game_id, data.get("player_id", None))
+        game = server_manager.get_game_by_id(game_id)
+        if game is not None:
+            game.submit(register_player, ws, player, server_manager)
+            result = None
+        else:
+            result = to_dict(server_manager.register_player(player, ws))
+    elif action == "get_status":
+        # { "action": "get_status", "game_id": "2" } - full snapshot when client can't apply a status patch
+        game = server_manager.get_game_by_id(data.get("game_id"))
+        if game is not None:
+            game.submit(send_full_status, ws, game)
+            result = None
+        else:
+            result = {"status": "error", "desc": "game not found"}
+    elif action == "signal":
+        # { "action": "signal", "player_id": "4", "local_ts": 213121237874 }
+        player_id = data.get("player_id")
+        local_ts = data.get("local_ts")
+        game = server_manager.get_game_by_player_id(player_id)
+        if game is not None:
+            lag = server_manager.ntp_manager.get_lag(player_id)
+            adjusted_ts = local_ts - lag
+            signal: Signal = Signal(player_id, now(), local_ts, adjusted_ts)
+            game.submit(game.process_signal, signal)
+        result = {"status": "OK"}
+    elif action == "host_decision":
+        # { "action": "host_decision", "game_id": "3", "decision": "accept" }
+        game_id = data.get("game_id")
+        host_decision = data.get("host_decision")
+        game = server_manager.get_game_by_id(game_id)
+        result = STATUS_OK
+        if game is not None:
+            # host refetches the status on the reply, so it is sent once the decision is applied and broadcast
+            game.submit(apply_and_reply, ws, game, game.process_host_decision, host_decision)
+            result = None
+    elif action == "start_timer":
+    #{ "action": "start_timer", "game_id": "2" }
+        game_id = data.get("game_id")
+        game = server_manager.get_game_by_id(game_id)
+        result = STATUS_OK
+        if game is not None:
+            game.submit(apply_and_reply, ws, game, game.start_timer)
+            result = None
+    elif action == "finalize":
+        game_id = data.get("game_id")
+        game = server_manager.get_game_by_id(game_id)
+        if game is not None:
+            game.submit(game.finalize_game)
+    elif action == "set_round_names":
+        game_id = data.get("game_id")
+        game = server_manager.get_game_by_id(game_id)
+        if game is not None and hasattr(game, 'set_round_names'):
+            round_names_as_text = data.get("round_names", None)
+            game.submit(apply_and_reply, ws, game, game.set_round_names, round_names_as_text)
+            result = None
+    else:
+        result = None
+    if result is not None:
+        send_reply(ws, result)
+    elif action == "offset_check":
+        data['server_in_ts'] = now()
+        estimate = server_manager.process_lag_check(data)
+        # lag keeps the meaning clients show it with (one-way network delay), the signed clock offset goes separately
+        result = dict(action="offset_check_result", lag=estimate["error_ms"] if estimate is not None else 0,
+                      offset=estimate["offset"] if estimate is not None else 0)
+        ws.send(encode_message(result))
+
+
+def send_reply(ws: ClientConnection, result: dict):
+    logger.info(f"Sending: {result}")
+    ws.send(encode_message(result))
+
+
+# actions below read or change the state of a game, so they run as commands in the mailbox of the game
+
+def start_game(ws: ClientConnection, game):
+    result_start = dict(id=game.game_id, token=game.token, host={"name": game.host.name, "id": game.host.player_id, "token": game.token, "game_id": game.game_id})
+    send_reply(ws, result_start)
+    game.update_status()
+
 
+def apply_and_reply(ws: ClientConnection, game, command, *args):
+    command(*args)
+    game.reply(ws, STATUS_OK)
 
-def get_game_status(server_manager, game_id):
+
+def reconnect_host(ws: ClientConnection, game, server_manager: SIServerManager):
+    server_manager.register_socket(game.host.player_id, ws)
+    result = dict(id=game.game_id, token=game.token, host={"name": game.host.name, "id": game.host.player_id, "token": game.token, "game_id": game.game_id})
+    # reconnected client has no base version for status patches
+    result.update(game.generate_full_status_message())
+    send_reply(ws, result)
+
+
+def register_player(ws: ClientConnection, player: Player, server_manager: SIServerManager):
+    player = server_manager.register_player(player, ws)
+    result = to_dict(player)
+    if isinstance(player, Player):
+        # status patch adding the player is broadcast after the batch, on top of this snapshot
+        result.update(server_manager.get_game_by_id(player.game_id).generate_full_status_message())
+    send_reply(ws, result)
+
+
+def send_full_status(ws: ClientConnection, game):
+    send_reply(ws, game.generate_full_status_message())
+
+
+def get_game_status(server_manager, game_id, if_none_match=None, extra_fields=None):
+    # status is encoded once per game version; clients polling with the etag of the latest version get 304
+    if game_id is not None and not server_manager.owns_game_key(game_id):
+        return {"error": f"game {game_id} is served by another node"}, 421
     game = server_manager.get_game_by_id(game_id)
     if game is not None:
-        result = game.generate_game_status()
-        return result, 200
+        etag, result, body = game.get_http_status()
+        if extra_fields:
+            # the response also depends on the caller (e.g. the player), so the etag names the extra fields too
+            etag = f'{etag[:-1]}.{zlib.crc32(encode_message(extra_fields).encode("utf-8")):08x}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match is not None and etag_matches(etag, if_none_match):
+            return "", 304, headers
+        if extra_fields:
+            body = encode_message(dict(result, **extra_fields))
+        headers["Content-Type"] = "application/json"
+        return body, 200, headers
     else:
         return {"error": f"game {game_id} not found"}, 200
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
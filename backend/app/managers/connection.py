@@ -0,0 +1,285 @@
+# this class wraps a client websocket with a bounded outbound queue drained by its own writer thread
+# so a slow client never blocks broadcasts to other players (or the thread that produced the message)
+# status frames are supersedable: a newer status frame is merged with one still waiting at the tail of the queue
+import asyncio
+import logging
+import os
+import socket as socket_module
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from backend.app.managers.game import merge_status_messages
+from backend.app.util.util import encode_message
+
+logger = logging.getLogger(__name__)
+
+
+class ClientConnection:
+
+    # overflow policies, applied when the queue is full
+    DROP_SUPERSEDED = "drop_superseded"  # drop the new status frame, disconnect if a critical frame doesn't fit
+    DROP_OLDEST = "drop_oldest"  # drop the oldest frame whatever it is
+    DISCONNECT = "disconnect"  # treat a full queue as a stalled client
+
+    DEFAULT_MAX_QUEUE = 64
+    DEFAULT_STALL_TIMEOUT = 10  # seconds a frame may wait (or a send may take) before the client is disconnected
+
+    def __init__(self, socket, max_queue: int = None, stall_timeout: float = None, overflow_policy: str = None):
+        self.socket = socket
+        self.player_id: Optional[str] = None
+        self.connection_id: Optional[str] = None  # address of the websocket for other cluster nodes
+        self.max_queue = max(1, max_queue if max_queue is not None else
+                             int(os.getenv("SI_SEND_QUEUE_SIZE", ClientConnection.DEFAULT_MAX_QUEUE)))
+        self.stall_timeout = stall_timeout if stall_timeout is not None else \
+            float(os.getenv("SI_SEND_STALL_TIMEOUT", ClientConnection.DEFAULT_STALL_TIMEOUT))
+        self.overflow_policy = overflow_policy or os.getenv("SI_SEND_OVERFLOW_POLICY", ClientConnection.DROP_SUPERSEDED)
+
+        self.queue = deque()  # entries of (frame, supersedable, enqueued_at, message)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.writer: Optional[threading.Thread] = None
+        self.sending_since: Optional[float] = None
+
+        # metrics
+        self.sent = 0
+        self.dropped = 0
+        self.merged = 0  # status frames merged into a newer one while waiting in the queue
+        self.max_depth = 0
+        self.total_latency_ms = 0  # time from enqueue to the end of the send
+        self.max_latency_ms = 0
+        self.close_reason: Optional[str] = None
+
+    @property
+    def connected(self):
+        return not self.closed and self.socket.connected
+
+    def receive(self, *args, **kwargs):
+        return self.socket.receive(*args, **kwargs)
+
+    def send(self, frame: str, supersedable: bool = False, message: dict = None):
+        with self.condition:
+            if self.closed:
+                raise ConnectionError(f"connection of {self.player_id} is closed ({self.close_reason})")
+            enqueued_at = time.monotonic()
+            if supersedable:
+                frame, message, enqueued_at = self._supersede_queued_status(frame, message, enqueued_at)
+            room = self._make_room(supersedable) if len(self.queue) >= self.max_queue else True
+            if room:
+                self.queue.append((frame, supersedable, enqueued_at, message))
+                self.max_depth = max(self.max_depth, len(self.queue))
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._run, name=f"ws-writer-{self.player_id}", daemon=True)
+                    self.writer.start()
+                self.condition.notify()
+        if room is None:
+            self.close("send queue overflow")
+
+    def _supersede_queued_status(self, frame: str, message: Optional[dict], enqueued_at: float):
+        # must be called with self.condition held
+        # a status frame still waiting at the tail of the queue is merged into the new one;
+        # status frames queued before a critical frame are kept, so frames never overtake each other
+        if len(self.queue) == 0 or not self.queue[-1][1]:
+            return frame, message, enqueued_at
+        previous = self.queue.pop()
+        merged = None
+        if message is not None and previous[3] is not None:
+            merged = merge_status_messages(previous[3], message)
+        if merged is None:
+            # client will notice the version gap and ask for a full status
+            self.dropped += 1
+            return frame, message, enqueued_at
+        self.merged += 1
+        return encode_message(merged), merged, previous[2]
+
+    def _make_room(self, supersedable: bool) -> Optional[bool]:
+        # must be called with self.condition held
+        # returns True if the new frame can be queued, False if it is dropped, None if the client must be disconnected
+        if self.overflow_policy == ClientConnection.DROP_OLDEST:
+            self.queue.popleft()
+            self.dropped += 1
+            return True
+        if self.overflow_policy == ClientConnection.DROP_SUPERSEDED and supersedable:
+            # queue is full of critical frames: the newest status can be requested again later
+            self.dropped += 1
+            return False
+        self.dropped += 1
+        return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0 and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                frame, _, enqueued_at, _ = self.queue.popleft()
+                self.sending_since = time.monotonic()
+            try:
+                self.socket.send(frame)
+            except Exception as e:
+                logger.error(f"Error sending message to {self.player_id}: {e}")
+                self.close(f"send failed: {e}")
+                return
+            finally:
+                self.sending_since = None
+            latency_ms = (time.monotonic() - enqueued_at) * 1000
+            self.sent += 1
+            self.total_latency_ms += latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+
+    def check_stalled(self) -> bool:
+        # disconnects the client if its oldest frame waits (or the current send hangs) longer than stall_timeout
+        now = time.monotonic()
+        with self.condition:
+            if self.closed:
+                return False
+            oldest = self.queue[0][2] if len(self.queue) > 0 else None
+            sending_since = self.sending_since
+        if (oldest is not None and now - oldest > self.stall_timeout) or \
+                (sending_since is not None and now - sending_since > self.stall_timeout):
+            logger.warning(f"Disconnecting stalled client {self.player_id}")
+            self.close("stalled")
+            return True
+        return False
+
+    def _close_locked(self, reason: str):
+        # must be called with self.condition held
+        self.closed = True
+        self.close_reason = reason
+        self.queue.clear()
+        self.condition.notify()
+
+    def close(self, reason: str = "closed"):
+        with self.condition:
+            if self.closed:
+                return
+            writer_blocked = self.sending_since is not None
+            self._close_locked(reason)
+        try:
+            raw_socket = getattr(self.socket, "sock", None)
+            if writer_blocked and raw_socket is not None:
+                # writer hangs in send: unblock it by shutting the transport down instead of sending a close frame
+                raw_socket.shutdown(socket_module.SHUT_RDWR)
+            elif self.socket.connected:
+                self.socket.close()
+        except Exception as e:
+            logger.error(f"Error closing connection of {self.player_id}: {e}")
+
+    def get_metrics(self):
+        with self.condition:
+            queue_depth = len(self.queue)
+        return dict(
+            queue_depth=queue_depth,
+            max_depth=self.max_depth,
+            sent=self.sent,
+            dropped=self.dropped,
+            merged=self.merged,
+            avg_latency_ms=self.total_latency_ms / self.sent if self.sent else 0,
+            max_latency_ms=self.max_latency_ms,
+            closed=self.closed,
+            close_reason=self.close_reason,
+        )
+
+
+class AsyncClientConnection(ClientConnection):
+    # ClientConnection of the asgi serving mode: the queue is drained by an asyncio task instead of a thread
+    # send() may be called from any thread, the frames are always written on the event loop
+
+    def __init__(self, send_frame, receive_frame, loop: asyncio.AbstractEventLoop = None, **kwargs):
+        super().__init__(None, **kwargs)
+        self.send_frame = send_frame  # coroutine function writing a text frame (None closes the websocket)
+        self.receive_frame = receive_frame  # coroutine function returning the next text frame (None when closed)
+        self.loop = loop or asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+
+    @property
+    def connected(self):
+        return not self.closed
+
+    async def receive(self):
+        return await self.receive_frame()
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def send(self, frame: str, supersedable: bool = False, message: dict = None):
+        with self.condition:
+            if self.closed:
+                raise ConnectionError(f"connection of {self.player_id} is closed ({self.close_reason})")
+            enqueued_at = time.monotonic()
+            if supersedable:
+                frame, message, enqueued_at = self._supersede_queued_status(frame, message, enqueued_at)
+            room = self._make_room(supersedable) if len(self.queue) >= self.max_queue else True
+            if room:
+                self.queue.append((frame, supersedable, enqueued_at, message))
+                self.max_depth = max(self.max_depth, len(self.queue))
+        if room is None:
+            self.close("send queue overflow")
+        elif room:
+            self._call(self._wake_writer)
+
+    def _call(self, fn, *args):
+        if self._on_loop():
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _wake_writer(self):
+        # runs on the loop
+        if self.writer is None and not self.closed:
+            self.writer = self.loop.create_task(self._run_async())
+        self.wakeup.set()
+
+    async def _run_async(self):
+        while True:
+            with self.condition:
+                if self.closed:
+                    return
+                entry = self.queue.popleft() if len(self.queue) > 0 else None
+                if entry is None:
+                    self.wakeup.clear()
+                else:
+                    self.sending_since = time.monotonic()
+            if entry is None:
+                await self.wakeup.wait()
+                continue
+            frame, _, enqueued_at, _ = entry
+            try:
+                await self.send_frame(frame)
+            except asyncio.CancelledError:
+                return
+            except Exception as e:
+                logger.error(f"Error sending message to {self.player_id}: {e}")
+                self.close(f"send failed: {e}")
+                return
+            finally:
+                self.sending_since = None
+            latency_ms = (time.monotonic() - enqueued_at) * 1000
+            self.sent += 1
+            self.total_latency_ms += latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+
+    def close(self, reason: str = "closed"):
+        with self.condition:
+            if self.closed:
+                return
+            self._close_locked(reason)
+        self._call(self._close_on_loop)
+
+    def _close_on_loop(self):
+        # runs on the loop: a writer stuck in send is cancelled, then the client gets a close frame
+        if self.writer is not None and not self.writer.done():
+            self.writer.cancel()
+        self.wakeup.set()
+        self.loop.create_task(self._send_close())
+
+    async def _send_close(self):
+        try:
+            await self.send_frame(None)
+        except Exception as e:
+            logger.debug(f"Error closing connection of {self.player_id}: {e}")
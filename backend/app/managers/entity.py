@@ -2,8 +2,11 @@ from backend.app.util.util import generate_id
 
 
 # this class keeps definition of all small bean-like classes without complex logic
+# entities declare __slots__ (no per-instance __dict__) and serialize themselves with to_dict
 
 class Player:
+    __slots__ = ("score", "player_id", "name", "game_id", "lag")
+
     def __init__(self, name: str, game_id: str, existing_id:str = None , restore_score:int = 0): 
         self.score:int = restore_score
         self.player_id = generate_id() if existing_id is None else existing_id
@@ -11,9 +14,17 @@ class Player:
         self.game_id=game_id
         self.lag = 0  # used to show delay when signal was received
 
+    def to_dict(self):
+        return {"score": self.score, "player_id": self.player_id, "name": self.name, "game_id": self.game_id, "lag": self.lag}
+
 class Signal:
+    __slots__ = ("player_id", "server_ts", "client_ts", "adjusted_ts")
+
     def __init__(self, player_id: str, server_ts, client_ts, adjusted_ts):
         self.player_id = player_id
         self.server_ts = server_ts
         self.client_ts = client_ts
         self.adjusted_ts = adjusted_ts
+
+    def to_dict(self):
+        return {"player_id": self.player_id, "server_ts": self.server_ts, "client_ts": self.client_ts, "adjusted_ts": self.adjusted_ts}
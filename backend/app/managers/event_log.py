@@ -0,0 +1,199 @@
+# this class keeps an append-only log of the commands applied to games, so a crash between two snapshot saves
+# loses no buzzes or decisions: a game is recovered from its last saved snapshot plus the events logged after it
+# every event is one JSON line [game_id, seq, type, args]; seq counts the events of a game and is saved in its snapshot
+# appends only buffer the line, a writer thread group-commits everything buffered (by all games) with one write
+# and one fsync every commit interval, so durability doesn't cost an fsync per action
+# the log is split into segment files; a segment is deleted once every game in it has a saved snapshot past its events
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class GameEventLog:
+
+    DEFAULT_COMMIT_INTERVAL = 0.01  # seconds; events of the last interval may be lost on crash
+    DEFAULT_SEGMENT_EVENTS = 10000  # events after which a new segment file is started
+
+    def __init__(self, directory: str, commit_interval: float = None, segment_events: int = None):
+        self.directory = directory
+        self.commit_interval = commit_interval if commit_interval is not None else \
+            float(os.getenv("SI_EVENT_LOG_COMMIT_INTERVAL", GameEventLog.DEFAULT_COMMIT_INTERVAL))
+        self.segment_events = max(1, segment_events if segment_events is not None else
+                                  int(os.getenv("SI_EVENT_LOG_SEGMENT_EVENTS", GameEventLog.DEFAULT_SEGMENT_EVENTS)))
+
+        self.buffer: List[str] = []
+        self.buffer_last_seq: Dict[str, int] = dict()  # game_id -> last seq among the buffered events
+        self.condition = threading.Condition()  # guards buffer
+        self.write_lock = threading.Lock()  # held while a group is written, segments change only under it
+        # closed segments: (path, game_id -> last seq in the segment); the open one is self.file / self.file_last_seq
+        self.segments: List[tuple] = []
+        self.file = None
+        self.file_path = None
+        self.file_events = 0
+        self.file_last_seq: Dict[str, int] = dict()
+        self.next_segment = 0
+        self.saved_seq: Dict[str, int] = dict()  # game_id -> event seq of its latest saved snapshot
+        self.recovered: Dict[str, List[tuple]] = dict()  # game_id -> [(seq, type, args)] read from existing segments
+        self.running = False
+
+        # metrics
+        self.appended = 0
+        self.appended_bytes = 0
+        self.commits = 0
+        self.max_group = 0
+        self.last_commit_ms = 0
+        self.max_commit_ms = 0
+        self.deleted_segments = 0
+        self.recovered_events = 0
+        self.replayed_events = 0
+
+    def load(self):
+        # reads events of the existing segments (kept until their games are saved again), then starts a new segment
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = sorted(int(name.split(".")[1]) for name in os.listdir(self.directory)
+                         if name.startswith("events.") and name.endswith(".log") and name.split(".")[1].isdigit())
+        for number in numbers:
+            path = self._segment_path(number)
+            last_seq = dict()
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        game_id, seq, event_type, args = json.loads(line)
+                    except ValueError:
+                        # torn write at the end of the segment: everything before it is intact
+                        break
+                    self.recovered.setdefault(game_id, []).append((seq, event_type, args))
+                    last_seq[game_id] = seq
+                    self.recovered_events += 1
+            self.segments.append((path, last_seq))
+        self.next_segment = numbers[-1] + 1 if numbers else 0
+        self._open_segment()
+        self.running = True
+        threading.Thread(target=self._run, name="event-log", daemon=True).start()
+        atexit.register(self.close)
+        return self
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"events.{number:08d}.log")
+
+    def _open_segment(self):
+        self.file_path = self._segment_path(self.next_segment)
+        self.next_segment += 1
+        self.file = open(self.file_path, "a", encoding="utf-8")
+        self.file_events = 0
+        self.file_last_seq = dict()
+
+    def append(self, game_id: str, seq: int, event_type: str, args: tuple):
+        # called from the mailbox of the game; returns without waiting for the disk
+        line = json.dumps([game_id, seq, event_type, args], separators=(",", ":"), ensure_ascii=False) + "\n"
+        with self.condition:
+            self.buffer.append(line)
+            self.buffer_last_seq[game_id] = seq
+            self.appended += 1
+            self.appended_bytes += len(line)
+
+    def commit(self):
+        with self.write_lock:
+            with self.condition:
+                if len(self.buffer) == 0:
+                    return
+                lines, self.buffer = self.buffer, []
+                last_seq, self.buffer_last_seq = self.buffer_last_seq, dict()
+            start = time.perf_counter()
+            self.file.write("".join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file_events += len(lines)
+            self.file_last_seq.update(last_seq)
+            if self.file_events >= self.segment_events:
+                self.file.close()
+                self.segments.append((self.file_path, self.file_last_seq))
+                self._open_segment()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.commits += 1
+            self.max_group = max(self.max_group, len(lines))
+            self.last_commit_ms = elapsed_ms
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+
+    def snapshot_saved(self, game_id: str, seq: int):
+        # the snapshot of the game saved to storage includes all its events up to seq
+        if seq > self.saved_seq.get(game_id, -1):
+            self.saved_seq[game_id] = seq
+
+    def _delete_saved_segments(self):
+        with self.write_lock:
+            remaining = list()
+            for path, last_seq in self.segments:
+                if all(self.saved_seq.get(game_id, -1) >= seq for game_id, seq in last_seq.items()):
+                    os.remove(path)
+                    self.deleted_segments += 1
+                else:
+                    remaining.append((path, last_seq))
+            self.segments = remaining
+
+    def recovered_game_ids(self) -> List[str]:
+        return list(self.recovered)
+
+    def is_created_in_log(self, game_id: str) -> bool:
+        # all events of the game since its creation are in the log (it can be rebuilt without a saved snapshot)
+        events = self.recovered.get(game_id)
+        return events is not None and events[0][1] == "create"
+
+    def events_after(self, game_id: str, seq: int) -> List[tuple]:
+        # events read at startup that are not in the saved snapshot of the game (handed out once)
+        events = [e for e in self.recovered.pop(game_id, []) if e[0] > seq]
+        self.replayed_events += len(events)
+        return events
+
+    def discard(self, game_id: str):
+        # events of a game that can't be recovered (no saved snapshot and no create event) don't keep segments alive
+        events = self.recovered.pop(game_id, [])
+        if len(events) > 0:
+            self.snapshot_saved(game_id, events[-1][0])
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(self.commit_interval)
+                if not self.running:
+                    break
+            try:
+                self.commit()
+                if len(self.segments) > 0:
+                    self._delete_saved_segments()
+            except Exception as e:
+                logger.error(f"Error writing game events: {e}")
+
+    def close(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.commit()
+        with self.write_lock:
+            self.file.close()
+
+    def get_metrics(self):
+        with self.condition:
+            buffered = len(self.buffer)
+        return dict(
+            buffered=buffered,
+            appended=self.appended,
+            appended_bytes=self.appended_bytes,
+            commits=self.commits,
+            avg_group=self.appended / self.commits if self.commits else 0,
+            max_group=self.max_group,
+            last_commit_ms=self.last_commit_ms,
+            max_commit_ms=self.max_commit_ms,
+            segments=len(self.segments) + 1,
+            deleted_segments=self.deleted_segments,
+            recovered_events=self.recovered_events,
+            replayed_events=self.replayed_events,
+        )
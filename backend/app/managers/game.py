@@ -1,11 +1,15 @@
 import logging
-from threading import Timer
+import time
+import uuid
 from abc import abstractmethod
 from enum import Enum, auto
 from typing import Dict, Optional, List, Iterable, Union
 
 from backend.app.managers.entity import Player, Signal
-from backend.app.util.util import generate_id, generate_token, now, to_dict, DEFAULT_NUMBER_OF_ROUNDS
+from backend.app.managers.mailbox import GameMailbox
+from backend.app.managers.round_stats import RoundStats
+from backend.app.managers.scheduler import TimerHandle
+from backend.app.util.util import generate_id, generate_token, now, encode_message, DEFAULT_NUMBER_OF_ROUNDS
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +28,37 @@ class HostDecision(Enum):
     cancel = auto()
 
 
+def merge_status_messages(previous: dict, message: dict) -> Optional[dict]:
+    # combines two consecutive status messages (full snapshot or patch) into one,
+    # so a slow client can skip the older one without a gap in versions; None if they don't follow each other
+    if "status" in message:
+        return message
+    patch = message.get("status_patch")
+    if patch is None:
+        return None
+    if "status" in previous:
+        if previous.get("version") != patch["base_version"]:
+            return None
+        status = {**previous["status"], **patch["changes"]}
+        if "game_stats_append" in patch:
+            status["game_stats"] = list(status.get("game_stats") or []) + patch["game_stats_append"]
+        return dict(status=status, version=patch["version"])
+    old = previous.get("status_patch")
+    if old is None or old["version"] != patch["base_version"]:
+        return None
+    changes = {**old["changes"], **patch["changes"]}
+    merged = dict(game_id=patch["game_id"], version=patch["version"], base_version=old["base_version"], changes=changes)
+    if "game_stats" in patch["changes"]:
+        pass  # newer full list wins
+    elif "game_stats" in old["changes"]:
+        changes["game_stats"] = old["changes"]["game_stats"] + patch.get("game_stats_append", [])
+    else:
+        appended = old.get("game_stats_append", []) + patch.get("game_stats_append", [])
+        if len(appended) > 0:
+            merged["game_stats_append"] = appended
+    return dict(status_patch=merged)
+
+
 class AGame:
     # abstract class to represent games (SI, Brain, Erudit Quartet, etc.)
 
@@ -36,7 +71,30 @@ class AGame:
         self.game_state = GameState.running.name
         self.finalized = False  # if game is finalized, no new entries are allowed        
         self.player_ids_list = []
+        # recipients of broadcasts (host first), rebuilt only when players join or leave
+        self.recipient_ids: List[str] = []
+        self.recipient_id_set = set()
+        self.players_by_name: List[Player] = []  # players sorted for the status, rebuilt with the recipients
         self.game_save_handler = game_save_handler
+        # every broadcast status gets the next version; clients apply patches on top of the previous version
+        self.state_version = 0
+        self.last_broadcast_status: Optional[dict] = None
+        # status served over http: (state version, etag, status, encoded status); the etag also names this instance
+        # of the game, as versions start again from 0 when the game is loaded from storage
+        self.http_status: Optional[tuple] = None
+        self.instance_tag = uuid.uuid4().hex[:8]
+        # bumped by commands changing status fields without broadcasting a status (see get_unpublished_fields),
+        # so the status served over http follows them
+        self.unpublished_changes = 0
+        # all actions of the game are applied by the mailbox; broadcasts of a batch wait in the outbox
+        self.mailbox = GameMailbox(self)
+        self.last_activity = time.monotonic()  # last action submitted, for eviction of idle games
+        self.outbox: List[tuple] = []  # entries of (message, player_ids, supersedable, status snapshot)
+        self.replies: List[tuple] = []  # (socket, message) answering commands of the batch, sent after the outbox
+        # commands applied to the game are appended to the event log of the server (if enabled) with the next seq;
+        # the seq of the last applied command is saved in the snapshot, recovery replays the commands after it
+        self.event_seq = 0
+        self.replaying = False  # while True, commands only change the state (no broadcasts, saves or timers)
 
     def restore_from_data(self, game_data: dict):
         self.game_id = game_data["game_id"]
@@ -47,11 +105,12 @@ class AGame:
         self.host = Player(game_id = self.game_id,existing_id=game_data["host_user_id"], name=game_data.get("host_name", ""))
         self.players = {p['player_id']: Player(game_id = self.game_id,existing_id=p['player_id'], name=p['name'], restore_score=p.get('score',0)) for p in raw_game_data['players']}
         self.player_ids_list = list(self.players.keys())
+        self._rebuild_recipients()
 
 
     @abstractmethod
     def check_signals(self):
-        # checks incoming signals for individual game
+        # resolves signals accumulated by individual game (called when the accumulation deadline expires)
         pass
 
     @abstractmethod
@@ -95,37 +154,214 @@ class AGame:
     def log_stats(self):
         pass
 
-    def broadcast_event(self, message: any, player_ids: Optional[Iterable[str]] = None):
+    @abstractmethod
+    def apply_event(self, event_type: str, *args):
+        # applies a command read from the event log (see record_event)
+        pass
+
+    def record_event(self, event_type: str, *args):
+        # args must be JSON serializable, apply_event gets them back after a crash
+        event_log = self.server_manager.event_log
+        if event_log is None or self.replaying:
+            return
+        self.event_seq += 1
+        event_log.append(self.game_id, self.event_seq, event_type, args)
+
+    def replay_events(self, events: List[tuple]):
+        # events: (seq, type, args) logged after the snapshot the game was restored from
+        self.replaying = True
+        try:
+            for seq, event_type, args in events:
+                try:
+                    self.apply_event(event_type, *args)
+                except Exception as e:
+                    logger.error(f"Error replaying event {seq} ({event_type}) of game {self.game_id}: {e}")
+                self.event_seq = seq
+        finally:
+            self.replaying = False
+
+    def _rebuild_recipients(self):
+        recipients = [self.host.player_id] if self.host is not None else []
+        recipients.extend(p for p in self.players.keys() if p not in recipients)
+        self.recipient_ids = recipients
+        self.recipient_id_set = set(recipients)
+        self.players_by_name = sorted(self.players.values(), key=lambda pl: pl.name)
+
+    def submit(self, command, *args):
+        # queues an action for the game, applied (in order) by the single consumer of its mailbox
+        self.last_activity = time.monotonic()
+        self.mailbox.submit(command, *args)
+
+    def broadcast_event(self, message: any, player_ids: Optional[Iterable[str]] = None, supersedable: bool = False):
         # sends a message to all or subset of players
         # examples:
         # - send update with new score/stats -> all players
         # - send notification that the player won the battle for the button (to a single player)
         # - send notification that the player lost the battle for the button (to all players who tried to win)
-        for p in list(self.players.keys()) + [self.host.player_id]:
-            if player_ids is None or p in player_ids:
-                socket = self.server_manager.get_socket_by_player_id(p)
-                if socket is not None and socket.connected:
-                    try:
-                        socket.send(message)
-                    except Exception as e:
-                        logger.error(f"Error sending message to {p}: {e}")
-                        # if socket is not available, remove it from the list of players
-                        if p in self.players:
-                            del self.players[p]
-                # Disabled this for now as it block reconnect
-                # else:
-                #    self.server_manager.unregister_player(p)
+        # inside a mailbox batch the message is sent after the batch; the same message object sent again
+        # to the same players (e.g. signals to the host on every buzz) is sent once, at its latest position
+        if self.replaying:
+            return
+        if self.mailbox.in_batch:
+            player_ids = tuple(player_ids) if player_ids is not None else None
+            self.outbox = [e for e in self.outbox if e[0] is not message or e[1] != player_ids]
+            self.outbox.append((message, player_ids, supersedable, None))
+            return
+        self._send_event(message, player_ids, supersedable)
+
+    def flush_broadcasts(self):
+        # called by the mailbox after every batch
+        outbox, self.outbox = self.outbox, []
+        for message, player_ids, supersedable, status in outbox:
+            if status is not None:
+                self._publish_status(status)
+            else:
+                self._send_event(message, player_ids, supersedable)
+        replies, self.replies = self.replies, []
+        for socket, message in replies:
+            self._send_reply(socket, message)
+
+    def reply(self, socket, message: dict):
+        # answers the client that sent a command; inside a batch the reply goes after the broadcasts of the batch,
+        # so a client reacting to it (e.g. refetching the status over http) already sees the state the command produced
+        if self.mailbox.in_batch:
+            self.replies.append((socket, message))
+            return
+        self._send_reply(socket, message)
+
+    def _send_reply(self, socket, message: dict):
+        logger.info(f"Sending: {message}")
+        try:
+            socket.send(encode_message(message))
+        except Exception as e:
+            logger.error(f"Error sending reply to {getattr(socket, 'player_id', None)}: {e}")
+
+    def _send_event(self, message: any, player_ids: Optional[Iterable[str]], supersedable: bool):
+        # message is encoded to a JSON frame once and the same frame is queued for every recipient;
+        # supersedable frames (status updates) still queued for slow clients are merged with newer ones
+        frame = encode_message(message)
+        if player_ids is None:
+            recipients = self.recipient_ids
+        else:
+            recipients = [p for p in player_ids if p in self.recipient_id_set]
+        for p in recipients:
+            socket = self.server_manager.get_socket_by_player_id(p)
+            if socket is not None and socket.connected:
+                try:
+                    socket.send(frame, supersedable, message if supersedable else None)
+                except Exception as e:
+                    logger.error(f"Error sending message to {p}: {e}")
+            # Disabled this for now as it block reconnect
+            # else:
+            #    self.server_manager.unregister_player(p)
 
     def finalize_game(self):
         # if game is finalized no new players can join
+        self.record_event("finalize")
         self.finalized = True
+        self.unpublished_changes += 1
 
     def finish_game(self):
         self.game_state = GameState.finished.name
 
+    def is_finished(self):
+        return self.game_state == GameState.finished.name
+
+    def is_accepting_signals_phase(self):
+        # players need precise clock offsets while this is True (probed more often)
+        return False
+
+    def generate_snapshot(self) -> Optional[dict]:
+        # game type specific derived state saved next to the status, so restore_from_data doesn't recompute it
+        return None
+
+    def generate_status_message(self, status: dict):
+        # first broadcast is a full snapshot, afterwards only keys changed since the previous broadcast are sent
+        # game_stats only grows, so new entries are sent as game_stats_append instead of the whole list
+        # None when nothing changed: the version stays, so clients don't bump theirs for an empty patch
+        previous = self.last_broadcast_status
+        if previous is None:
+            self.state_version += 1
+            self.last_broadcast_status = status
+            return dict(status=status, version=self.state_version)
+
+        changes = dict()
+        for key, value in status.items():
+            if key != "game_stats" and previous.get(key) != value:
+                changes[key] = value
+        appended = None
+        old_stats = previous.get("game_stats") or []
+        new_stats = status.get("game_stats") or []
+        if len(new_stats) >= len(old_stats) and (len(old_stats) == 0 or new_stats[len(old_stats) - 1] == old_stats[-1]):
+            if len(new_stats) > len(old_stats):
+                appended = new_stats[len(old_stats):]
+        else:
+            changes["game_stats"] = new_stats
+        if len(changes) == 0 and appended is None:
+            return None
+
+        self.state_version += 1
+        self.last_broadcast_status = status
+        patch = dict(game_id=self.game_id, version=self.state_version, base_version=self.state_version - 1, changes=changes)
+        if appended is not None:
+            patch["game_stats_append"] = appended
+        return dict(status_patch=patch)
+
+    def generate_full_status_message(self):
+        # snapshot matching the latest broadcast version (sent on demand, e.g. after reconnect or a missed patch)
+        if self.last_broadcast_status is None:
+            return dict(status=self.generate_game_status()["status"], version=self.state_version)
+        return dict(status=self.last_broadcast_status, version=self.state_version)
+
+    def get_unpublished_fields(self) -> dict:
+        # status fields changed by commands that don't broadcast a status (clients learn about them otherwise)
+        return dict(finalized=1 if self.finalized else 0)
+
+    def get_http_status(self) -> tuple:
+        # (etag, status, encoded status) of the latest version, generated at most once per version
+        # version is read before the status, so the cached status is never older than its etag
+        version = (self.state_version, self.unpublished_changes)
+        cached = self.http_status
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+        status = self.last_broadcast_status
+        result = dict(status=dict(status, **self.get_unpublished_fields())) if status is not None else self.generate_game_status()
+        cached = (version, f'"{self.game_id}.{self.instance_tag}.{version[0]}.{version[1]}"', result, encode_message(result))
+        self.http_status = cached
+        return cached[1:]
+
+    def send_full_status(self, player_id: str):
+        self.broadcast_event(self.generate_full_status_message(), [player_id])
+
     def update_status(self):
+        # inside a mailbox batch only the latest status of the batch is broadcast and saved (status is taken now,
+        # so later changes in the batch don't leak into it)
+        if self.replaying:
+            return
         status = self.generate_game_status()
-        self.broadcast_event(status)
+        if self.mailbox.in_batch:
+            self.outbox = [e for e in self.outbox if e[3] is None]
+            self.outbox.append((None, None, True, status))
+            return
+        self._publish_status(status)
+
+    def _publish_status(self, status: dict):
+        message = self.generate_status_message(status["status"])
+        if message is not None:
+            self._send_event(message, None, True)
+        self._save_status(status)
+
+    def save_status(self):
+        # saves the current state without broadcasting it (e.g. before eviction, as not every command updates the status)
+        self._save_status(self.generate_game_status())
+
+    def _save_status(self, status: dict):
+        # derived state is taken when the status is published (after the batch), so it matches event_seq:
+        # commands of the batch that didn't update the status (e.g. signals) are in the snapshot, not replayed again
+        snapshot = self.generate_snapshot()
+        if snapshot is not None:
+            # saved with the status, not broadcast
+            status = dict(status, snapshot=snapshot)
 
         game_data = {
             "name": self.host.name,
@@ -140,9 +376,13 @@ class AGame:
             game_data=game_data,
             
         )
+        if self.game_state == GameState.finished.name:
+            # final state must not wait for the next write-behind flush
+            self.server_manager.flush_game(self.game_id)
 
     def register_player(self, player: Player):
         if not self.finalized:
+            self.record_event("register", player.player_id, player.name)
             player_id = player.player_id
             if player_id in self.players:
                 # if player is already registered, restore it's score
@@ -150,6 +390,7 @@ class AGame:
             self.players[player.player_id] = player
             if player_id not in self.player_ids_list:
                 self.player_ids_list.append(player.player_id)
+            self._rebuild_recipients()
 
     def unregister_player(self, player: Player):
         if player is not None:
@@ -157,12 +398,15 @@ class AGame:
                 player_id = player
             else:
                 player_id = player.player_id
+            self.record_event("unregister", player_id)
             del self.players[player_id]
             if player_id in self.player_ids_list:
                 self.player_ids_list.remove(player_id)
+            self._rebuild_recipients()
 
     def register_host(self, player: Player):
         self.host = player
+        self._rebuild_recipients()
         self.update_status()
 
 
@@ -171,6 +415,7 @@ class SIGame(AGame):
     DEFAULT_SIGNAL_ACCUMULATION_TIME = 1  # seconds
     DEFAULT_TIMER_COUNTDOWN = 5  # seconds
     DEFAULT_NOMINALS = [10, 20, 30,40, 50]
+    SNAPSHOT_VERSION = 2  # format of generate_snapshot; version 1 lacks the question state, others are restored from game_stats
 
 
     def __init__(self, server_manager, game_save_handler, number_of_rounds=DEFAULT_NUMBER_OF_ROUNDS):
@@ -185,8 +430,7 @@ class SIGame(AGame):
         self.game_stats = list()
 
         self.number_of_rounds = number_of_rounds
-        self.round_stats = [[{} for _ in range(len(self.nominals))] for _ in range(self.number_of_rounds)]
-        self.current_round_stats = self.round_stats[self.current_round]
+        self.round_stats = RoundStats(self.number_of_rounds, len(self.nominals))
         self.number_of_question_in_round = 0
         self.round_names = ["Тема #" + str(i+1) for i in range(0, self.number_of_rounds)]
 
@@ -201,6 +445,12 @@ class SIGame(AGame):
         self.failed_responders_ids: List[int] = []
         self.time_left: int = SIGame.DEFAULT_TIMER_COUNTDOWN
         self.question_stats: Dict[str, int] = dict()
+        self.timer_handle: Optional[TimerHandle] = None  # countdown timer running on the shared scheduler
+        self.signal_deadline: Optional[TimerHandle] = None  # armed by the first signal, resolves responders
+        # timers only submit commands to the mailbox; bumped whenever a timer is replaced or stopped,
+        # so commands still queued for the old one are ignored
+        self.timer_generation = 0
+        self.signal_deadline_generation = 0
 
         # keeps question stats: for each answered player it shows whether answer was correct (True) or not (False)
 
@@ -216,9 +466,79 @@ class SIGame(AGame):
         self.round_name = raw_game_data["round_name"]
         self.round_names = raw_game_data.get("round_names", self.round_names)
 
+        self.question_state = QuestionState[raw_game_data['question_state']]
+
+        snapshot = game_data["data"].get("snapshot")
+        if snapshot is None or snapshot.get("version") not in (1, SIGame.SNAPSHOT_VERSION) or not self._restore_from_snapshot(snapshot):
+            # saved before snapshots were introduced
+            self._restore_from_game_stats()
+        if self.question_state == QuestionState.awaiting_more_signals:
+            self.resume_signal_accumulation()
+
+    def resume_signal_accumulation(self):
+        # restored (or recovered from the event log) while signals were accumulating: the deadline didn't survive,
+        # the rest of the window is waited out
+        if len(self.signals) > 0:
+            elapsed = (now() - self.first_signal_ts) / 1000 if self.first_signal_ts is not None else 0
+            self._arm_signal_deadline(max(0, SIGame.DEFAULT_SIGNAL_ACCUMULATION_TIME - elapsed))
+        else:
+            # signals are not in the saved data (no snapshot, or a version 1 one): the question takes buzzes again,
+            # the next one arms a new deadline
+            self.question_state = QuestionState.running
+
+    def generate_snapshot(self) -> dict:
+        return dict(
+            version=SIGame.SNAPSHOT_VERSION,
+            event_seq=self.event_seq,
+            question_number=self.question_number,
+            nominal_index=self.nominal_index,
+            number_of_question_in_round=self.number_of_question_in_round,
+            player_ids=list(self.player_ids_list),
+            round_stats=self.round_stats.to_snapshot(),
+            # state of the current question, changed by commands that don't update the status
+            question_state=self.question_state.name,
+            finalized=self.finalized,
+            signals=[[s.player_id, s.server_ts, s.client_ts, s.adjusted_ts] for s in self.signals.values()],
+            first_signal_ts=self.first_signal_ts,
+            is_accepting_signals=self.is_accepting_signals,
+            is_host_notified_on_first_signal=self.is_host_notified_on_first_signal,
+            responder_ids=[p.player_id for p in self.responders],
+            failed_responders_ids=list(self.failed_responders_ids),
+            question_stats=dict(self.question_stats),
+            time_left=self.time_left,
+        )
+
+    def _restore_from_snapshot(self, snapshot: dict) -> bool:
+        round_stats = RoundStats.from_snapshot(self.number_of_rounds, len(self.nominals), snapshot["round_stats"])
+        if round_stats is None:
+            return False
+        self.round_stats = round_stats
+        self.question_number = snapshot["question_number"]
+        self.nominal_index = snapshot["nominal_index"]
+        self.number_of_question_in_round = snapshot["number_of_question_in_round"]
+        # players keep the order they joined in (status lists them by name)
+        ordered = [p for p in snapshot["player_ids"] if p in self.players]
+        restored = set(ordered)
+        self.player_ids_list = ordered + [p for p in self.player_ids_list if p not in restored]
+        if snapshot["version"] >= 2:
+            self.event_seq = snapshot["event_seq"]
+            self.question_state = QuestionState[snapshot["question_state"]]
+            self.finalized = snapshot["finalized"]
+            self.signals = {s[0]: Signal(*s) for s in snapshot["signals"]}
+            self.first_signal_ts = snapshot["first_signal_ts"]
+            self.is_accepting_signals = snapshot["is_accepting_signals"]
+            self.is_host_notified_on_first_signal = snapshot["is_host_notified_on_first_signal"]
+            self.responders = [self.players[p] for p in snapshot["responder_ids"] if p in self.players]
+            self.failed_responders_ids = snapshot["failed_responders_ids"]
+            self.question_stats = snapshot["question_stats"]
+            self.time_left = snapshot["time_left"]
+        return True
+
+    def _restore_from_game_stats(self):
         number_of_questions_in_round = len(self.nominals)
 
         # reconstruct round stats values based on game data
+        self.round_stats = RoundStats(self.number_of_rounds, number_of_questions_in_round)
         for r in self.game_stats:
             if r['player_stats'] is not None:
                 qn = r['question_number']
@@ -226,15 +546,12 @@ class SIGame(AGame):
                 qi = self.nominals.index(nominal) 
                 qr = qn // number_of_questions_in_round + 1
                 for (p,v) in r['player_stats'].items():
-                    self.round_stats[qr][qi][p] = 1 if v > 0 else -1
-
-        self.current_round_stats = self.round_stats[self.current_round]       
+                    self.round_stats.set_result(qr, qi, p, 1 if v > 0 else -1)
 
 
         self.nominal_index  = self.nominals.index(self.current_nominal)
         self.number_of_question_in_round = self.nominal_index - 1
         self.question_number = (self.current_round - 1) * number_of_questions_in_round + self.number_of_question_in_round
-        self.question_state = QuestionState[raw_game_data['question_state']]
 
     def apply_round_names_as_text(self,round_names_as_text):
         self.round_names = ["Тема #" + str(i+1) for i in range(0, self.number_of_rounds)]
@@ -247,10 +564,45 @@ class SIGame(AGame):
                 
 
     def set_round_names(self, round_names_as_text):
+        self.record_event("round_names", round_names_as_text)
         self.apply_round_names_as_text(round_names_as_text)
         self.update_status()
 
+    def apply_event(self, event_type: str, *args):
+        if event_type == "create":
+            # game created shortly before a crash, never saved
+            token, host_id, host_name, number_of_rounds, round_names_as_text = args
+            self.token = token
+            self.number_of_rounds = number_of_rounds
+            self.round_stats = RoundStats(self.number_of_rounds, len(self.nominals))
+            self.host = Player(host_name, self.game_id, host_id)
+            self._rebuild_recipients()
+            self.apply_round_names_as_text(round_names_as_text)
+        elif event_type == "register":
+            player_id, name = args
+            self.register_player(Player(name, self.game_id, player_id))
+        elif event_type == "unregister":
+            if args[0] in self.players:
+                self.unregister_player(args[0])
+        elif event_type == "finalize":
+            self.finalize_game()
+        elif event_type == "signal":
+            self.process_signal(Signal(*args))
+        elif event_type == "check_signals":
+            self.check_signals()
+        elif event_type == "decision":
+            self.process_host_decision(args[0])
+        elif event_type == "start_timer":
+            self.start_timer(args[0])
+        elif event_type == "tick":
+            self._run_timer(args[0])
+        elif event_type == "round_names":
+            self.set_round_names(args[0])
+        else:
+            logger.error(f"Unknown event {event_type} of game {self.game_id}")
+
     def reset(self, is_after_incorrect_answer: bool = False):
+        self._cancel_signal_deadline()
         self.signals = dict()
         self.is_host_notified_on_first_signal = False
         self.first_signal_ts = None
@@ -263,47 +615,33 @@ class SIGame(AGame):
             self.question_stats: Dict[str, int] = dict()
 
     def generate_game_status(self):
-        players = list(self.players.values())
-        players.sort(key=lambda pl: pl.name)
+        # built directly in its serialized form (no to_dict pass): every value is a fresh list/dict or immutable,
+        # so the result stays a valid snapshot while the game changes; logged game_stats entries are never modified
         status = dict()
-        players_stat = list()
-        for p in players:
-            players_stat.append(dict(name=p.name, player_id=p.player_id, score=p.score))
-        status['players'] = players_stat
+        status['players'] = [dict(name=p.name, player_id=p.player_id, score=p.score) for p in self.players_by_name]
         status['number_of_rounds'] = self.number_of_rounds
         status['nominal'] = self.current_nominal
         status['game_state'] = self.game_state
         status['question_state'] = self.question_state.name
-        status['responders'] = self.responders
+        status['responders'] = [p.to_dict() for p in self.responders]
         status['time_left'] = self.time_left
         status['finalized'] = 1 if self.finalized else 0
-        status["game_stats"] = self.game_stats
+        status["game_stats"] = list(self.game_stats)
         status['game_id'] = self.game_id
         status["game_token"] = self.token
         status['round_number'] = self.current_round
-        status['nominals'] = self.nominals
+        status['nominals'] = list(self.nominals)
         status['number_of_question_in_round'] = self.number_of_question_in_round
         status['round_name'] = self.round_names[self.current_round - 1] if self.round_names is not None and len(self.round_names) > 0 else None
-        status['round_names'] = self.round_names
+        status['round_names'] = list(self.round_names) if self.round_names is not None else None
         status['current_round_stats'] = self._generate_current_round_array()
-        result = dict(status=status)
-        result = to_dict(result)
-        return result
+        return dict(status=status)
+
+    def get_unpublished_fields(self) -> dict:
+        return dict(super().get_unpublished_fields(), question_state=self.question_state.name)
 
     def _generate_current_round_array(self):
-        result = list()
-        for p in self.player_ids_list:
-            player_data = list()
-            player = self.players[p]
-            player_data.append(player.name)
-            player_data.append(player.score)
-            for s in self.current_round_stats:
-                if p in s:
-                    player_data.append(s[p])
-                else:
-                    player_data.append(0)
-            result.append(player_data)
-        return result
+        return self.round_stats.round_table(self.current_round, [self.players[p] for p in self.player_ids_list])
 
     def log_stats(self):
         stats = dict(question_number=self.question_number, player_stats=self.question_stats,
@@ -311,6 +649,7 @@ class SIGame(AGame):
         self.game_stats.append(stats)
 
     def roll_to_next_question(self):
+        self.stop_timer()
         self.log_stats()
         self.question_number += 1
 
@@ -322,7 +661,6 @@ class SIGame(AGame):
             if self.nominal_index == 0:
                 self.current_round += 1
             self.current_nominal = self.nominals[self.nominal_index]
-            self.current_round_stats = self.round_stats[self.current_round]
             self.reset()
         else:
             self.reset()
@@ -336,6 +674,7 @@ class SIGame(AGame):
             return
         if isinstance(decision, str):
             decision = HostDecision[decision]
+        self.record_event("decision", decision.name)
 
         logger.info(f"decision: {decision}")
         responder = self.responders[0]
@@ -346,7 +685,7 @@ class SIGame(AGame):
             if decision == HostDecision.accept:
                 responder.score += self.current_nominal
                 self.question_stats[responder.player_id] = 1
-                self.current_round_stats[self.number_of_question_in_round] = self.question_stats
+                self.round_stats.set_result(self.current_round, self.number_of_question_in_round, responder.player_id, 1)
                 self.roll_to_next_question()
             else:
                 responder.score -= self.current_nominal
@@ -355,7 +694,7 @@ class SIGame(AGame):
                 self.is_accepting_signals = True
                 self.question_state = QuestionState.running
                 self.reset(is_after_incorrect_answer=True)
-                self.current_round_stats[self.number_of_question_in_round] = self.question_stats
+                self.round_stats.set_result(self.current_round, self.number_of_question_in_round, responder.player_id, -1)
                 self.update_status()
 
     def process_signal(self, signal: Signal):
@@ -371,11 +710,23 @@ class SIGame(AGame):
         if not self.is_accepting_signals:
             return
 
-        if len(self.signals) == 0:
+        self.record_event("signal", player_id, signal.server_ts, signal.client_ts, signal.adjusted_ts)
+        is_first_signal = len(self.signals) == 0
+        if is_first_signal:
+            # not broadcast: players keep buzzing until the window closes (served over http only)
             self.question_state = QuestionState.awaiting_more_signals
-            self.first_signal_ts = now()
+            self.unpublished_changes += 1
+            # a replayed signal keeps the time it was received, not the time of the recovery
+            self.first_signal_ts = signal.server_ts if self.replaying else now()
+            # responders are resolved exactly when the accumulation window closes (logged as check_signals)
+            self.signal_deadline_generation += 1
+            if not self.replaying:
+                self._arm_signal_deadline(SIGame.DEFAULT_SIGNAL_ACCUMULATION_TIME)
         self.signals[player_id] = signal
         self.broadcast_event(self.signals, [self.host.player_id])
+        if is_first_signal and not self.is_host_notified_on_first_signal:
+            self.notify_host(dict(action="game_paused"))
+            self.is_host_notified_on_first_signal = True
 
     def _detect_responders_list(self) -> List[Player]:
         responders: List[Player] = list()
@@ -393,44 +744,68 @@ class SIGame(AGame):
     def _sort_signals(self):
         self.signals = dict(sorted(self.signals.items(), key=lambda x: x[1].adjusted_ts))
 
-    def check_signals(self):
+    def check_signals(self, generation: Optional[int] = None):
+        if generation is not None and generation != self.signal_deadline_generation:
+            return
+        self.signal_deadline = None
         if self.question_state == QuestionState.answering:
             return
         if len(self.signals):
-            if not self.is_host_notified_on_first_signal:
-                message = dict(action="game_paused")
-                self.notify_host(message)
-                self.is_host_notified_on_first_signal = True
-            delta = now() - self.first_signal_ts
-            if  delta > SIGame.DEFAULT_SIGNAL_ACCUMULATION_TIME * 1000:
-                self.is_accepting_signals = False
-                logger.info(f"signal accumulation time expired, notifying players")
-                self.question_state = QuestionState.answering
-                self._sort_signals()
-                self.responders = self._detect_responders_list()
-                self.update_status()
+            self.record_event("check_signals")
+            self.is_accepting_signals = False
+            logger.info(f"signal accumulation time expired after {now() - self.first_signal_ts} ms, notifying players")
+            self.question_state = QuestionState.answering
+            self._sort_signals()
+            self.responders = self._detect_responders_list()
+            self.update_status()
 
-            else:
-                logger.info(f"delta = {delta}; keep signals accumulation")
+    def _arm_signal_deadline(self, delay: float):
+        if self.signal_deadline is not None:
+            self.signal_deadline.cancel()
+        self.signal_deadline = self.server_manager.scheduler.schedule(
+            delay, self.submit, self.check_signals, self.signal_deadline_generation)
+
+    def _cancel_signal_deadline(self):
+        self.signal_deadline_generation += 1
+        if self.signal_deadline is not None:
+            self.signal_deadline.cancel()
+            self.signal_deadline = None
 
     def notify_host(self, message):
         logger.info(f"notifying host")
         self.broadcast_event(message, player_ids=[self.host.player_id])
 
-    def _run_timer(self, timer: Timer, interval:int):
+    def _run_timer(self, interval:int, generation: Optional[int] = None):
+        if generation is not None and generation != self.timer_generation:
+            return
+        self.record_event("tick", interval)
         logger.info(f"running _run_timer")
         if self.question_state != QuestionState.running:
             # if signal is received, stopping countdown
-            timer.cancel()
+            self.stop_timer()
         if self.time_left > 0:
             self.update_status()
             self.time_left -= interval
         else:
             self.roll_to_next_question()
             self.update_status()
-            timer.cancel()
+
+    def is_accepting_signals_phase(self):
+        return self.timer_handle is not None or self.question_state == QuestionState.awaiting_more_signals
 
     def start_timer(self, interval=1):
-        timer = Timer(interval, self.start_timer, [interval])
-        self._run_timer(timer, interval)
-        timer.start()
+        # restarting the countdown replaces the running one instead of adding a second chain
+        self.record_event("start_timer", interval)
+        self.stop_timer()
+        if self.replaying:
+            # countdown isn't resumed after recovery, its ticks are replayed from the log
+            return
+        self.server_manager.ntp_manager.probe_soon(self.player_ids_list)
+        self.timer_handle = self.server_manager.scheduler.schedule_repeating(
+            interval, self.submit, self._run_timer, interval, self.timer_generation, delay=0)
+
+    def stop_timer(self):
+        self.timer_generation += 1
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
@@ -0,0 +1,91 @@
+# this class serializes all mutations of a single game: socket threads, timers and cluster messages only enqueue
+# commands, and a single consumer applies them one by one in submission order, so game state needs no locks
+# commands queued while the game is busy are applied as one batch; broadcasts of the batch are sent after it,
+# with repeated status updates (and repeated notifications of the same message) coalesced into one
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class GameMailbox:
+
+    DEFAULT_MAX_BATCH = 64  # commands applied before other games get their turn on the executor
+
+    def __init__(self, game, max_batch: int = DEFAULT_MAX_BATCH):
+        self.game = game
+        self.max_batch = max_batch
+        self.queue = deque()  # entries of (command, args, enqueued_at)
+        self.lock = threading.Lock()
+        self.scheduled = False  # a drain is queued on (or running in) the executor
+        self.in_batch = False
+        self.evicted = False  # set by GameResidency when the game is dropped from memory, under the lock
+
+        # metrics
+        self.commands = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.total_wait_ms = 0  # time commands spent in the queue before being applied
+        self.max_wait_ms = 0
+
+    def submit(self, command, *args):
+        # can be called from any thread
+        with self.lock:
+            self.queue.append((command, args, time.monotonic()))
+            evicted, self.evicted = self.evicted, False
+            schedule = not self.scheduled
+            self.scheduled = True
+        if evicted:
+            # a reference taken before the eviction is still in use: the game goes back to memory, so its
+            # commands are not applied to an instance nobody saves, and no second copy is loaded
+            self.game.server_manager.residency.reinstate(self.game)
+        if schedule:
+            self.game.server_manager.game_executor.submit(self._drain)
+
+    def _drain(self):
+        with self.lock:
+            batch = [self.queue.popleft() for _ in range(min(self.max_batch, len(self.queue)))]
+        self.in_batch = True
+        try:
+            for command, args, enqueued_at in batch:
+                wait_ms = (time.monotonic() - enqueued_at) * 1000
+                self.total_wait_ms += wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+                try:
+                    command(*args)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error in command {command} of game {self.game.game_id}: {e}")
+        finally:
+            self.in_batch = False
+            self.commands += len(batch)
+            self.batches += 1
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            try:
+                self.game.flush_broadcasts()
+            except Exception as e:
+                logger.error(f"Error broadcasting batch of game {self.game.game_id}: {e}")
+            with self.lock:
+                # commands arrived meanwhile go to the back of the executor queue, so busy games don't starve others
+                self.scheduled = len(self.queue) > 0
+                reschedule = self.scheduled
+            if reschedule:
+                self.game.server_manager.game_executor.submit(self._drain)
+
+    def pending(self):
+        with self.lock:
+            return len(self.queue)
+
+    def get_metrics(self):
+        return dict(
+            pending=self.pending(),
+            commands=self.commands,
+            failed=self.failed,
+            batches=self.batches,
+            max_batch=self.max_batch_size,
+            avg_wait_ms=self.total_wait_ms / self.commands if self.commands else 0,
+            max_wait_ms=self.max_wait_ms,
+        )
@@ -3,92 +3,245 @@
 # so we compare when the signal was emitted, not when it was received
 import logging
 import threading
-from typing import Dict, List
+import time
+from array import array
+from typing import Dict, List, Optional, Iterable
 
-from backend.app.util.util import now
+from backend.app.util.util import now, encode_message
 
 logger = logging.getLogger(__name__)
 
-class NtpBean:
-
-    def __init__(self):
-        self.t1: int = 0  # server_out_ts
-        self.t2: int = 0  # client_ts
-        self.t3: int = 0  # server_in_ts
-        self.lag = 0
-
-        self.recalc_lag()
-
-    def recalc_lag(self):
-        self.lag = (self.t3 - self.t1) / 2
-
-
 class NtpManager:
-    # holds a series of NpbBeans and calculates a sliding average
+    # clock offset estimator for all players: samples live in shared flat arrays, one row of WINDOW samples per player
+    # every probe gives t1 (server_out_ts), t2 (client_ts) and t3 (server_in_ts):
+    #   rtt = t3 - t1, offset = t2 - (t1 + t3) / 2 (how far the client clock is ahead of the server clock)
+    # a sample is off by at most rtt / 2, so the estimate averages only the samples with the lowest rtt in the window;
+    # one delayed probe can't move it. Estimates are cached per row, get_lag is a single array lookup
+
+    WINDOW = 8  # samples kept per player
+    RTT_TOLERANCE_MS = 5  # samples with rtt up to min rtt + tolerance are averaged
+    INITIAL_CAPACITY = 64  # rows, doubled when exhausted
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.capacity = 0
+        self.offsets = array("d")  # capacity * WINDOW
+        self.rtts = array("d")  # capacity * WINDOW
+        self.counts = array("q")  # samples received per row
+        self.lags = array("d")  # cached offset estimate per row
+        self.errors = array("d")  # cached error bound (min rtt / 2) per row
+        self.spreads = array("d")  # cached max - min of the offsets the estimate is based on, per row
+        self.rows: Dict[str, int] = dict()
+        self.free_rows: List[int] = list()
+        self.lock = threading.Lock()  # guards row allocation; samples of a row are written by its player only
+        self._grow(capacity)
+
+        # metrics
+        self.samples = 0
+        self.rejected = 0
+
+    def _grow(self, capacity: int):
+        # must be called with self.lock held (or from __init__)
+        added = capacity - self.capacity
+        self.offsets.extend([0.0] * (added * NtpManager.WINDOW))
+        self.rtts.extend([0.0] * (added * NtpManager.WINDOW))
+        self.counts.extend([0] * added)
+        self.lags.extend([0.0] * added)
+        self.errors.extend([0.0] * added)
+        self.spreads.extend([0.0] * added)
+        self.free_rows.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def register(self, player_id: str):
+        with self.lock:
+            row = self.rows.get(player_id)
+            if row is None:
+                if len(self.free_rows) == 0:
+                    self._grow(self.capacity * 2)
+                row = self.rows[player_id] = self.free_rows.pop()
+            self.counts[row] = 0
+            self.lags[row] = 0
+            self.errors[row] = 0
+            self.spreads[row] = 0
+
+    def unregister(self, player_id: str):
+        with self.lock:
+            row = self.rows.pop(player_id, None)
+            if row is not None:
+                self.free_rows.append(row)
+
+    def process_response(self, player_id: str, server_out_ts, server_in_ts, client_ts):
+        row = self.rows.get(player_id)
+        if row is None or server_out_ts is None or server_in_ts is None or client_ts is None:
+            self.rejected += 1
+            return
+        rtt = server_in_ts - server_out_ts
+        if rtt < 0:
+            self.rejected += 1
+            return
+        count = self.counts[row]
+        base = row * NtpManager.WINDOW
+        slot = base + count % NtpManager.WINDOW
+        self.offsets[slot] = client_ts - (server_out_ts + server_in_ts) / 2
+        self.rtts[slot] = rtt
+        self.counts[row] = count + 1
+        self.samples += 1
+
+        # recompute the cached estimate from the min-rtt samples of the window
+        end = base + min(count + 1, NtpManager.WINDOW)
+        min_rtt = min(self.rtts[base:end])
+        limit = min_rtt + NtpManager.RTT_TOLERANCE_MS
+        total = 0.0
+        used = 0
+        low = high = None
+        for i in range(base, end):
+            if self.rtts[i] <= limit:
+                offset = self.offsets[i]
+                total += offset
+                used += 1
+                low = offset if low is None or offset < low else low
+                high = offset if high is None or offset > high else high
+        self.lags[row] = total / used
+        self.errors[row] = min_rtt / 2
+        self.spreads[row] = high - low
 
-    ARRAY_SIZE = 8
+    def get_lag(self, player_id: str):
+        row = self.rows.get(player_id)
+        return self.lags[row] if row is not None else 0
 
-    def __init__(self):
-        self.counter:int = 0
-        self.monitor: List[NtpBean] = [NtpBean() for _ in range(NtpManager.ARRAY_SIZE)]
+    def get_estimate(self, player_id: str) -> Optional[dict]:
+        # confidence of the offset: it is off by at most error_ms, based on that many samples
+        row = self.rows.get(player_id)
+        if row is None:
+            return None
+        return dict(offset=self.lags[row], error_ms=self.errors[row], spread_ms=self.spreads[row],
+                    samples=min(self.counts[row], NtpManager.WINDOW))
 
-    def process_response(self, server_out_ts, server_in_ts, client_ts):
-        ntpbean = self.monitor[self.counter%NtpManager.ARRAY_SIZE]
-        ntpbean.t1 = server_out_ts
-        ntpbean.t2 = client_ts
-        ntpbean.t3 = server_in_ts
-        ntpbean.recalc_lag()
-        self.counter += 1
+    def is_stable(self, player_id: str, min_samples: int, max_spread_ms: float) -> bool:
+        row = self.rows.get(player_id)
+        return row is not None and self.counts[row] >= min_samples and self.spreads[row] <= max_spread_ms
 
-    def get_lag(self):
-        offset_array = [x.lag for x in self.monitor if x.t1 != 0]
-        if len(offset_array) == 0:
-            return 0
+    def get_metrics(self):
+        return dict(players=len(self.rows), capacity=self.capacity, samples=self.samples, rejected=self.rejected)
 
-        offset = sum(offset_array) / len(offset_array)
-        return offset
 
 class NtpServer:
+    # sends offset_check probes: a burst right after a player connects, then every BASE_INTERVAL seconds,
+    # backing off up to MAX_INTERVAL while the offset estimate is stable; while a question accepts signals
+    # (and right before, when the countdown starts) players of that game are probed every ACTIVE_INTERVAL
+    # players of finished games are not probed; due probes are collected and sent in one pass every TICK seconds
+
+    TICK = 0.25  # seconds
+    BURST_PROBES = 4  # samples collected quickly after connect
+    BURST_INTERVAL = 0.25
+    BASE_INTERVAL = 1
+    MAX_INTERVAL = 8
+    ACTIVE_INTERVAL = 0.5
+    STABLE_SPREAD_MS = 5  # offsets agreeing within this range are stable
+    RATE_WINDOW = 10  # seconds the probe rate metric is computed over
 
     def __init__(self, server_manager):
-        self.ntp_map: Dict[str, NtpManager] = dict()
+        self.ntp_manager = NtpManager()
         self.server_manager = server_manager
         self.player_ids = set()
+        self.intervals: Dict[str, float] = dict()  # current probe interval per player (without the active phase)
+        self.next_probe_at: Dict[str, float] = dict()
+
+        # metrics
+        self.probes_sent = 0
+        self.skipped_finished = 0
+        self.probe_rate = 0  # probes per second, over the last RATE_WINDOW seconds
+        self.rate_window_start = time.monotonic()
+        self.rate_window_probes = 0
 
     def process_response(self, data):
         player_id = data.get("player_id")
-        ntp_manager = self.ntp_map.get(player_id)
-        ntp_manager.process_response(
+        self.ntp_manager.process_response(
+            player_id,
             data.get("server_out_ts"),
             data.get("server_in_ts"),
             data.get("client_ts"))
-        return ntp_manager.get_lag()
+        if player_id in self.intervals:
+            self.intervals[player_id] = self._next_interval(player_id)
+        return self.ntp_manager.get_estimate(player_id)
+
+    def _next_interval(self, player_id: str) -> float:
+        estimate = self.ntp_manager.get_estimate(player_id)
+        if estimate is None or estimate["samples"] < NtpServer.BURST_PROBES:
+            return NtpServer.BURST_INTERVAL
+        if self.ntp_manager.is_stable(player_id, NtpServer.BURST_PROBES, NtpServer.STABLE_SPREAD_MS):
+            return min(max(self.intervals[player_id], NtpServer.BASE_INTERVAL) * 2, NtpServer.MAX_INTERVAL)
+        return NtpServer.BASE_INTERVAL
 
     def register_player(self, player_id: str):
-        self.ntp_map[player_id] = NtpManager()
+        self.ntp_manager.register(player_id)
+        self.intervals[player_id] = NtpServer.BURST_INTERVAL
+        self.next_probe_at[player_id] = 0
         self.player_ids.add(player_id)
 
     def unregister_player(self, player_id: str):
-        del self.ntp_map[player_id]
-        self.player_ids.remove(player_id)
+        self.ntp_manager.unregister(player_id)
+        self.player_ids.discard(player_id)
+        self.intervals.pop(player_id, None)
+        self.next_probe_at.pop(player_id, None)
+
+    def probe_soon(self, player_ids: Iterable[str]):
+        # players are about to send signals (countdown starts): refresh their offsets with the next batch
+        for player_id in player_ids:
+            if player_id in self.next_probe_at:
+                self.next_probe_at[player_id] = 0
 
     def get_lag(self, player_id: str):
-        ntp_manager = self.ntp_map.get(player_id)
-        return ntp_manager.get_lag() if ntp_manager is not None else 0
+        return self.ntp_manager.get_lag(player_id)
+
+    def get_estimate(self, player_id: str):
+        return self.ntp_manager.get_estimate(player_id)
+
+    def get_metrics(self):
+        metrics = self.ntp_manager.get_metrics()
+        metrics.update(probes_sent=self.probes_sent, probes_per_second=self.probe_rate,
+                       skipped_finished=self.skipped_finished,
+                       backed_off=sum(1 for i in list(self.intervals.values()) if i > NtpServer.BASE_INTERVAL))
+        return metrics
 
     def _monitor(self):
+        now_monotonic = time.monotonic()
+        due = list()
         for player_id in self.player_ids.copy():
+            next_probe_at = self.next_probe_at.get(player_id)
+            if next_probe_at is None or next_probe_at > now_monotonic:
+                continue
+            interval = self.intervals.get(player_id, NtpServer.BASE_INTERVAL)
+            game = self.server_manager.get_game_by_player_id(player_id)
+            if game is not None:
+                if game.is_finished():
+                    self.skipped_finished += 1
+                    self.next_probe_at[player_id] = now_monotonic + NtpServer.MAX_INTERVAL
+                    continue
+                if game.is_accepting_signals_phase():
+                    interval = min(interval, NtpServer.ACTIVE_INTERVAL)
+            self.next_probe_at[player_id] = now_monotonic + interval
+            due.append(player_id)
+
+        # one timestamp for the whole batch
+        server_out_ts = now()
+        for player_id in due:
             socket = self.server_manager.get_socket_by_player_id(player_id)
             if socket is not None and socket.connected is True:
-                ping_message = dict(action="offset_check", player_id=player_id, server_out_ts=now())
+                ping_message = dict(action="offset_check", player_id=player_id, server_out_ts=server_out_ts)
                 try:
-                    socket.send(ping_message)
+                    socket.send(encode_message(ping_message))
+                    self.probes_sent += 1
+                    self.rate_window_probes += 1
                 except Exception as e:
                     logger.error(f"Error: {e}")
             # disabled teporarily to allow reconnect
             # else:
             #    self.server_manager.unregister_player(player_id)
 
-    def monitor(self, interval=1):
-        self._monitor()
-        threading.Timer(interval, self.monitor, [interval]).start()
\ No newline at end of file
+        if now_monotonic - self.rate_window_start >= NtpServer.RATE_WINDOW:
+            self.probe_rate = self.rate_window_probes / (now_monotonic - self.rate_window_start)
+            self.rate_window_start = now_monotonic
+            self.rate_window_probes = 0
+
+    def monitor(self, interval=TICK):
+        self.server_manager.scheduler.schedule_repeating(interval, self._monitor, delay=0)
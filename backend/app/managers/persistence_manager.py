@@ -0,0 +1,119 @@
+# this class is responsible for write-behind persistence of game snapshots
+# games hand over their latest status on every update, only the newest snapshot per game is kept
+# and a background thread writes dirty snapshots through the real save handler
+import atexit
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class GamePersister:
+
+    DEFAULT_FLUSH_INTERVAL = 2  # seconds
+    DEFAULT_MAX_DIRTY = 50  # number of games waiting to be saved that triggers an early flush
+
+    def __init__(self, save_handler, flush_interval: float = None, max_dirty: int = None, saved_handler=None):
+        self.save_handler = save_handler
+        # called with the arguments of every successful save (e.g. to trim the event log of the game)
+        self.saved_handler = saved_handler
+        if flush_interval is None:
+            flush_interval = float(os.getenv("SI_SAVE_INTERVAL", GamePersister.DEFAULT_FLUSH_INTERVAL))
+        if max_dirty is None:
+            max_dirty = int(os.getenv("SI_SAVE_MAX_DIRTY", GamePersister.DEFAULT_MAX_DIRTY))
+        self.flush_interval = flush_interval
+        self.max_dirty = max(1, max_dirty)
+
+        self.pending: Dict[str, dict] = dict()  # map of [game_id -> arguments of the latest save call]
+        self.condition = threading.Condition()
+        # held while a batch is taken and written, so writes of the same game never overtake each other
+        self.write_lock = threading.Lock()
+        self.running = True
+
+        # metrics
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0
+        self.max_flush_ms = 0
+        self.total_flush_ms = 0
+
+        self.thread = threading.Thread(target=self._run, name="game-persister", daemon=True)
+        self.thread.start()
+        atexit.register(self.shutdown)
+
+    def save(self, game_id: str, **kwargs):
+        # same signature as game_save_handler: remembers the snapshot and returns immediately
+        with self.condition:
+            if game_id in self.pending:
+                self.coalesced += 1
+            self.pending[game_id] = dict(game_id=game_id, **kwargs)
+            self.submitted += 1
+            if len(self.pending) >= self.max_dirty:
+                self.condition.notify()
+
+    def flush(self, game_id: str = None):
+        # synchronously writes pending snapshots: all of them or only the one of the given game
+        with self.write_lock:
+            with self.condition:
+                if game_id is None:
+                    batch = list(self.pending.values())
+                    self.pending.clear()
+                else:
+                    entry = self.pending.pop(game_id, None)
+                    batch = [entry] if entry is not None else []
+            self._write(batch)
+
+    def _write(self, batch: List[dict]):
+        if len(batch) == 0:
+            return
+        start = time.perf_counter()
+        for entry in batch:
+            try:
+                self.save_handler(**entry)
+                self.written += 1
+                if self.saved_handler is not None:
+                    self.saved_handler(entry)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error saving game {entry.get('game_id')}: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.running and len(self.pending) < self.max_dirty:
+                    self.condition.wait(self.flush_interval)
+                if not self.running:
+                    break
+            self.flush()
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.flush()
+
+    def get_metrics(self):
+        with self.condition:
+            queue_depth = len(self.pending)
+        return dict(
+            queue_depth=queue_depth,
+            submitted=self.submitted,
+            coalesced=self.coalesced,
+            written=self.written,
+            failed=self.failed,
+            flushes=self.flushes,
+            last_flush_ms=self.last_flush_ms,
+            max_flush_ms=self.max_flush_ms,
+            avg_flush_ms=self.total_flush_ms / self.flushes if self.flushes else 0,
+        )
@@ -0,0 +1,208 @@
+# this class keeps the set of games held in memory bounded: games are ordered by last access (LRU)
+# and a periodic sweep evicts finished or idle games without connected players, after their latest snapshot
+# is written; when the count or memory budget is exceeded, least recently used games without connected
+# players go first. Evicted games are loaded again through game_loader on the next access
+# an eviction runs in the mailbox of the game (after the commands queued before it), and an evicted instance still
+# referenced somewhere is put back on its next command or lookup, so a game never has two instances in memory
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from backend.app.util.util import encode_message
+
+logger = logging.getLogger(__name__)
+
+
+class GameResidency:
+
+    DEFAULT_MAX_GAMES = 1000
+    DEFAULT_IDLE_TIMEOUT = 1800  # seconds without actions after which a game without connected players is evicted
+    DEFAULT_MEMORY_BUDGET_MB = 0  # estimated size of all resident games, 0 - no budget
+    SWEEP_INTERVAL = 30  # seconds
+
+    def __init__(self, server_manager, max_games: int = None, idle_timeout: float = None, memory_budget_mb: float = None):
+        self.server_manager = server_manager
+        self.max_games = max_games if max_games is not None else \
+            int(os.getenv("SI_MAX_GAMES", GameResidency.DEFAULT_MAX_GAMES))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else \
+            float(os.getenv("SI_GAME_IDLE_TIMEOUT", GameResidency.DEFAULT_IDLE_TIMEOUT))
+        memory_budget_mb = memory_budget_mb if memory_budget_mb is not None else \
+            float(os.getenv("SI_GAMES_MEMORY_MB", GameResidency.DEFAULT_MEMORY_BUDGET_MB))
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        # game_id -> size estimate (bytes) and the state version it was computed for
+        self.sizes = dict()
+        # guards the storage of games (and the token map) between lookups, the sweep and evictions
+        self.lock = threading.RLock()
+        # evicted games still referenced (e.g. by a socket thread about to submit a command): game_id -> game
+        self.evicted = weakref.WeakValueDictionary()
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.evicted_finished = 0
+        self.evicted_idle = 0
+        self.evicted_pressure = 0
+        self.reinstated = 0
+        self.last_sweep_ms = 0
+
+    @staticmethod
+    def create_storage() -> OrderedDict:
+        # storage of resident games, in LRU order (least recently used first)
+        return OrderedDict()
+
+    def touch(self, game_id: str):
+        games = self.server_manager.games
+        if game_id in games:
+            games.move_to_end(game_id)
+
+    def record_hit(self, game_id: str):
+        self.hits += 1
+        self.touch(game_id)
+
+    def record_miss(self, loaded: bool):
+        self.misses += 1
+        if loaded:
+            self.loads += 1
+
+    def start(self):
+        self.server_manager.scheduler.schedule_repeating(GameResidency.SWEEP_INTERVAL, self.sweep)
+
+    def _has_connected_players(self, game) -> bool:
+        for player_id in game.recipient_ids:
+            socket = self.server_manager.get_socket_by_player_id(player_id)
+            if socket is not None and socket.connected:
+                return True
+        return False
+
+    def _is_evictable(self, game) -> bool:
+        # running countdown, queued commands or connected players keep the game in memory
+        if game.mailbox.pending() > 0 or game.mailbox.scheduled:
+            return False
+        return self._is_idle(game)
+
+    def _is_idle(self, game) -> bool:
+        return not self._has_connected_players(game) and not game.is_accepting_signals_phase()
+
+    def estimated_size(self, game) -> int:
+        # size of the encoded full status, recomputed only when the game has changed
+        cached = self.sizes.get(game.game_id)
+        if cached is not None and cached[1] == game.state_version:
+            return cached[0]
+        size = len(encode_message(game.generate_full_status_message()))
+        self.sizes[game.game_id] = (size, game.state_version)
+        return size
+
+    def sweep(self):
+        # picks the games to evict, the evictions themselves are applied by the mailboxes of the games
+        start = time.perf_counter()
+        now_monotonic = time.monotonic()
+        with self.lock:
+            games = list(self.server_manager.games.values())
+        remaining = len(games)
+        candidates = set()
+        for game in games:
+            if not self._is_evictable(game):
+                continue
+            if game.is_finished():
+                game.mailbox.submit(self._evict, game, "finished")
+            elif now_monotonic - game.last_activity > self.idle_timeout:
+                game.mailbox.submit(self._evict, game, "idle")
+            else:
+                continue
+            candidates.add(game.game_id)
+            remaining -= 1
+
+        # over the limits: least recently used games without connected players go first
+        resident_bytes = sum(self.estimated_size(g) for g in games if g.game_id not in candidates) \
+            if self.memory_budget > 0 else 0
+        for game in games:
+            if remaining <= self.max_games and resident_bytes <= self.memory_budget:
+                break
+            if game.game_id not in candidates and self._is_evictable(game):
+                if self.memory_budget > 0:
+                    resident_bytes -= self.estimated_size(game)
+                game.mailbox.submit(self._evict, game, "pressure")
+                remaining -= 1
+        self.last_sweep_ms = (time.perf_counter() - start) * 1000
+
+    def _evict(self, game, reason: str):
+        # mailbox command: the game may have got players or commands since the sweep picked it
+        if not self._is_idle(game) or (reason == "idle" and time.monotonic() - game.last_activity <= self.idle_timeout):
+            return
+        # not every command updates the status, the current state is saved, and stored before the game can be loaded again
+        game.save_status()
+        self.server_manager.flush_game(game.game_id)
+        with self.lock:
+            with game.mailbox.lock:
+                if len(game.mailbox.queue) > 0:
+                    return
+                # commands submitted from now on put the game back (see reinstate)
+                game.mailbox.evicted = True
+            self.evict(game)
+        if reason == "finished":
+            self.evicted_finished += 1
+        elif reason == "idle":
+            self.evicted_idle += 1
+        else:
+            self.evicted_pressure += 1
+
+    def evict(self, game):
+        server_manager = self.server_manager
+        with self.lock:
+            if server_manager.games.get(game.game_id) is game:
+                del server_manager.games[game.game_id]
+            if server_manager.game_token_to_id.get(game.token) == game.game_id:
+                del server_manager.game_token_to_id[game.token]
+            # found by id or token
+            self.evicted[game.game_id] = game
+            self.evicted[game.token] = game
+            # counted under the lock: get_game_by_id compares it to detect evictions during a read from storage
+            self.evictions += 1
+        for player_id in game.recipient_ids:
+            if server_manager.player_id_to_game.get(player_id) is game:
+                del server_manager.player_id_to_game[player_id]
+            socket = server_manager.player_id_to_socket.get(player_id)
+            if socket is not None and not socket.connected:
+                del server_manager.player_id_to_socket[player_id]
+            server_manager.ntp_manager.unregister_player(player_id)
+        self.sizes.pop(game.game_id, None)
+        logger.info(f"Evicted game {game.game_id} from memory")
+
+    def find_evicted(self, game_id: str):
+        # evicted instance of the game that is still referenced, put back instead of loading a copy from storage
+        with self.lock:
+            game = self.evicted.get(game_id)
+            if game is not None:
+                self.reinstate(game)
+            return game
+
+    def reinstate(self, game):
+        with self.lock:
+            if self.evicted.get(game.game_id) is not game:
+                return
+            self.evicted.pop(game.game_id, None)
+            self.evicted.pop(game.token, None)
+            game.mailbox.evicted = False
+            self.server_manager.games[game.game_id] = game
+            self.server_manager.game_token_to_id[game.token] = game.game_id
+            self.reinstated += 1
+        logger.info(f"Game {game.game_id} is back in memory")
+
+    def get_metrics(self):
+        return dict(
+            resident=len(self.server_manager.games),
+            hits=self.hits,
+            misses=self.misses,
+            loads=self.loads,
+            evictions=self.evictions,
+            evicted_finished=self.evicted_finished,
+            evicted_idle=self.evicted_idle,
+            evicted_pressure=self.evicted_pressure,
+            reinstated=self.reinstated,
+            last_sweep_ms=self.last_sweep_ms,
+        )
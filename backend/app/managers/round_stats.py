@@ -0,0 +1,60 @@
+# this class keeps results of all questions of a game: one int8 cell per (player, round, question in round)
+# holding 1 (correct answer), -1 (wrong answer) or 0 (no answer)
+# cells live in one flat array laid out player slot first: (slot * rounds + round - 1) * questions + question,
+# so all results of a player in a round are one contiguous slice, and new players only extend the array
+import base64
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+
+class RoundStats:
+
+    def __init__(self, number_of_rounds: int, questions_in_round: int):
+        self.number_of_rounds = number_of_rounds
+        self.questions_in_round = questions_in_round
+        self.row_size = number_of_rounds * questions_in_round  # cells per player slot
+        self.cells = array("b")
+        self.slots: Dict[str, int] = dict()
+
+    def to_snapshot(self) -> dict:
+        # player ids in slot order and the raw cells (base64), restored without replaying any question
+        return dict(players=list(self.slots), cells=base64.b64encode(self.cells.tobytes()).decode("ascii"))
+
+    @staticmethod
+    def from_snapshot(number_of_rounds: int, questions_in_round: int, snapshot: dict) -> Optional["RoundStats"]:
+        # None if the snapshot doesn't match the dimensions of the game
+        round_stats = RoundStats(number_of_rounds, questions_in_round)
+        round_stats.cells.frombytes(base64.b64decode(snapshot["cells"]))
+        if len(round_stats.cells) != len(snapshot["players"]) * round_stats.row_size:
+            return None
+        round_stats.slots = {player_id: slot for slot, player_id in enumerate(snapshot["players"])}
+        return round_stats
+
+    def slot(self, player_id: str) -> int:
+        slot = self.slots.get(player_id)
+        if slot is None:
+            slot = self.slots[player_id] = len(self.slots)
+            self.cells.extend(bytes(self.row_size))
+        return slot
+
+    def _offset(self, player_id: str, round_number: int) -> int:
+        # rounds are numbered from 1
+        return (self.slot(player_id) * self.number_of_rounds + round_number - 1) * self.questions_in_round
+
+    def set_result(self, round_number: int, question: int, player_id: str, value: int):
+        self.cells[self._offset(player_id, round_number) + question] = value
+
+    def round_results(self, round_number: int, player_id: str) -> List[int]:
+        # results of the player for every question of the round
+        if player_id not in self.slots:
+            return [0] * self.questions_in_round
+        offset = self._offset(player_id, round_number)
+        return self.cells[offset:offset + self.questions_in_round].tolist()
+
+    def round_points(self, round_number: int, player_id: str, nominals: List[int]) -> int:
+        # points the player got (or lost) in the round
+        return sum(v * n for v, n in zip(self.round_results(round_number, player_id), nominals))
+
+    def round_table(self, round_number: int, players: Iterable) -> List[list]:
+        # [name, score, result of every question of the round] for every player
+        return [[p.name, p.score] + self.round_results(round_number, p.player_id) for p in players]
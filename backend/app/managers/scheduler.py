@@ -0,0 +1,264 @@
+# this class is responsible for running all delayed and periodic callbacks of the server
+# (game countdowns, signal accumulation deadlines, clock probes) on a single thread (or on the event loop in asgi mode)
+# timers live in a heap ordered by deadline; cancelled and rescheduled entries are skipped lazily
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+
+    def __init__(self, scheduler, callback, args, interval: Optional[float]):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.args = args
+        self.interval = interval  # None for one-shot timers
+        self.deadline: float = 0
+        self.generation: int = 0  # bumped on reschedule, so older heap entries get ignored
+        self.cancelled: bool = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def reschedule(self, delay: float):
+        self.scheduler.reschedule(self, delay)
+
+    @property
+    def active(self):
+        return not self.cancelled
+
+
+class Scheduler:
+
+    def __init__(self, name: str = "scheduler"):
+        self.name = name
+        self.heap = list()  # entries of (deadline, sequence, generation, handle)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.running = True
+
+        # metrics
+        self.executed = 0
+        self.failed = 0
+        self.max_delay_ms = 0  # worst lateness of a callback compared to its deadline
+
+    def _push(self, handle: TimerHandle, delay: float):
+        # must be called with self.condition held
+        handle.deadline = time.monotonic() + max(0, delay)
+        heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle.generation, handle))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+        self.condition.notify()
+
+    def schedule(self, delay: float, callback, *args) -> TimerHandle:
+        # runs callback(*args) once after delay seconds
+        handle = TimerHandle(self, callback, args, None)
+        with self.condition:
+            self._push(handle, delay)
+        return handle
+
+    def schedule_repeating(self, interval: float, callback, *args, delay: float = None) -> TimerHandle:
+        # runs callback(*args) every interval seconds (first run after delay, defaults to interval) until cancelled
+        handle = TimerHandle(self, callback, args, interval)
+        with self.condition:
+            self._push(handle, interval if delay is None else delay)
+        return handle
+
+    def cancel(self, handle: Optional[TimerHandle]):
+        if handle is None:
+            return
+        with self.condition:
+            handle.cancelled = True
+            handle.generation += 1
+
+    def reschedule(self, handle: TimerHandle, delay: float):
+        # moves the next run of the timer (also re-arms a cancelled one)
+        with self.condition:
+            handle.cancelled = False
+            handle.generation += 1
+            self._push(handle, delay)
+
+    def pending(self):
+        with self.condition:
+            return sum(1 for entry in self.heap if entry[2] == entry[3].generation)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    if len(self.heap) == 0:
+                        self.condition.wait()
+                        continue
+                    deadline, _, generation, handle = self.heap[0]
+                    if generation != handle.generation:
+                        heapq.heappop(self.heap)
+                        continue
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        heapq.heappop(self.heap)
+                        break
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+
+            self.max_delay_ms = max(self.max_delay_ms, (time.monotonic() - deadline) * 1000)
+            try:
+                handle.callback(*handle.args)
+                self.executed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error in scheduled callback {handle.callback}: {e}")
+
+            with self.condition:
+                # callback may have cancelled or rescheduled the timer itself
+                if handle.generation == generation:
+                    if handle.interval is None:
+                        handle.cancelled = True  # one-shot timer is done
+                    else:
+                        # keep the rate, but don't try to catch up on runs missed by a long callback
+                        handle.deadline = max(deadline + handle.interval, time.monotonic())
+                        heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle.generation, handle))
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def get_metrics(self):
+        return dict(
+            pending=self.pending(),
+            executed=self.executed,
+            failed=self.failed,
+            max_delay_ms=self.max_delay_ms,
+        )
+
+
+class AsyncioScheduler(Scheduler):
+    # same interface as Scheduler, but callbacks run on an asyncio event loop (asgi serving mode)
+    # timers created before the loop is started are armed by start(); calls from other threads are handed to the loop
+
+    def __init__(self, name: str = "asyncio-scheduler"):
+        super().__init__(name)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.armed = dict()  # handle -> asyncio.TimerHandle of its next run
+        self.waiting = list()  # (handle, delay) scheduled before start()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        with self.condition:
+            self.loop = loop
+            waiting, self.waiting = self.waiting, list()
+        for handle, delay in waiting:
+            self._call(self._arm, handle, handle.generation, delay)
+
+    def _call(self, fn, *args):
+        if self.loop is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def submit(self, fn, *args):
+        # executor interface, so game mailboxes can drain on the loop
+        if self.loop is None:
+            fn(*args)
+        else:
+            # never run inline: a drain resubmitting itself must not recurse
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _push(self, handle: TimerHandle, delay: float):
+        # must be called with self.condition held
+        handle.deadline = time.monotonic() + max(0, delay)
+        if self.loop is None:
+            self.waiting.append((handle, delay))
+        else:
+            self._call(self._arm, handle, handle.generation, delay)
+
+    def _arm(self, handle: TimerHandle, generation: int, delay: float):
+        # runs on the loop
+        if handle.generation != generation or not self.running:
+            return
+        previous = self.armed.pop(handle, None)
+        if previous is not None:
+            previous.cancel()
+        deadline = self.loop.time() + max(0, delay)
+        self.armed[handle] = self.loop.call_at(deadline, self._fire, handle, generation, deadline)
+
+    def _disarm(self, handle: TimerHandle, generation: int):
+        # runs on the loop
+        if handle.generation != generation:
+            return
+        timer = self.armed.pop(handle, None)
+        if timer is not None:
+            timer.cancel()
+
+    def cancel(self, handle: Optional[TimerHandle]):
+        if handle is None:
+            return
+        with self.condition:
+            handle.cancelled = True
+            handle.generation += 1
+            generation = handle.generation
+        self._call(self._disarm, handle, generation)
+
+    def pending(self):
+        with self.condition:
+            return len(self.armed) + len(self.waiting)
+
+    def _fire(self, handle: TimerHandle, generation: int, deadline: float):
+        if self.armed.get(handle) is not None and handle.generation == generation:
+            del self.armed[handle]
+        if handle.generation != generation:
+            return
+        self.max_delay_ms = max(self.max_delay_ms, (self.loop.time() - deadline) * 1000)
+        try:
+            handle.callback(*handle.args)
+            self.executed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error in scheduled callback {handle.callback}: {e}")
+
+        # callback may have cancelled or rescheduled the timer itself
+        if handle.generation == generation:
+            if handle.interval is None:
+                handle.cancelled = True  # one-shot timer is done
+            else:
+                # keep the rate, but don't try to catch up on runs missed by a long callback
+                next_deadline = max(deadline + handle.interval, self.loop.time())
+                handle.deadline = time.monotonic() + next_deadline - self.loop.time()
+                self.armed[handle] = self.loop.call_at(next_deadline, self._fire, handle, generation, next_deadline)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+        self._call(self._stop)
+
+    def _stop(self):
+        for timer in self.armed.values():
+            timer.cancel()
+        self.armed.clear()
+
+
+# create static version of Scheduler shared by all games and managers
+scheduler = Scheduler()
+
+# return static version of Scheduler so it can be imported
+def get_scheduler() -> Scheduler:
+    return scheduler
+
+# replace the shared Scheduler (asgi mode installs an AsyncioScheduler), must happen before the server manager is created
+def set_scheduler(new_scheduler: Scheduler):
+    global scheduler
+    scheduler = new_scheduler
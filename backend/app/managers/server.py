@@ -1,16 +1,22 @@
 import logging
-import threading
+import os
 from abc import abstractmethod
-from typing import Dict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
 
 from simple_websocket import Server
 
 
 
+from backend.app.managers.connection import ClientConnection
 from backend.app.managers.entity import Player
-from backend.app.managers.game import AGame, SIGame
+from backend.app.managers.event_log import GameEventLog
+from backend.app.managers.game import AGame, QuestionState, SIGame
 from backend.app.managers.ntp_manager import NtpServer
-from backend.app.util.util import DEFAULT_NUMBER_OF_ROUNDS
+from backend.app.managers.persistence_manager import GamePersister
+from backend.app.managers.residency import GameResidency
+from backend.app.managers.scheduler import Scheduler, get_scheduler
+from backend.app.util.util import DEFAULT_NUMBER_OF_ROUNDS, generate_token, percentile
 
 logger = logging.getLogger(__name__)
 
@@ -18,19 +24,114 @@ logger = logging.getLogger(__name__)
 class AServerManager:
     # manager responsible for handling all games (if game is active - from memory, if persisted but not active - from storage)
 
-    def __init__(self, game_save_handler, game_loader):
-        self.games: Dict[str, AGame] = dict()
+    DEFAULT_GAME_WORKERS = 4
+
+    def __init__(self, game_save_handler, game_loader, game_created_handler=None):
+        # games held in memory in LRU order; GameResidency evicts finished and idle ones (get_game_by_id reloads them)
+        self.games: Dict[str, AGame] = GameResidency.create_storage()
         self.player_id_to_game: Dict[str, AGame] = dict()
-        self.player_id_to_socket: Dict[str, Server] = dict()
+        self.player_id_to_socket: Dict[str, ClientConnection] = dict()
         self.game_token_to_id: Dict[str, str] = dict()
+        # game_id -> instance being restored from storage (guarded by residency.lock), concurrent lookups wait for it
+        self.loading_games: Dict[str, Future] = dict()
+        # all timers (game countdowns, signal deadlines, clock probes) share one scheduler thread
+        self.scheduler: Scheduler = get_scheduler()
         self.ntp_manager: NtpServer = NtpServer(self)
         self.ntp_manager.monitor()
-        self.game_save_handler = game_save_handler
+        self.scheduler.schedule_repeating(1, self._check_stalled_connections)
+        # commands of all games are logged (SI_EVENT_LOG_DIR), so a crash doesn't lose what happened since the last save
+        event_log_dir = os.getenv("SI_EVENT_LOG_DIR")
+        self.event_log: Optional[GameEventLog] = GameEventLog(event_log_dir).load() if event_log_dir else None
+        # games save through the write-behind persister, so update_status never waits on storage
+        self.persister: GamePersister = GamePersister(game_save_handler, saved_handler=self._on_game_saved)
+        self.game_save_handler = self.persister.save
         self.game_loader = game_loader
+        # called with (game_id, token) of every new game, e.g. to drop them from a cache of missing games
+        self.game_created_handler = game_created_handler
+        # games apply their commands (see GameMailbox) on this pool, one thread per game at a time;
+        # asgi mode replaces it with the event loop
+        self.game_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SI_GAME_WORKERS", AServerManager.DEFAULT_GAME_WORKERS)),
+                                                thread_name_prefix="game")
+        # set by ClusterNode when several server processes share the games
+        self.cluster = None
+        self.residency = GameResidency(self)
+        self.residency.start()
+
+    def flush_game(self, game_id: str):
+        # writes pending snapshot of the game synchronously (used when game is finished)
+        self.persister.flush(game_id)
+
+    def owns_game_key(self, key: str) -> bool:
+        # in cluster mode a game (by id or token) belongs to the node the key hashes to
+        return self.cluster is None or self.cluster.is_local(key)
+
+    def shutdown(self):
+        self.persister.shutdown()
+        if self.event_log is not None:
+            self.event_log.close()
+
+    def _on_game_saved(self, entry: dict):
+        # events up to the seq of the saved snapshot are no longer needed for recovery
+        snapshot = entry["game_data"]["data"].get("snapshot")
+        if self.event_log is not None and snapshot is not None and "event_seq" in snapshot:
+            self.event_log.snapshot_saved(entry["game_id"], snapshot["event_seq"])
+
+    def get_metrics(self):
+        metrics = dict(persister=self.persister.get_metrics(), scheduler=self.scheduler.get_metrics(), ntp=self.ntp_manager.get_metrics(),
+                       connections=self._aggregate_connection_metrics(), games=self._aggregate_game_metrics(),
+                       residency=self.residency.get_metrics())
+        if self.event_log is not None:
+            metrics["event_log"] = self.event_log.get_metrics()
+        if self.cluster is not None:
+            metrics["cluster"] = self.cluster.get_metrics()
+        return metrics
+
+    # metrics are served without authentication, so connections and games are reported only as aggregates:
+    # a player_id or game_id is what the socket commands are authorized with
+    def _aggregate_connection_metrics(self):
+        connections = [c.get_metrics() for c in list(self.player_id_to_socket.values())]
+        sent = sum(c["sent"] for c in connections)
+        close_reasons = dict()
+        for c in connections:
+            if c["closed"]:
+                close_reasons[c["close_reason"]] = close_reasons.get(c["close_reason"], 0) + 1
+        latencies = sorted(c["avg_latency_ms"] for c in connections if c["sent"])
+        return dict(
+            count=len(connections),
+            closed=sum(close_reasons.values()),
+            close_reasons=close_reasons,
+            queue_depth=sum(c["queue_depth"] for c in connections),
+            max_depth=max((c["max_depth"] for c in connections), default=0),
+            sent=sent,
+            dropped=sum(c["dropped"] for c in connections),
+            merged=sum(c["merged"] for c in connections),
+            avg_latency_ms=sum(c["avg_latency_ms"] * c["sent"] for c in connections) / sent if sent else 0,
+            p50_latency_ms=percentile(latencies, 0.5),
+            p99_latency_ms=percentile(latencies, 0.99),
+            max_latency_ms=max((c["max_latency_ms"] for c in connections), default=0),
+        )
+
+    def _aggregate_game_metrics(self):
+        mailboxes = [game.mailbox.get_metrics() for game in list(self.games.values())]
+        commands = sum(m["commands"] for m in mailboxes)
+        waits = sorted(m["avg_wait_ms"] for m in mailboxes if m["commands"])
+        return dict(
+            count=len(mailboxes),
+            pending=sum(m["pending"] for m in mailboxes),
+            max_pending=max((m["pending"] for m in mailboxes), default=0),
+            commands=commands,
+            failed=sum(m["failed"] for m in mailboxes),
+            batches=sum(m["batches"] for m in mailboxes),
+            max_batch=max((m["max_batch"] for m in mailboxes), default=0),
+            avg_wait_ms=sum(m["avg_wait_ms"] * m["commands"] for m in mailboxes) / commands if commands else 0,
+            p50_wait_ms=percentile(waits, 0.5),
+            p99_wait_ms=percentile(waits, 0.99),
+            max_wait_ms=max((m["max_wait_ms"] for m in mailboxes), default=0),
+        )
 
     def process_lag_check(self, data):
-        lag = self.ntp_manager.process_response(data)
-        return lag
+        # clock estimate of the player (see NtpManager.get_estimate), None for unknown players
+        return self.ntp_manager.process_response(data)
 
     def add_player_to_all_maps(self,  player: Player, ws: Server, game=None):
         if game is not None:
@@ -67,14 +168,6 @@ class AServerManager:
 
         game.update_status()
 
-    def _check_signals(self):
-        for game in self.games.values():
-            game.check_signals()
-
-    def check_signals(self, interval: int=5):
-        self._check_signals()
-        threading.Timer(interval, self.check_signals, [interval]).start()
-
     @abstractmethod
     def create_game(self, game: AGame) -> Player:
         pass
@@ -87,7 +180,19 @@ class AServerManager:
         return self.player_id_to_game.get(player_id)
 
     def register_socket(self, user_id: str, socket):
+        # every socket gets an outbound queue with its own writer, so slow clients don't block broadcasts
+        if not isinstance(socket, ClientConnection):
+            socket = ClientConnection(socket)
+        socket.player_id = user_id
+        previous = self.player_id_to_socket.get(user_id)
         self.player_id_to_socket[user_id] = socket
+        if previous is not None and previous is not socket:
+            # client reconnected with a new socket, stop the writer of the old one
+            previous.close("replaced by a new connection")
+
+    def _check_stalled_connections(self):
+        for connection in list(self.player_id_to_socket.values()):
+            connection.check_stalled()
 
     def get_socket_by_player_id(self, player_id: str):
         return self.player_id_to_socket.get(player_id)
@@ -95,35 +200,128 @@ class AServerManager:
 
 class SIServerManager(AServerManager):
 
-    def __init__(self, game_save_handler, game_loader):
-        super().__init__(game_save_handler, game_loader)
-        self.interval_seconds = 1
-        self.check_signals(interval=self.interval_seconds)
+    def __init__(self, game_save_handler, game_loader, game_created_handler=None):
+        super().__init__(game_save_handler, game_loader, game_created_handler)
+        if self.event_log is not None:
+            self.recover_games()
 
+    def recover_games(self):
+        # loads every game with events left in the log (not saved before the previous process stopped)
+        game_ids = self.event_log.recovered_game_ids()
+        for game_id in game_ids:
+            try:
+                if self.get_game_by_id(game_id) is None:
+                    logger.error(f"Error recovering game {game_id}: no saved snapshot or create event")
+                    self.event_log.discard(game_id)
+            except Exception as e:
+                logger.error(f"Error recovering game {game_id}: {e}")
+        if len(game_ids) > 0:
+            logger.info(f"Recovered {len(game_ids)} games from the event log")
 
     def get_game_by_id(self, game_id: str):
-        if game_id in self.game_token_to_id:
-            game_id = self.game_token_to_id[game_id]
-        game = self.games.get(game_id, None)   
-        if game is None:
-            game_data = self.game_loader(game_id)
+        # in cluster mode only the owner node holds the game, elsewhere a copy loaded from storage would be stale
+        if game_id is None or not self.owns_game_key(game_id):
+            return None
+        game = self._find_resident_game(game_id)
+        if game is not None:
+            return game
+        key = game_id
+        while True:
+            # storage is read without holding the residency lock, so a slow load doesn't hold up lookups of other games
+            evictions = self.residency.evictions
+            game_data = self.game_loader(key)
             if game_data is not None:
-                game = SIGame(self, game_save_handler=self.game_save_handler)
-                game.restore_from_data(game_data)
+                game_id = game_data["game_id"]
+            elif self.event_log is None or not self.event_log.is_created_in_log(key):
+                self.residency.record_miss(False)
+                return None
+            # one caller restores the game (by id, whichever key it was looked up with), the others wait for its instance
+            with self.residency.lock:
+                game = self._find_resident_game(game_id)
+                if game is not None:
+                    return game
+                if self.residency.evictions != evictions and game_id not in self.loading_games:
+                    # the game may have been loaded, changed and evicted since it was read: read it again
+                    continue
+                loading = self.loading_games.get(game_id)
+                is_loader = loading is None
+                if is_loader:
+                    loading = self.loading_games[game_id] = Future()
+            break
+        if not is_loader:
+            return loading.result()
+        try:
+            game = self._restore_game(game_id, game_data)
+            with self.residency.lock:
                 self.games[game.game_id] = game
-                self.game_token_to_id[game.token] = game.game_id         
+                self.game_token_to_id[game.token] = game.game_id
+                self.residency.record_miss(True)
+            loading.set_result(game)
+            return game
+        except Exception as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self.residency.lock:
+                del self.loading_games[game_id]
+
+    def _find_resident_game(self, key: str):
+        # game in memory by id or token, an evicted instance still referenced counts as resident
+        with self.residency.lock:
+            game_id = self.game_token_to_id.get(key, key)
+            game = self.games.get(game_id)
+            if game is None:
+                game = self.residency.find_evicted(game_id)
+            if game is not None:
+                self.residency.record_hit(game.game_id)
+            return game
+
+    def _restore_game(self, game_id: str, game_data: Optional[dict]) -> SIGame:
+        game = SIGame(self, game_save_handler=self.game_save_handler)
+        if game_data is not None:
+            game.restore_from_data(game_data)
+        else:
+            # created shortly before a crash and never saved: the whole game is in the log
+            game.game_id = game_id
+        if self.event_log is not None:
+            self._replay_logged_events(game)
         return game
+
+    def _replay_logged_events(self, game: SIGame):
+        events = self.event_log.events_after(game.game_id, game.event_seq)
+        if len(events) == 0:
+            self.event_log.snapshot_saved(game.game_id, game.event_seq)
+            return
+        game.replay_events(events)
+        logger.info(f"Replayed {len(events)} events of game {game.game_id}")
+        if game.question_state == QuestionState.awaiting_more_signals:
+            # replayed signals keep their receive time, so the window may have closed while the server was down
+            game.resume_signal_accumulation()
+        game.update_status()
     
    
-    def create_game(self, ws:Server, host_name=None, host_id=None, number_of_rounds=DEFAULT_NUMBER_OF_ROUNDS, round_names_as_text=None) -> AGame:
+    def create_game(self, ws:Server, host_name=None, host_id=None, number_of_rounds=DEFAULT_NUMBER_OF_ROUNDS, round_names_as_text=None, game_id=None) -> AGame:
         game = SIGame(self, game_save_handler=self.game_save_handler, number_of_rounds=number_of_rounds if number_of_rounds is not None else DEFAULT_NUMBER_OF_ROUNDS)
-        self.games[game.game_id] = game
-        self.game_token_to_id[game.token] = game.game_id
+        # game id is assigned by the cluster node routing the request (never reuse an existing one)
+        if game_id is not None and game_id not in self.games and self.game_loader(game_id) is None:
+            game.game_id = game_id
+        # token has to lead to the same node as the id
+        while not self.owns_game_key(game.token):
+            game.token = generate_token()
+        with self.residency.lock:
+            self.games[game.game_id] = game
+            self.game_token_to_id[game.token] = game.game_id
+        if self.game_created_handler is not None:
+            self.game_created_handler(game.game_id, game.token)
         host_name = host_name or "Host"
         host = Player(host_name, game.game_id, host_id)
+        game.record_event("create", game.token, host.player_id, host_name, game.number_of_rounds, round_names_as_text)
         self.add_player_to_all_maps(host, ws)
         game.register_host(host)
         game.apply_round_names_as_text(round_names_as_text)
+        # written through right away: lookups of the token in storage (e.g. /auth of players) must find the new game
+        game.save_status()
+        self.flush_game(game.game_id)
             
         return game
 
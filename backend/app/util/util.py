@@ -1,4 +1,5 @@
 import argparse
+import json
 import logging
 import string
 import sys
@@ -6,6 +7,12 @@ import time
 import uuid
 import random
 
+try:
+    # optional faster JSON encoder, the standard json module is used when it isn't installed
+    import orjson
+except ImportError:
+    orjson = None
+
 
 DEFAULT_NUMBER_OF_ROUNDS = 8
 
@@ -89,18 +96,33 @@ def to_dict(obj):
     elif isinstance(obj, list):
         # If the object is a list, process each element
         return [to_dict(item) for item in obj]
+    elif hasattr(obj, "to_dict"):
+        # Entities (Player, Signal, ...) have explicit serializers
+        return to_dict(obj.to_dict())
     elif hasattr(obj, "__dict__"):
         # If the object is a custom object, use its __dict__ attribute
-        result = {}
-        for key, value in obj.__dict__.items():
-            if hasattr(value, "__dict__"):
-                result[key] = value.__dict__
-            else:
-                result[key] = value
-        return result
+        return {key: to_dict(value) for key, value in obj.__dict__.items()}
     else:
         # Base case: return the object as is (e.g., primitive types)
         return obj
 
+def _json_default(obj):
+    # objects that are not JSON types (Player, Signal, ...) are serialized the same way to_dict does it
+    if hasattr(obj, "to_dict") or hasattr(obj, "__dict__"):
+        return to_dict(obj)
+    return str(obj)
+
+def encode_message(message) -> str:
+    """Serializes a message to a compact JSON frame (strings are treated as already encoded)."""
+    if isinstance(message, str):
+        return message
+    if orjson is not None:
+        return orjson.dumps(message, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+
+def percentile(values, p: float) -> float:
+    """Returns the p-quantile (0..1) of already sorted values, 0 when there are none."""
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
 def now():
     return time.time_ns() / 1000000
@@ -0,0 +1,146 @@
+# benchmark of the two serving modes: memory held by idle websockets and broadcast latency
+# thread mode - every socket has a blocked reader thread (flask-sock) and a writer thread (ClientConnection)
+# asyncio mode - every socket has a reader task and a writer task (AsyncClientConnection)
+# every mode runs in a separate process, so resident memory of one doesn't leak into the other
+# run: python -m backend.bench.asgi_bench [socket counts, default 1000 10000]
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from backend.app.managers.connection import ClientConnection, AsyncClientConnection
+from backend.app.util.util import encode_message
+
+SOCKET_COUNTS = [1000, 10000]
+BROADCASTS = 20
+MESSAGE = {"status_patch": {"game_id": "1", "version": 2, "base_version": 1, "changes": {"question_state": "running"}}}
+
+
+def rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def p99(latencies):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+
+
+class FakeSocket:
+    # stands for simple_websocket.Server: receive blocks its reader thread until the client goes away
+    connected = True
+
+    def __init__(self, delivered):
+        self.delivered = delivered
+        self.closed = threading.Event()
+
+    def receive(self):
+        self.closed.wait()
+
+    def send(self, frame):
+        self.delivered.append(time.perf_counter())
+
+    def close(self):
+        self.closed.set()
+
+
+def run_threads(number_of_sockets: int):
+    delivered = list()
+    base_rss = rss_kb()
+    connections = list()
+    for i in range(number_of_sockets):
+        socket = FakeSocket(delivered)
+        threading.Thread(target=socket.receive, daemon=True).start()
+        connection = ClientConnection(socket, stall_timeout=60)
+        connection.player_id = str(i)
+        connection.send(encode_message({"status": "OK"}))  # registration reply starts the writer thread
+        connections.append(connection)
+    while len(delivered) < number_of_sockets:
+        time.sleep(0.01)
+    idle_kb = rss_kb() - base_rss
+
+    latencies = list()
+    for _ in range(BROADCASTS):
+        delivered.clear()
+        start = time.perf_counter()
+        frame = encode_message(MESSAGE)
+        for connection in connections:
+            connection.send(frame, True, MESSAGE)
+        while len(delivered) < number_of_sockets:
+            time.sleep(0.001)
+        latencies.extend((t - start) * 1000 for t in delivered)
+    for connection in connections:
+        connection.close()
+    return idle_kb, p99(latencies)
+
+
+async def run_asyncio(number_of_sockets: int):
+    delivered = list()
+    base_rss = rss_kb()
+    connections = list()
+
+    async def send_frame(frame):
+        delivered.append(time.perf_counter())
+
+    for i in range(number_of_sockets):
+        closed = asyncio.Event()
+
+        async def receive_frame(closed=closed):
+            await closed.wait()
+            return None
+
+        connection = AsyncClientConnection(send_frame, receive_frame, stall_timeout=60)
+        connection.player_id = str(i)
+        asyncio.get_running_loop().create_task(connection.receive())
+        connection.send(encode_message({"status": "OK"}))
+        connections.append(connection)
+    while len(delivered) < number_of_sockets:
+        await asyncio.sleep(0.01)
+    idle_kb = rss_kb() - base_rss
+
+    latencies = list()
+    for _ in range(BROADCASTS):
+        delivered.clear()
+        start = time.perf_counter()
+        frame = encode_message(MESSAGE)
+        for connection in connections:
+            connection.send(frame, True, MESSAGE)
+        while len(delivered) < number_of_sockets:
+            await asyncio.sleep(0.001)
+        latencies.extend((t - start) * 1000 for t in delivered)
+    return idle_kb, p99(latencies)
+
+
+def run_mode(mode: str, number_of_sockets: int):
+    if mode == "threads":
+        idle_kb, p99_ms = run_threads(number_of_sockets)
+    else:
+        idle_kb, p99_ms = asyncio.run(run_asyncio(number_of_sockets))
+    print(json.dumps(dict(idle_kb=idle_kb, p99_ms=p99_ms)))
+
+
+def main():
+    socket_counts = [int(n) for n in sys.argv[1:]] or SOCKET_COUNTS
+    print(f"{'sockets':>8} {'mode':>8} {'idle KB/socket':>15} {'p99 broadcast ms':>17}")
+    for number_of_sockets in socket_counts:
+        for mode in ("threads", "asyncio"):
+            process = subprocess.run([sys.executable, "-m", "backend.bench.asgi_bench", "--mode", mode, str(number_of_sockets)],
+                                     capture_output=True, text=True)
+            if process.returncode != 0:
+                error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"
+                print(f"{number_of_sockets:>8} {mode:>8} {error}")
+                continue
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            print(f"{number_of_sockets:>8} {mode:>8} {result['idle_kb'] / number_of_sockets:>15.1f} {result['p99_ms']:>17.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "--mode":
+        run_mode(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,54 @@
+# benchmark of AGame.broadcast_event: per-broadcast cost as the number of players grows
+# compares the encode-once fan-out with serializing the message separately for every socket
+# run: python -m backend.bench.broadcast_bench
+import time
+
+from backend.app.managers.entity import Player
+from backend.app.managers.server import SIServerManager
+from backend.app.util.util import encode_message
+
+PLAYER_COUNTS = [10, 100, 1000]
+BROADCASTS = 20
+
+
+class FakeSocket:
+    connected = True
+
+    def send(self, message):
+        pass
+
+
+def create_game(server_manager: SIServerManager, number_of_players: int):
+    game = server_manager.create_game(FakeSocket(), host_name="Host")
+    for i in range(number_of_players):
+        server_manager.register_player(Player(f"player{i}", game.game_id), FakeSocket())
+    return game
+
+
+def encode_per_socket(game, message):
+    for p in game.recipient_ids:
+        socket = game.server_manager.get_socket_by_player_id(p)
+        if socket is not None and socket.connected:
+            socket.send(encode_message(message))
+
+
+def measure_us(fn, game, message):
+    start = time.perf_counter()
+    for _ in range(BROADCASTS):
+        fn(game, message)
+    return (time.perf_counter() - start) / BROADCASTS * 1000000
+
+
+def main():
+    server_manager = SIServerManager(game_save_handler=lambda **kwargs: None, game_loader=lambda game_id: None)
+    print(f"{'players':>8} {'status bytes':>13} {'encode once us':>15} {'encode per socket us':>21}")
+    for number_of_players in PLAYER_COUNTS:
+        game = create_game(server_manager, number_of_players)
+        message = game.generate_full_status_message()
+        once_us = measure_us(lambda g, m: g.broadcast_event(m), game, message)
+        per_socket_us = measure_us(encode_per_socket, game, message)
+        print(f"{number_of_players:>8} {len(encode_message(message)):>13} {once_us:>15.1f} {per_socket_us:>21.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# benchmark of the cluster mode: websocket action throughput as the number of worker processes grows
+# every worker owns the games hashing to it; every load generator is a separate (non owning) node holding the
+# websockets, so its actions are routed to the owner and the replies come back over the local socket bus
+# run: python -m backend.bench.cluster_bench [worker counts, default 1 2 4]
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from backend.app.cluster.bus import LocalSocketBus
+from backend.app.cluster.node import ClusterNode
+from backend.app.controllers.game_controller import handle_message
+from backend.app.managers.connection import ClientConnection
+from backend.app.managers.server import SIServerManager
+
+WORKER_COUNTS = [1, 2, 4]
+GAMES_PER_GENERATOR = 10
+PLAYERS_PER_GAME = 10
+REQUESTS_PER_GENERATOR = 5000
+
+
+class FakeSocket:
+    connected = True
+
+    def __init__(self, on_frame):
+        self.on_frame = on_frame
+
+    def send(self, frame):
+        self.on_frame(frame)
+
+    def close(self):
+        self.connected = False
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_node(node_id: str, worker_ids, addresses: str):
+    logging.getLogger().setLevel(logging.WARNING)
+    server_manager = SIServerManager(game_save_handler=lambda **kwargs: None, game_loader=lambda game_id: None)
+    bus = LocalSocketBus(LocalSocketBus.parse_addresses(addresses))
+    return ClusterNode(node_id, worker_ids, bus, server_manager, handle_message)
+
+
+def run_worker(node_id: str, worker_ids, addresses: str):
+    create_node(node_id, worker_ids, addresses)
+    print("ready", flush=True)
+    sys.stdin.read()  # runs until the benchmark closes stdin
+
+
+def run_generator(node_id: str, worker_ids, addresses: str):
+    node = create_node(node_id, worker_ids, addresses)
+    condition = threading.Condition()
+    replies = dict(started=0, status=0)
+
+    def on_frame(frame):
+        with condition:
+            if frame.startswith('{"id":'):
+                replies["started"] += 1
+            elif frame.startswith('{"status":{'):
+                replies["status"] += 1
+            condition.notify_all()
+
+    def wait_for(key, count):
+        with condition:
+            condition.wait_for(lambda: replies[key] >= count, timeout=60)
+
+    game_ids = list()
+    for i in range(GAMES_PER_GENERATOR):
+        data = dict(action="start_game", host_name=f"host{i}", number_of_rounds=2)
+        node.dispatch(ClientConnection(FakeSocket(on_frame)), data)
+        game_ids.append(data["game_id"])
+    wait_for("started", GAMES_PER_GENERATOR)
+
+    players = list()
+    for game_id in game_ids:
+        for i in range(PLAYERS_PER_GAME):
+            connection = ClientConnection(FakeSocket(on_frame))
+            node.dispatch(connection, dict(action="register", name=f"player{i}", game_id=game_id))
+            players.append((connection, game_id))
+    time.sleep(1)  # registration replies and status broadcasts settle
+    with condition:
+        replies["status"] = 0
+
+    start = time.perf_counter()
+    for i in range(REQUESTS_PER_GENERATOR):
+        connection, game_id = players[i % len(players)]
+        node.dispatch(connection, dict(action="get_status", game_id=game_id))
+    wait_for("status", REQUESTS_PER_GENERATOR)
+    seconds = time.perf_counter() - start
+    print(json.dumps(dict(requests=replies["status"], seconds=seconds)), flush=True)
+
+
+def run_cluster(number_of_workers: int):
+    worker_ids = [f"w{i}" for i in range(number_of_workers)]
+    generator_ids = [f"g{i}" for i in range(number_of_workers)]
+    addresses = ",".join(f"{node_id}=127.0.0.1:{free_port()}" for node_id in worker_ids + generator_ids)
+    command = [sys.executable, "-m", "backend.bench.cluster_bench"]
+    workers = [subprocess.Popen(command + ["--worker", node_id, ",".join(worker_ids), addresses],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for node_id in worker_ids]
+    try:
+        for worker in workers:
+            worker.stdout.readline()
+        generators = [subprocess.Popen(command + ["--generator", node_id, ",".join(worker_ids), addresses],
+                                       stdout=subprocess.PIPE, text=True) for node_id in generator_ids]
+        results = [json.loads(generator.communicate()[0].strip().splitlines()[-1]) for generator in generators]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+    requests = sum(result["requests"] for result in results)
+    return requests, requests / max(result["seconds"] for result in results)
+
+
+def main(args):
+    worker_counts = [int(n) for n in args] or WORKER_COUNTS
+    print(f"cpu cores: {os.cpu_count()}")
+    print(f"{'workers':>8} {'requests':>9} {'actions/s':>10}")
+    for number_of_workers in worker_counts:
+        requests, throughput = run_cluster(number_of_workers)
+        print(f"{number_of_workers:>8} {requests:>9} {throughput:>10.0f}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    del sys.argv[1:]  # ArgConfig parses the command line as server arguments
+    if len(args) == 4 and args[0] == "--worker":
+        run_worker(args[1], args[2].split(","), args[3])
+    elif len(args) == 4 and args[0] == "--generator":
+        run_generator(args[1], args[2].split(","), args[3])
+    else:
+        main(args)
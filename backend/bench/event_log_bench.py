@@ -0,0 +1,48 @@
+# benchmark of the game event log: games appending commands concurrently, durable after every command (one fsync
+# per event) vs group commit (the writer thread fsyncs everything buffered by all games once per commit interval)
+# run: python -m backend.bench.event_log_bench
+import tempfile
+import threading
+import time
+
+from backend.app.managers.event_log import GameEventLog
+
+GAME_COUNTS = [1, 10, 100]
+TOTAL_EVENTS = 2000
+
+
+def run(number_of_games: int, group_commit: bool):
+    # every game is a thread appending signals; returns events per second (logged and fsynced) and fsyncs done
+    events_per_game = max(1, TOTAL_EVENTS // number_of_games)
+    with tempfile.TemporaryDirectory() as directory:
+        event_log = GameEventLog(directory).load()
+
+        def play(game_id: str):
+            for seq in range(1, events_per_game + 1):
+                event_log.append(game_id, seq, "signal", (f"player{seq % 20}", 1000 + seq, 990 + seq, 995 + seq))
+                if not group_commit:
+                    event_log.commit()
+
+        threads = [threading.Thread(target=play, args=(f"game{g}",)) for g in range(number_of_games)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        event_log.commit()
+        elapsed = time.perf_counter() - start
+        event_log.close()
+        return event_log.appended / elapsed, event_log.commits
+
+
+def main():
+    print(f"{'games':>6} {'events':>7} {'per event/s':>12} {'fsyncs':>7} {'group/s':>10} {'fsyncs':>7}")
+    for number_of_games in GAME_COUNTS:
+        single_rate, single_fsyncs = run(number_of_games, False)
+        group_rate, group_fsyncs = run(number_of_games, True)
+        events = max(1, TOTAL_EVENTS // number_of_games) * number_of_games
+        print(f"{number_of_games:>6} {events:>7} {single_rate:>12.0f} {single_fsyncs:>7} {group_rate:>10.0f} {group_fsyncs:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# microbenchmarks of the functions running on every buzz or tick, with regression baselines
+# every hot path is driven with fake connections across player counts and game lengths (rounds played); a result
+# is its per-call time relative to a pure-python calibration workload run right after it (median of several runs),
+# so the speed of the machine, or a change of it during the run, cancels out. Results are compared with
+# backend/bench/baselines/hot_paths.json and the run fails (exit code 1) if a hot path got slower than its
+# baseline by more than the threshold
+# run: python -m backend.bench.hot_paths_bench [--update] [--threshold 0.25] [--filter name] [--baseline path]
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from backend.app.managers.entity import Player, Signal
+from backend.app.managers.server import SIServerManager
+from backend.app.util.util import to_dict
+
+PLAYER_COUNTS = [10, 100, 1000]
+ROUND_COUNTS = [8, 30]
+SIGNAL_BURST = 10  # signals of one question in the process_signal benchmark
+DEFAULT_THRESHOLD = 0.25  # allowed slowdown against the baseline
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "hot_paths.json")
+MIN_RUN_SECONDS = 0.02  # calls of a function are repeated until one run takes at least this long
+RUNS = 9
+
+
+class FakeSocket:
+    connected = True
+
+    def send(self, message):
+        pass
+
+    def close(self):
+        self.connected = False
+
+
+class FakeConnection:
+    # stands for ClientConnection (no writer thread), so broadcasts measure only the work of the game
+    connected = True
+
+    def send(self, frame, supersedable: bool = False, message=None):
+        pass
+
+    def check_stalled(self):
+        pass
+
+
+def create_game(server_manager: SIServerManager, number_of_players: int, number_of_rounds: int):
+    # plays every round but the last one (one wrong and one correct answer per question), players get fake connections
+    game = server_manager.create_game(FakeSocket(), host_name="Host", number_of_rounds=number_of_rounds)
+    server_manager.player_id_to_socket.pop(game.host.player_id).close()
+    server_manager.player_id_to_socket[game.host.player_id] = FakeConnection()
+    players = list()
+    for i in range(number_of_players):
+        player = Player(f"player{i}", game.game_id)
+        game.register_player(player)
+        server_manager.player_id_to_socket[player.player_id] = FakeConnection()
+        players.append(player)
+    for q in range((number_of_rounds - 1) * len(game.nominals)):
+        for decision, player in (("decline", players[q % number_of_players]), ("accept", players[(q + 1) % number_of_players])):
+            game.responders = [player]
+            game.question_state = game.question_state.answering
+            game.process_host_decision(decision)
+    game.update_status()
+    return game, players
+
+
+def signals_of(players: List[Player]) -> Dict[str, Signal]:
+    # every player buzzed, in random order of adjusted time
+    signals = dict()
+    for i, player in enumerate(players):
+        adjusted_ts = random.uniform(0, 1000)
+        signals[player.player_id] = Signal(player.player_id, 1000 + i, adjusted_ts, adjusted_ts)
+    return signals
+
+
+def signal_burst(game, signals: List[Signal]):
+    game.reset()
+    for signal in signals:
+        game.process_signal(signal)
+
+
+def sort_signals(game, signals: Dict[str, Signal]):
+    # includes restoring the unsorted signals
+    game.signals = dict(signals)
+    game._sort_signals()
+
+
+def calibration():
+    # pure python work of the same kind as the hot paths (dicts, sorting, json), scales baselines between machines
+    rows = [dict(name=f"player{i}", score=(i * 7919) % 1000, stats=[i % 3 - 1] * 5) for i in range(200)]
+    rows.sort(key=lambda r: (r["score"], r["name"]))
+    return json.dumps(rows)
+
+
+def time_calls(fn: Callable, args: tuple, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        fn(*args)
+    return time.perf_counter() - start
+
+
+def calls_per_run(fn: Callable, args: tuple) -> int:
+    # number of calls making a run long enough for the clock
+    number = 1
+    while True:
+        elapsed = time_calls(fn, args, number)
+        if elapsed >= MIN_RUN_SECONDS:
+            return number
+        number *= 2 if elapsed == 0 else max(2, min(10, int(MIN_RUN_SECONDS / elapsed) + 1))
+
+
+def measure(fn: Callable, *args) -> dict:
+    # us: best per-call time; relative: median over runs of the per-call time divided by the calibration's
+    number = calls_per_run(fn, args)
+    calibration_number = calls_per_run(calibration, ())
+    best = None
+    ratios = list()
+    for _ in range(RUNS):
+        per_call = time_calls(fn, args, number) / number
+        calibration_per_call = time_calls(calibration, (), calibration_number) / calibration_number
+        best = per_call if best is None else min(best, per_call)
+        ratios.append(per_call / calibration_per_call)
+    return dict(us=best * 1000000, relative=statistics.median(ratios))
+
+
+def run_benchmarks(name_filter: str = None) -> Dict[str, dict]:
+    random.seed(1)
+    server_manager = SIServerManager(game_save_handler=lambda **kwargs: None, game_loader=lambda game_id: None)
+    results = dict()
+
+    def record(name: str, fn: Callable, *args):
+        if name_filter is None or name_filter in name:
+            results[name] = measure(fn, *args)
+            print(f"{name:<60} {results[name]['us']:>12.2f} {results[name]['relative']:>10.4f}")
+
+    for number_of_rounds in ROUND_COUNTS:
+        for number_of_players in PLAYER_COUNTS:
+            game, players = create_game(server_manager, number_of_players, number_of_rounds)
+            case = f"players={number_of_players},rounds={number_of_rounds}"
+            status = game.generate_game_status()
+            record(f"generate_game_status[{case}]", game.generate_game_status)
+            record(f"util.to_dict[{case}]", to_dict, status)
+            record(f"broadcast_event[{case}]", game.broadcast_event, game.generate_full_status_message())
+            if number_of_rounds != ROUND_COUNTS[0]:
+                continue
+            # functions below don't depend on the length of the game
+            case = f"players={number_of_players}"
+            record(f"_generate_current_round_array[{case}]", game._generate_current_round_array)
+            signals = signals_of(players)
+            record(f"process_signal[{case},burst={SIGNAL_BURST}]", signal_burst, game, list(signals.values())[:SIGNAL_BURST])
+            game.reset()
+            record(f"_sort_signals[{case}]", sort_signals, game, signals)
+            game.signals = signals
+            record(f"_detect_responders_list[{case}]", game._detect_responders_list)
+            game.reset()
+    server_manager.shutdown()
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: dict, threshold: float) -> List[str]:
+    # names of the hot paths slower (relative to the calibration) than their baseline by more than the threshold
+    regressions = list()
+    print(f"\n{'hot path':<60} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, result in results.items():
+        expected = baseline["results"].get(name)
+        if expected is None:
+            print(f"{name:<60} {'-':>10} {result['relative']:>10.4f} {'new':>8}")
+            continue
+        change = result["relative"] / expected["relative"] - 1
+        regressed = change > threshold
+        print(f"{name:<60} {expected['relative']:>10.4f} {result['relative']:>10.4f} {change:>+8.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the game hot paths with regression baselines")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--filter", help="run only hot paths whose name contains this")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'hot path':<60} {'us per call':>12} {'relative':>10}")
+    results = run_benchmarks(args.filter)
+
+    if args.update:
+        baseline = dict(python=platform.python_version(), results=results)
+        if args.filter is not None and os.path.exists(args.baseline):
+            # other hot paths keep their baseline
+            with open(args.baseline) as f:
+                baseline["results"] = {**json.load(f)["results"], **results}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nbaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nno baseline at {args.baseline}, run with --update to create it")
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if len(regressions) > 0:
+        print(f"\n{len(regressions)} hot paths regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nno hot path regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    del sys.argv[1:]  # ArgConfig parses the command line as server arguments
+    sys.exit(main(args))
@@ -0,0 +1,442 @@
+# load generator for the websocket api: games played concurrently like a quiz night
+# every game has a host connection (start_game) and player connections (register); players answer offset_check
+# probes with a skewed clock and network jitter, buzz in bursts after start_timer, and the host accepts or declines
+# the first responder, so every question goes through signals, accumulation, answering and the next question
+# reports buzz -> answering latency (seen by the host, includes the signal accumulation window of the game),
+# status fan-out latency (a player getting a status version vs the first connection of the game getting it),
+# status versions clients missed, frames the server dropped, and thread / memory growth of the server process
+# runs only against a local server: one started for the run (default) or --url of a running one (--pid to sample it)
+# all connections are served by one event loop (wsproto over asyncio streams), so the tool itself stays light
+# run: python -m backend.bench.load_harness [--games 20] [--players 10] [--questions 10] [--help for the rest]
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, CloseConnection, Message, Ping, RejectConnection, Request, TextMessage
+
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STATE_TIMEOUT = 15  # seconds to wait for the game to reach the next state
+SAMPLE_INTERVAL = 0.5  # seconds between samples of the server process
+
+
+def now_ms():
+    # same clock as the server (util.now)
+    return time.time_ns() / 1000000
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+class Stats:
+    # everything measured during the run
+
+    def __init__(self):
+        self.buzz_to_answering_ms: List[float] = []
+        self.fanout_ms: List[float] = []
+        self.first_seen: Dict[tuple, float] = dict()  # (game_id, version) -> first receipt of the status version
+        self.missed_versions = 0
+        self.resyncs = 0
+        self.unexpected_closes = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.questions = 0
+        self.frames = 0
+
+    def status_received(self, game_id: str, version: int, received_at: float):
+        first = self.first_seen.setdefault((game_id, version), received_at)
+        self.fanout_ms.append((received_at - first) * 1000)
+
+
+class LoadClient:
+    # one websocket connection of a host or a player
+
+    def __init__(self, stats: Stats, args):
+        self.stats = stats
+        self.args = args
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.closing = False
+        self.clock_offset = random.uniform(-args.clock_skew, args.clock_skew)  # ms the local clock is off
+        self.game_id: Optional[str] = None
+        self.version: Optional[int] = None  # latest status version applied
+        self.status: dict = dict()  # latest status, patches applied
+        self.changed = asyncio.Event()
+        self.read_task: Optional[asyncio.Task] = None
+
+    async def connect(self, host: str, port: int, path: str):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(self.ws.send(Request(host=f"{host}:{port}", target=path)))
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("connection closed during handshake")
+            self.ws.receive_data(data)
+            for event in self.ws.events():
+                if isinstance(event, AcceptConnection):
+                    self.read_task = asyncio.create_task(self._read())
+                    return
+                if isinstance(event, RejectConnection):
+                    raise ConnectionError(f"websocket rejected with status {event.status_code}")
+
+    def send(self, message: dict):
+        if not self.closing:
+            self.writer.write(self.ws.send(Message(data=json.dumps(message))))
+
+    async def _read(self):
+        parts = []
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                self.ws.receive_data(data)
+                for event in self.ws.events():
+                    if isinstance(event, TextMessage):
+                        parts.append(event.data)
+                        if event.message_finished:
+                            received_at = time.perf_counter()
+                            self.stats.frames += 1
+                            self._on_message(json.loads("".join(parts)), received_at)
+                            parts = []
+                    elif isinstance(event, Ping):
+                        self.writer.write(self.ws.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        if not self.closing:
+                            self.stats.unexpected_closes += 1
+                        self.closing = True
+                        self.writer.write(self.ws.send(event.response()))
+                        return
+        except Exception:
+            if not self.closing:
+                self.stats.errors += 1
+        if not self.closing:
+            self.stats.unexpected_closes += 1
+            self.closing = True
+
+    def _on_message(self, message, received_at: float):
+        if not isinstance(message, dict):
+            return
+        if message.get("action") == "offset_check":
+            asyncio.create_task(self._answer_probe(message))
+            return
+        if "status" in message and isinstance(message["status"], dict):
+            self.status = dict(message["status"])
+            self._status_version(message["version"], received_at)
+        elif "status_patch" in message:
+            patch = message["status_patch"]
+            if self.version is not None and patch["base_version"] != self.version:
+                if patch["base_version"] > self.version:
+                    # versions were dropped on the way: resync with a full status, as the web client does
+                    self.stats.missed_versions += patch["base_version"] - self.version
+                    self.stats.resyncs += 1
+                    self.send(dict(action="get_status", game_id=self.game_id))
+                return
+            self.status.update(patch["changes"])
+            self._status_version(patch["version"], received_at)
+        self.on_message(message)
+
+    def _status_version(self, version: int, received_at: float):
+        if self.version is None or version > self.version:
+            self.version = version
+            if self.game_id is not None:
+                self.stats.status_received(self.game_id, version, received_at)
+            self.changed.set()
+
+    def on_message(self, message: dict):
+        pass
+
+    async def _answer_probe(self, message: dict):
+        # network delay both ways, local clock off by clock_offset
+        await asyncio.sleep(random.uniform(0, self.args.jitter) / 1000)
+        message["client_ts"] = now_ms() + self.clock_offset
+        await asyncio.sleep(random.uniform(0, self.args.jitter) / 1000)
+        self.send(message)
+
+    async def wait_until(self, predicate: Callable[[dict], bool], timeout: float = STATE_TIMEOUT):
+        deadline = time.perf_counter() + timeout
+        while not predicate(self.status):
+            self.changed.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                if not predicate(self.status):
+                    raise
+
+    async def close(self):
+        self.closing = True
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(self.ws.send(CloseConnection(code=1000)))
+            await self.writer.drain()
+        except Exception:
+            pass
+        self.writer.close()
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+
+class HostClient(LoadClient):
+
+    def __init__(self, stats: Stats, args):
+        super().__init__(stats, args)
+        self.started = asyncio.get_running_loop().create_future()
+
+    def on_message(self, message: dict):
+        if "id" in message and "host" in message and not self.started.done():
+            self.game_id = message["id"]
+            self.started.set_result(message)
+
+
+class PlayerClient(LoadClient):
+
+    def __init__(self, stats: Stats, args):
+        super().__init__(stats, args)
+        self.player_id: Optional[str] = None
+        self.registered = asyncio.get_running_loop().create_future()
+
+    def on_message(self, message: dict):
+        if "player_id" in message and "status" in message and not self.registered.done():
+            self.player_id = message["player_id"]
+            self.registered.set_result(message)
+
+    def buzz(self):
+        self.send(dict(action="signal", player_id=self.player_id, local_ts=now_ms() + self.clock_offset))
+
+
+async def play_game(number: int, host: str, port: int, path: str, stats: Stats, args):
+    clients: List[LoadClient] = []
+    try:
+        host_client = HostClient(stats, args)
+        clients.append(host_client)
+        await host_client.connect(host, port, path)
+        # the game finishes on the first question of its last round, so that one is never reached
+        host_client.send(dict(action="start_game", host_name=f"host{number}",
+                              number_of_rounds=math.ceil(args.questions / 5) + 1))
+        await asyncio.wait_for(host_client.started, STATE_TIMEOUT)
+
+        players = [PlayerClient(stats, args) for _ in range(args.players)]
+        clients.extend(players)
+        await asyncio.gather(*(p.connect(host, port, path) for p in players))
+        for i, player in enumerate(players):
+            player.game_id = host_client.game_id
+            player.send(dict(action="register", name=f"player{i}", game_id=host_client.game_id))
+        await asyncio.wait_for(asyncio.gather(*(p.registered for p in players)), STATE_TIMEOUT)
+        await asyncio.sleep(args.warmup)  # first burst of clock probes
+
+        for _ in range(args.questions):
+            await play_question(host_client, players, stats, args)
+            if host_client.status.get("game_state") == "finished":
+                break
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+    except Exception as e:
+        stats.errors += 1
+        print(f"game {number}: {type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        await asyncio.gather(*(c.close() for c in clients))
+
+
+async def play_question(host_client: HostClient, players: List[PlayerClient], stats: Stats, args):
+    host_client.send(dict(action="start_timer", game_id=host_client.game_id))
+    await asyncio.sleep(random.uniform(0.2, 0.6))  # players think
+    failed = set()
+    for attempt in range(2):
+        eligible = [p for p in players if p.player_id not in failed]
+        if len(eligible) == 0:
+            break
+        buzzers = random.sample(eligible, min(args.buzzers, len(eligible)))
+        # burst: first buzz now, the others within --skew ms
+        started_at = time.perf_counter()
+        buzzers[0].buzz()
+        for player in buzzers[1:]:
+            asyncio.get_running_loop().call_later(random.uniform(0, args.skew) / 1000, player.buzz)
+        await host_client.wait_until(lambda s: s.get("question_state") == "answering")
+        stats.buzz_to_answering_ms.append((time.perf_counter() - started_at) * 1000)
+        await asyncio.sleep(args.decision_delay)
+        responders = host_client.status.get("responders") or []
+        decline = attempt == 0 and random.random() < args.decline_rate
+        version = host_client.version
+        host_client.send(dict(action="host_decision", game_id=host_client.game_id,
+                              host_decision="decline" if decline else "accept"))
+        # next state: question open again (after decline) or the next question
+        await host_client.wait_until(lambda s: host_client.version > version and s.get("question_state") == "running")
+        if not decline:
+            break
+        if len(responders) > 0:
+            failed.add(responders[0]["player_id"])
+    stats.questions += 1
+
+
+class ServerProcess:
+    # samples threads and resident memory of the server process from /proc
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.samples: List[tuple] = []  # (threads, rss kb)
+
+    def sample(self):
+        if self.pid is None:
+            return None
+        threads = rss = 0
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss = int(line.split()[1])
+        except OSError:
+            return None
+        self.samples.append((threads, rss))
+        return threads, rss
+
+    async def monitor(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, directory: str):
+    # fresh server with json storage in a temporary directory, its log discarded
+    port = free_port()
+    env = dict(os.environ, SI_PORT=str(port), PYTHONPATH=REPO_ROOT)
+    module = "backend.app.asgi" if mode == "asgi" else "backend.app.app"
+    process = subprocess.Popen([sys.executable, "-m", module], cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server didn't start listening in 30 seconds")
+
+
+def get_server_metrics(host: str, port: int) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/api/metrics", timeout=10) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+async def run(host: str, port: int, path: str, server: ServerProcess, args, stats: Stats):
+    monitor = asyncio.create_task(server.monitor())
+    await asyncio.sleep(SAMPLE_INTERVAL)  # baseline before the first connection
+    started_at = time.perf_counter()
+    games = list()
+    for number in range(args.games):
+        games.append(asyncio.create_task(play_game(number, host, port, path, stats, args)))
+        await asyncio.sleep(args.ramp)
+    await asyncio.gather(*games)
+    seconds = time.perf_counter() - started_at
+    await asyncio.sleep(SAMPLE_INTERVAL)  # connections closed by the server
+    server.sample()
+    monitor.cancel()
+    return seconds
+
+
+def report(stats: Stats, server: ServerProcess, metrics: Optional[dict], seconds: float, args):
+    print(f"games {args.games}, players per game {args.players}, questions {args.questions}, "
+          f"connections {args.games * (args.players + 1)}, {seconds:.1f} s, {stats.questions} questions played")
+    print(f"{'':24} {'p50':>8} {'p99':>8} {'p999':>8} {'samples':>8}")
+    for name, values in (("buzz -> answering ms", stats.buzz_to_answering_ms), ("status fan-out ms", stats.fanout_ms)):
+        print(f"{name:24} {percentile(values, 0.5):>8.1f} {percentile(values, 0.99):>8.1f} "
+              f"{percentile(values, 0.999):>8.1f} {len(values):>8}")
+    print(f"frames received {stats.frames}, status versions missed {stats.missed_versions} "
+          f"(resyncs {stats.resyncs}), closed by server {stats.unexpected_closes}, "
+          f"timeouts {stats.timeouts}, errors {stats.errors}")
+    if metrics is not None:
+        connections = metrics.get("connections", {})
+        print(f"server: frames dropped {connections.get('dropped', 0)}, status frames merged {connections.get('merged', 0)} "
+              f"(connections still registered)")
+    if len(server.samples) > 0:
+        base_threads, base_rss = server.samples[0]
+        peak_threads = max(s[0] for s in server.samples)
+        peak_rss = max(s[1] for s in server.samples)
+        end_threads, end_rss = server.samples[-1]
+        print(f"server threads: start {base_threads}, peak {peak_threads} (+{peak_threads - base_threads}), "
+              f"end {end_threads} (+{end_threads - base_threads})")
+        print(f"server rss MB: start {base_rss / 1024:.1f}, peak {peak_rss / 1024:.1f} (+{(peak_rss - base_rss) / 1024:.1f}), "
+              f"end {end_rss / 1024:.1f} (+{(end_rss - base_rss) / 1024:.1f})")
+    print(f"cpu cores: {os.cpu_count()} (the load generator shares them with a server started for the run)")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Websocket load generator playing games against a local server")
+    parser.add_argument("--games", type=int, default=20, help="games played concurrently")
+    parser.add_argument("--players", type=int, default=10, help="player connections per game")
+    parser.add_argument("--questions", type=int, default=10, help="questions played in every game")
+    parser.add_argument("--buzzers", type=int, default=3, help="players buzzing on every question")
+    parser.add_argument("--skew", type=float, default=100, help="ms within which the buzzes of a question are sent")
+    parser.add_argument("--clock-skew", type=float, default=2000, help="max ms the clocks of players are off")
+    parser.add_argument("--jitter", type=float, default=20, help="max one-way network delay (ms) of clock probes")
+    parser.add_argument("--decline-rate", type=float, default=0.3, help="share of first answers the host declines")
+    parser.add_argument("--decision-delay", type=float, default=0.2, help="seconds the host takes to decide")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds between registration and the first question")
+    parser.add_argument("--ramp", type=float, default=0.05, help="seconds between starts of two games")
+    parser.add_argument("--mode", choices=["thread", "asgi"], default="thread", help="serving mode of the started server")
+    parser.add_argument("--url", help="websocket url of a running local server instead of starting one, e.g. ws://127.0.0.1:4000/ws")
+    parser.add_argument("--pid", type=int, help="pid of the server given by --url, to sample its threads and memory")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.url is not None and urlparse(args.url).hostname not in LOCAL_HOSTS:
+        parser.error("--url must point to a local server")
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    stats = Stats()
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        if args.url is None:
+            process, port = start_server(args.mode, directory)
+            host, path, pid = "127.0.0.1", "/ws", process.pid
+        else:
+            url = urlparse(args.url)
+            host, port, path, pid = url.hostname, url.port or 80, url.path or "/ws", args.pid
+        try:
+            server = ServerProcess(pid)
+            seconds = asyncio.run(run(host, port, path, server, args, stats))
+            metrics = get_server_metrics(host, port)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    report(stats, server, metrics, seconds, args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+# benchmark of the clock offset estimator: cost of one probe response and of get_lag for 1000/10000 players,
+# plus the estimate of a client whose clock is 1500 ms ahead, with a delayed probe in every window
+# run: python -m backend.bench.ntp_bench
+import random
+import time
+
+from backend.app.managers.ntp_manager import NtpManager
+
+PLAYER_COUNTS = [1000, 10000]
+ROUNDS = 8  # probes per player (the monitor sends one per second)
+CLIENT_OFFSET_MS = 1500
+
+
+def probe(manager: NtpManager, player_id: str, server_out_ts: float, delayed: bool):
+    one_way = 40 if delayed else random.uniform(2, 6)  # ms
+    client_ts = server_out_ts + one_way + CLIENT_OFFSET_MS
+    server_in_ts = server_out_ts + one_way + random.uniform(2, 6)
+    manager.process_response(player_id, server_out_ts, server_in_ts, client_ts)
+
+
+def main():
+    print(f"{'players':>8} {'response us':>12} {'get_lag us':>11} {'offset error ms':>16}")
+    for number_of_players in PLAYER_COUNTS:
+        manager = NtpManager()
+        player_ids = [f"player{i}" for i in range(number_of_players)]
+        for player_id in player_ids:
+            manager.register(player_id)
+
+        start = time.perf_counter()
+        for r in range(ROUNDS):
+            server_out_ts = time.time() * 1000
+            for player_id in player_ids:
+                probe(manager, player_id, server_out_ts, delayed=r == 3)
+        response_us = (time.perf_counter() - start) / (ROUNDS * number_of_players) * 1000000
+
+        start = time.perf_counter()
+        for player_id in player_ids:
+            manager.get_lag(player_id)
+        get_lag_us = (time.perf_counter() - start) / number_of_players * 1000000
+
+        worst_error = max(abs(manager.get_lag(player_id) - CLIENT_OFFSET_MS) for player_id in player_ids)
+        print(f"{number_of_players:>8} {response_us:>12.2f} {get_lag_us:>11.2f} {worst_error:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
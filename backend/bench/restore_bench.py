@@ -0,0 +1,84 @@
+# benchmark of loading a game from storage: json blob -> SIGame.restore_from_data, for games of growing length
+# compares blobs with a snapshot of the derived state with blobs saved before snapshots (game_stats replay)
+# run: python -m backend.bench.restore_bench
+import json
+import time
+
+from backend.app.managers.entity import Player
+from backend.app.managers.game import SIGame
+from backend.app.managers.server import SIServerManager
+
+ROUND_COUNTS = [8, 30, 100]
+PLAYERS = 20
+REPEATS = 20
+
+
+class FakeSocket:
+    connected = True
+
+    def send(self, message):
+        pass
+
+
+def create_saved_game(number_of_rounds: int):
+    # plays every question but the last one (one wrong answer and one correct answer each) and returns the saved record
+    saved = dict()
+
+    def save(game_id, user_id, tournament_id, game_data):
+        saved.update(game_id=game_id, id=game_id, host_user_id=user_id, tournament_id=tournament_id,
+                     name=game_data["name"], status=game_data["status"], token=game_data["token"],
+                     data=json.dumps(game_data["data"]))
+
+    server_manager = SIServerManager(game_save_handler=save, game_loader=lambda game_id: None)
+    game = server_manager.create_game(FakeSocket(), host_name="Host", number_of_rounds=number_of_rounds)
+    players = list()
+    for i in range(PLAYERS):
+        player = Player(f"player{i}", game.game_id)
+        server_manager.register_player(player, FakeSocket())
+        players.append(player)
+    for q in range(number_of_rounds * len(game.nominals) - 1):
+        for decision, player in (("decline", players[q % PLAYERS]), ("accept", players[(q + 1) % PLAYERS])):
+            game.responders = [player]
+            game.question_state = game.question_state.answering
+            game.process_host_decision(decision)
+    server_manager.flush_game(game.game_id)
+    server_manager.shutdown()
+    return saved, server_manager
+
+
+def without_snapshot(record: dict):
+    data = json.loads(record["data"])
+    del data["snapshot"]
+    return dict(record, data=json.dumps(data))
+
+
+def load(server_manager, record: dict):
+    # what the game loader and get_game_by_id do: decode the blob, restore the game
+    game_data = dict(record, data=json.loads(record["data"]))
+    game = SIGame(server_manager, game_save_handler=None)
+    game.restore_from_data(game_data)
+    return game
+
+
+def measure_us(fn, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000000
+
+
+def main():
+    # both include decoding the blob (the json us column), which is the same for both formats
+    print(f"{'rounds':>7} {'questions':>10} {'blob bytes':>11} {'json us':>8} {'snapshot us':>12} {'replay us':>10}")
+    for number_of_rounds in ROUND_COUNTS:
+        record, server_manager = create_saved_game(number_of_rounds)
+        legacy_record = without_snapshot(record)
+        snapshot_us = measure_us(load, server_manager, record)
+        replay_us = measure_us(load, server_manager, legacy_record)
+        json_us = measure_us(json.loads, legacy_record["data"])
+        questions = len(json.loads(record["data"])["status"]["game_stats"])
+        print(f"{number_of_rounds:>7} {questions:>10} {len(record['data']):>11} {json_us:>8.1f} {snapshot_us:>12.1f} {replay_us:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# benchmark of SIGame.generate_game_status and of encoding the status, as the number of players grows
+# compares the direct builder with the previous generic path (sort players on every call, then a recursive to_dict pass)
+# run: python -m backend.bench.status_bench
+import json
+import time
+
+from backend.app.managers.entity import Player
+from backend.app.managers.server import SIServerManager
+from backend.app.util.util import encode_message, orjson, to_dict
+
+PLAYER_COUNTS = [10, 100, 1000]
+QUESTIONS_PLAYED = 30
+REPEATS = 50
+
+
+class FakeSocket:
+    connected = True
+
+    def send(self, message):
+        pass
+
+
+def create_game(server_manager: SIServerManager, number_of_players: int):
+    game = server_manager.create_game(FakeSocket(), host_name="Host")
+    players = list()
+    for i in range(number_of_players):
+        player = Player(f"player{i}", game.game_id)
+        server_manager.register_player(player, FakeSocket())
+        players.append(player)
+    # every question is answered by one of the players, so game_stats and round stats grow as in a real game
+    for q in range(QUESTIONS_PLAYED):
+        game.responders = [players[q % number_of_players]]
+        game.question_state = game.question_state.answering
+        game.process_host_decision("accept")
+    return game
+
+
+def generic_status(game):
+    # generate_game_status as it was before the direct builder
+    players = list(game.players.values())
+    players.sort(key=lambda pl: pl.name)
+    status = dict()
+    status['players'] = [dict(name=p.name, player_id=p.player_id, score=p.score) for p in players]
+    status['number_of_rounds'] = game.number_of_rounds
+    status['nominal'] = game.current_nominal
+    status['game_state'] = game.game_state
+    status['question_state'] = game.question_state.name
+    status['responders'] = game.responders
+    status['time_left'] = game.time_left
+    status['finalized'] = 1 if game.finalized else 0
+    status["game_stats"] = game.game_stats
+    status['game_id'] = game.game_id
+    status["game_token"] = game.token
+    status['round_number'] = game.current_round
+    status['nominals'] = game.nominals
+    status['number_of_question_in_round'] = game.number_of_question_in_round
+    status['round_name'] = game.round_names[game.current_round - 1]
+    status['round_names'] = game.round_names
+    status['current_round_stats'] = game._generate_current_round_array()
+    return to_dict(dict(status=status))
+
+
+def encode_with_json(message):
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def measure_us(fn, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000000
+
+
+def main():
+    server_manager = SIServerManager(game_save_handler=lambda **kwargs: None, game_loader=lambda game_id: None)
+    print(f"json encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'players':>8} {'status bytes':>13} {'direct us':>10} {'generic us':>11} {'encode us':>10} {'json.dumps us':>14}")
+    for number_of_players in PLAYER_COUNTS:
+        game = create_game(server_manager, number_of_players)
+        status = game.generate_game_status()
+        assert status == generic_status(game)
+        direct_us = measure_us(game.generate_game_status)
+        generic_us = measure_us(generic_status, game)
+        encode_us = measure_us(encode_message, status)
+        json_us = measure_us(encode_with_json, status)
+        print(f"{number_of_players:>8} {len(encode_message(status)):>13} {direct_us:>10.1f} {generic_us:>11.1f} "
+              f"{encode_us:>10.1f} {json_us:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# benchmark of field lookups in the in-memory storage: declared secondary indexes vs linear scan
+# run: python -m backend.bench.storage_index_bench
+import time
+import uuid
+
+from backend.api.generic_data_provider import GenericDataProvider, STORAGE_INDEXES
+from backend.api.storage_index import IndexedStorage
+
+SIZES = [1000, 10000, 100000, 300000]
+LOOKUPS = 2000
+SCAN_LOOKUPS = 20  # linear scans are slow, keep the sample small
+
+
+def fill(provider: GenericDataProvider, storage: dict, size: int):
+    tokens = []
+    for i in range(size):
+        token = uuid.uuid4().hex
+        tokens.append(token)
+        provider.storage_upsert_one(storage, "users", None, dict(token=token, email=f"user{i}@example.com", name=f"user{i}"))
+        provider.storage_upsert_one(storage, "games", None, dict(token=token[:8], tournament_id="", name=f"game{i}"))
+    return tokens
+
+
+def measure_us(provider: GenericDataProvider, storage: dict, tokens: list, lookups: int):
+    step = max(1, len(tokens) // lookups)
+    sample = tokens[::step][:lookups]
+    start = time.perf_counter()
+    for token in sample:
+        provider.storage_lookup_one_by_field(storage, "users", "token", token)
+        provider.storage_lookup_one_by_field(storage, "games", "token", token[:8])
+    return (time.perf_counter() - start) / (2 * len(sample)) * 1000000
+
+
+def main():
+    provider = GenericDataProvider()
+    print(f"{'records':>10} {'indexed us/lookup':>18} {'scan us/lookup':>16}")
+    for size in SIZES:
+        indexed = IndexedStorage(STORAGE_INDEXES)
+        tokens = fill(provider, indexed, size)
+        plain = {entity: dict(records) for entity, records in indexed.items()}
+        indexed_us = measure_us(provider, indexed, tokens, LOOKUPS)
+        scan_us = measure_us(provider, plain, tokens, SCAN_LOOKUPS)
+        print(f"{size:>10} {indexed_us:>18.2f} {scan_us:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+-- schema used by the local MySQL container (docker-compose.mysql.yml)
+
+CREATE TABLE IF NOT EXISTS users (
+    id VARCHAR(255) NOT NULL UNIQUE, -- Unique string for the user ID
+    email VARCHAR(255) NOT NULL,    -- Email field
+    name VARCHAR(255) NOT NULL,     -- Name field
+    token VARCHAR(255) NOT NULL,    -- Token field
+    ratingid INT DEFAULT 0,         -- Integer field for rating ID
+    PRIMARY KEY (id),               -- Set `id` as the primary key
+    UNIQUE (token)                  -- Ensure token is unique
+);
+
+CREATE TABLE IF NOT EXISTS games (
+    id VARCHAR(255) NOT NULL UNIQUE, -- Unique string for the game ID
+    name VARCHAR(255) NOT NULL,     -- Name field
+    host_user_id VARCHAR(255) NOT NULL,    -- host user id field
+    tournament_id VARCHAR(255) NOT NULL,     -- tournament id field
+    status VARCHAR(255) NOT NULL,    -- status field
+    token VARCHAR(255) NOT NULL,    -- Token field
+    data TEXT CHARACTER SET utf8mb4 NOT NULL,    -- JSON data
+    PRIMARY KEY (id),               -- Set `id` as the primary key
+    INDEX idx_games_token (token)   -- Games are looked up by ID or token
+);
+
+CREATE TABLE IF NOT EXISTS game_questions (
+    id VARCHAR(255) NOT NULL UNIQUE, -- game ID and position of the question in the game
+    game_id VARCHAR(255) NOT NULL,  -- game the question belongs to
+    tournament_id VARCHAR(255) NOT NULL,     -- tournament of the game
+    position INT NOT NULL,          -- index of the entry in game_stats
+    question_number INT NOT NULL,   -- question number field
+    nominal INT NOT NULL,           -- nominal of the question
+    player_stats TEXT CHARACTER SET utf8mb4 NOT NULL,    -- JSON map of player ID -> result
+    PRIMARY KEY (id),
+    INDEX idx_game_questions_game (game_id),
+    INDEX idx_game_questions_tournament (tournament_id)
+);
+
+CREATE TABLE IF NOT EXISTS tournaments (
+    id VARCHAR(255) NOT NULL UNIQUE, -- Unique string for the tournament ID
+    host_user_id VARCHAR(255) NOT NULL,    -- host user id field
+    type VARCHAR(255) NOT NULL,     -- tournament type
+    name VARCHAR(255) NOT NULL,     -- Name field
+    status VARCHAR(255) NOT NULL,   -- status field
+    num_games INT DEFAULT 1,        -- number of games in the tournament
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS players (
+    id VARCHAR(255) NOT NULL UNIQUE, -- Unique string for the player ID
+    game_id VARCHAR(255) NOT NULL,  -- game the player belongs to
+    name VARCHAR(255) NOT NULL,     -- Name field
+    player_user_id VARCHAR(255) NOT NULL,    -- user id of the player (if registered)
+    score INT DEFAULT 0,            -- score field
+    tournament_player_id VARCHAR(255) NOT NULL,    -- tournament player id field
+    player_token VARCHAR(255) NOT NULL,    -- Token field
+    PRIMARY KEY (id)
+);
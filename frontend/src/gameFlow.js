@@ -63,6 +63,10 @@ export const handleLoop = (name, setHostData, setScreen, setGameStatus, screen,
     let currentSocket = null; // Declare currentSocket variable
     let numberOfRetries = 1;
     let gameStartedID = null;
+    // last full game status and its version, status patches from the server are applied on top of it
+    let lastStatus = null;
+    let lastStatusVersion = null;
+    let awaitingFullStatus = false;
 
     const getCurrentSocket = () => {
         return currentSocket;
@@ -90,6 +94,7 @@ export const handleLoop = (name, setHostData, setScreen, setGameStatus, screen,
         socket.onopen = () => {
             console.log("WebSocket connection opened");
             numberOfRetries = 1;
+            awaitingFullStatus = false;
 
             // Send JSON message with action and host_name
             if (screen === "start") {
@@ -130,7 +135,6 @@ export const handleLoop = (name, setHostData, setScreen, setGameStatus, screen,
                 console.log("Message received:", message);
                 let data = message.data;
                 console.log("Data received:", data);
-                data = data.replace(/'/g, '"');
                 data = JSON.parse(data);
 
                 if (screen === "start" || screen === "reconnect") {
@@ -147,8 +151,28 @@ export const handleLoop = (name, setHostData, setScreen, setGameStatus, screen,
                 try {
                     if (data.status) {
                         console.log("setting status", data.status);
+                        if (typeof data.status === "object" && data.version !== undefined) {
+                            lastStatus = data.status;
+                            lastStatusVersion = data.version;
+                            awaitingFullStatus = false;
+                        }
                         setGameStatus(data.status); // Update game status
                     }
+                    if (data.status_patch) {
+                        const patch = data.status_patch;
+                        if (lastStatus && lastStatusVersion === patch.base_version) {
+                            lastStatus = { ...lastStatus, ...patch.changes };
+                            if (patch.game_stats_append?.length) {
+                                lastStatus.game_stats = [...(lastStatus.game_stats || []), ...patch.game_stats_append];
+                            }
+                            lastStatusVersion = patch.version;
+                            setGameStatus(lastStatus);
+                        } else if (!awaitingFullStatus) {
+                            // missed a patch (or no snapshot yet): ask for the full status
+                            awaitingFullStatus = true;
+                            socket.send(JSON.stringify({ action: "get_status", game_id: patch.game_id }));
+                        }
+                    }
                     if (data.action) {
 
                         if (data.action === "offset_check") {